@@ -0,0 +1,40 @@
+"""
+Benchmarks for building layouts and preparing them for solving
+"""
+
+from mpllayout import primitives as pr
+from mpllayout import containers as cn
+
+from .layouts import GRID_SHAPES, AXIS_PRIMS, make_grid_layout
+
+
+class LayoutBuild:
+
+    params = (GRID_SHAPES, AXIS_PRIMS)
+    param_names = ("axes_shape", "axis_prims")
+
+    def time_build_layout(self, axes_shape, axis_prims):
+        make_grid_layout(axes_shape, axis_prims)
+
+
+class LayoutFlatten:
+
+    params = (GRID_SHAPES, AXIS_PRIMS)
+    param_names = ("axes_shape", "axis_prims")
+
+    def setup(self, axes_shape, axis_prims):
+        self.layout = make_grid_layout(axes_shape, axis_prims)
+
+    def time_flat_constraints(self, axes_shape, axis_prims):
+        self.layout.flat_constraints()
+
+    def time_flatten_prim(self, axes_shape, axis_prims):
+        cn.flatten("", self.layout.root_prim)
+
+    def time_filter_unique_values_from_prim(self, axes_shape, axis_prims):
+        pr.filter_unique_values_from_prim(self.layout.root_prim)
+
+    def track_num_constraints(self, axes_shape, axis_prims):
+        return len(self.layout.flat_constraints()[0])
+
+    track_num_constraints.unit = "constraints"
@@ -0,0 +1,46 @@
+"""
+Benchmarks for creating `matplotlib` figures from layouts
+"""
+
+import matplotlib as mpl
+mpl.use("Agg")
+from matplotlib import pyplot as plt
+
+from mpllayout import matplotlibutils as mputils
+from mpllayout import ui
+
+from .layouts import GRID_SHAPES, AXIS_PRIMS, make_grid_prims
+
+
+class UpdateSubplots:
+
+    params = (GRID_SHAPES, AXIS_PRIMS)
+    param_names = ("axes_shape", "axis_prims")
+
+    def setup(self, axes_shape, axis_prims):
+        self.root_prim = make_grid_prims(axes_shape, axis_prims)
+        self.fig, self.axs = mputils.subplots(self.root_prim)
+
+    def teardown(self, axes_shape, axis_prims):
+        plt.close(self.fig)
+
+    def time_subplots(self, axes_shape, axis_prims):
+        fig, _ = mputils.subplots(self.root_prim)
+        plt.close(fig)
+
+    def time_update_subplots(self, axes_shape, axis_prims):
+        mputils.update_subplots(self.root_prim, "Figure", self.fig, self.axs)
+
+
+class FigurePrims:
+
+    params = (GRID_SHAPES, AXIS_PRIMS)
+    param_names = ("axes_shape", "axis_prims")
+
+    def setup(self, axes_shape, axis_prims):
+        self.root_prim = make_grid_prims(axes_shape, axis_prims)
+
+    def time_figure_prims(self, axes_shape, axis_prims):
+        fig, _ = ui.figure_prims(self.root_prim)
+        fig.canvas.draw()
+        plt.close(fig)
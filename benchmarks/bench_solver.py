@@ -0,0 +1,83 @@
+"""
+Benchmarks for solving layouts
+
+Solver benchmarks only run the grid shapes in `NEWTON_GRID_SHAPES` and
+`MINIMIZE_GRID_SHAPES` rather than all of `GRID_SHAPES` because `jax`
+compilation of the global residual dominates for larger grids.
+For example, compiling a 10x10 grid with axis primitives takes over 15
+minutes for the Newton method, and a 5x5 grid with axis primitives takes over
+20 minutes for `method='minimize'`, which is past the benchmark timeout in
+`asv.conf.json`.
+"""
+
+import numpy as np
+
+from mpllayout import solver
+
+from .layouts import AXIS_PRIMS, make_grid_layout
+
+NEWTON_GRID_SHAPES = [(1, 1), (2, 2), (5, 5)]
+MINIMIZE_GRID_SHAPES = [(1, 1), (2, 2)]
+
+
+class SolveNewton:
+
+    params = (NEWTON_GRID_SHAPES, AXIS_PRIMS)
+    param_names = ("axes_shape", "axis_prims")
+
+    # Each solve includes compilation so only solve once per sample
+    number = 1
+    repeat = 1
+    rounds = 1
+
+    def setup(self, axes_shape, axis_prims):
+        self.layout = make_grid_layout(axes_shape, axis_prims)
+
+        # Warm up `jax` so one-off initialization isn't included
+        solver.solve(make_grid_layout((1, 1), False))
+
+    def time_solve(self, axes_shape, axis_prims):
+        solver.solve(self.layout)
+
+    def track_trace_time(self, axes_shape, axis_prims):
+        _, info = solver.solve(self.layout, profile=True)
+        return info["phase_times"]["trace"][0]
+
+    def track_compile_time(self, axes_shape, axis_prims):
+        _, info = solver.solve(self.layout, profile=True)
+        return info["phase_times"]["compile"][0]
+
+    def track_iteration_time(self, axes_shape, axis_prims):
+        _, info = solver.solve(self.layout, profile=True)
+        phase_times = info["phase_times"]
+        return np.mean(
+            np.array(phase_times["residual"])
+            + np.array(phase_times["jacobian"])
+            + np.array(phase_times["lstsq"])
+        )
+
+    def track_num_iterations(self, axes_shape, axis_prims):
+        _, info = solver.solve(self.layout)
+        return len(info["abs_errs"])
+
+    track_trace_time.unit = "seconds"
+    track_compile_time.unit = "seconds"
+    track_iteration_time.unit = "seconds"
+    track_num_iterations.unit = "iterations"
+
+
+class SolveMinimize:
+
+    params = (MINIMIZE_GRID_SHAPES, AXIS_PRIMS)
+    param_names = ("axes_shape", "axis_prims")
+
+    number = 1
+    repeat = 1
+    rounds = 1
+
+    def setup(self, axes_shape, axis_prims):
+        self.layout = make_grid_layout(axes_shape, axis_prims)
+        solver.solve(make_grid_layout((1, 1), False), method='minimize')
+
+    def time_solve(self, axes_shape, axis_prims):
+        solver.solve(self.layout, method='minimize', max_iter=100)
@@ -0,0 +1,173 @@
+"""
+Layouts used in benchmarks
+"""
+
+import numpy as np
+
+from mpllayout import layout as lay
+from mpllayout import primitives as pr
+from mpllayout import containers as cn
+from mpllayout import constraints as co
+
+# Grid shapes of axes (rows, columns)
+GRID_SHAPES = [(1, 1), (5, 5), (10, 10), (20, 20), (50, 50)]
+
+# Whether axes have x/y axis and axis label primitives
+AXIS_PRIMS = [False, True]
+
+# Axes dimensions, spacing between axes and figure margins (left, bottom,
+# right, top)
+AXES_SIZE = 1.5
+AXES_SPACING = 0.5
+FIG_MARGINS = (0.5, 0.5, 0.25, 0.25)
+
+
+def make_grid_layout(
+    axes_shape: tuple[int, int] = (3, 3), axis_prims: bool = False
+) -> lay.Layout:
+    """
+    Return a layout of a figure with a grid of axes
+
+    Parameters
+    ----------
+    axes_shape: tuple[int, int]
+        The number of axes rows and columns
+    axis_prims: bool
+        Whether axes have x/y axis and axis label primitives
+
+        If `True`, the x and y axes are boxes with fixed thicknesses positioned
+        at the bottom and left of each axes.
+    """
+    layout = lay.Layout()
+
+    ## Create the figure box
+    layout.add_prim(pr.Quadrilateral(), "Figure")
+    layout.add_constraint(co.Box(), ("Figure",), ())
+    layout.add_constraint(co.Fix(), ("Figure/Line0/Point0",), (np.array([0, 0]),))
+
+    ## Create the axes boxes
+    num_row, num_col = axes_shape
+    num_axes = num_row*num_col
+    for n in range(num_axes):
+        layout.add_prim(pr.Axes(xaxis=axis_prims, yaxis=axis_prims), f"Axes{n}")
+        layout.add_constraint(co.Box(), (f"Axes{n}/Frame",), ())
+
+        if axis_prims:
+            for key in ("XAxis", "YAxis"):
+                layout.add_constraint(co.Box(), (f"Axes{n}/{key}",), ())
+            layout.add_constraint(co.PositionXAxis(side="bottom"), (f"Axes{n}",), ())
+            layout.add_constraint(co.PositionYAxis(side="left"), (f"Axes{n}",), ())
+            layout.add_constraint(co.XAxisThickness(), (f"Axes{n}/XAxis",), (0.2,))
+            layout.add_constraint(co.YAxisThickness(), (f"Axes{n}/YAxis",), (0.2,))
+            layout.add_constraint(
+                co.PositionXAxisLabel(), (f"Axes{n}",), (0.5,)
+            )
+            layout.add_constraint(
+                co.PositionYAxisLabel(), (f"Axes{n}",), (0.5,)
+            )
+
+    ## Constrain the axes in a grid
+    # Grid margins are measured from each column/row to the last column/row
+    # (see `constructions.transform_map`)
+    def grid_margins(num):
+        return [
+            (num-1-n)*(AXES_SIZE + AXES_SPACING) - AXES_SIZE
+            for n in range(num-1)
+        ]
+
+    layout.add_constraint(
+        co.Grid(axes_shape),
+        tuple(f"Axes{n}/Frame" for n in range(num_axes)),
+        (
+            (num_col - 1) * [1],
+            (num_row - 1) * [1],
+            grid_margins(num_col),
+            grid_margins(num_row),
+        )
+    )
+    layout.add_constraint(co.Width(), ("Axes0/Frame",), (AXES_SIZE,))
+    layout.add_constraint(co.Height(), ("Axes0/Frame",), (AXES_SIZE,))
+
+    ## Constrain the grid margins
+    margin_left, margin_bottom, margin_right, margin_top = FIG_MARGINS
+    layout.add_constraint(
+        co.InnerMargin(side="left"), ("Axes0/Frame", "Figure"), (margin_left,)
+    )
+    layout.add_constraint(
+        co.InnerMargin(side="top"), ("Axes0/Frame", "Figure"), (margin_top,)
+    )
+    layout.add_constraint(
+        co.InnerMargin(side="bottom"),
+        (f"Axes{num_axes-1}/Frame", "Figure"),
+        (margin_bottom,)
+    )
+    layout.add_constraint(
+        co.InnerMargin(side="right"),
+        (f"Axes{num_axes-1}/Frame", "Figure"),
+        (margin_right,)
+    )
+    return layout
+
+def make_grid_prims(
+    axes_shape: tuple[int, int] = (3, 3), axis_prims: bool = False
+) -> pr.PrimitiveNode:
+    """
+    Return primitives for `make_grid_layout` placed at their solved positions
+
+    Primitive values are set directly (without solving) so large grids can be
+    used in rendering benchmarks.
+    """
+    root_prim = make_grid_layout(axes_shape, axis_prims).root_prim
+
+    # Default primitive values can be integer arrays so copy them to floats
+    prim_graph, prim_values = pr.filter_unique_values_from_prim(root_prim)
+    root_prim = pr.build_prim_from_unique_values(
+        cn.flatten("", root_prim),
+        prim_graph,
+        [np.array(value, dtype=float) for value in prim_values]
+    )
+
+    num_row, num_col = axes_shape
+    fig_width, fig_height = grid_figure_size(axes_shape)
+    set_box(root_prim["Figure"], 0, 0, fig_width, fig_height)
+
+    margin_left, margin_bottom, margin_right, margin_top = FIG_MARGINS
+    width = height = AXES_SIZE
+    for n in range(num_row*num_col):
+        row, col = divmod(n, num_col)
+        x0 = margin_left + col*(width + AXES_SPACING)
+        y1 = fig_height - margin_top - row*(height + AXES_SPACING)
+        y0 = y1 - height
+        axes = root_prim[f"Axes{n}"]
+        set_box(axes["Frame"], x0, y0, x0+width, y1)
+
+        if axis_prims:
+            set_box(axes["XAxis"], x0, y0-0.2, x0+width, y0)
+            set_box(axes["YAxis"], x0-0.2, y0, x0, y1)
+            axes["XAxisLabel"].value[:] = (x0 + 0.5*width, y0 - 0.2)
+            axes["YAxisLabel"].value[:] = (x0 - 0.2, y0 + 0.5*height)
+    return root_prim
+
+def grid_figure_size(axes_shape: tuple[int, int]) -> tuple[float, float]:
+    """
+    Return the figure width and height for `make_grid_layout`
+    """
+    num_row, num_col = axes_shape
+    margin_left, margin_bottom, margin_right, margin_top = FIG_MARGINS
+    width = (
+        margin_left + margin_right
+        + num_col*AXES_SIZE + (num_col-1)*AXES_SPACING
+    )
+    height = (
+        margin_bottom + margin_top
+        + num_row*AXES_SIZE + (num_row-1)*AXES_SPACING
+    )
+    return width, height
+
+def set_box(quad: pr.Quadrilateral, x0: float, y0: float, x1: float, y1: float):
+    """
+    Set quadrilateral vertices to a box
+    """
+    coords = [(x0, y0), (x1, y0), (x1, y1), (x0, y1)]
+    for n, coord in enumerate(coords):
+        quad[f"Line{n}/Point0"].value[:] = coord
@@ -0,0 +1,281 @@
+"""
+Scaling curves for layout stages
+
+This sweeps the size of grid layouts (see `make_grid_layout`), measures the
+time and peak memory of each stage and fits an empirical complexity exponent
+`p` so that the cost of a stage grows like `n**p` with the number of axes `n`.
+Layouts with axis primitives (`--axis-prims`) have deeper primitive trees
+and more constraints per axes.
+
+Stages that should be linear fail if their fitted exponent exceeds
+`MAX_EXPONENT` so that quadratic behaviour (for example, slicing lists while
+unflattening trees) is caught.
+
+Run this as a module from the repository root:
+
+    python -m benchmarks.scaling [--axis-prims] [--json PATH]
+
+The exit status is 1 if any stage fails.
+"""
+
+from typing import Any, Callable, Optional
+from numpy.typing import NDArray
+
+import sys
+import json
+import timeit
+import argparse
+import tracemalloc
+
+import numpy as np
+
+from mpllayout import primitives as pr
+from mpllayout import containers as cn
+from mpllayout import solver
+
+from .layouts import make_grid_layout
+
+# Grid shapes of axes (rows, columns) to sweep
+SCALING_SHAPES = [(2, 2), (4, 4), (6, 6), (8, 8), (12, 12), (16, 16)]
+
+# The maximum allowed exponent for stages that should be linear
+# This is halfway between linear (1) and quadratic (2) scaling.
+MAX_EXPONENT = 1.5
+
+# A stage is called with the inputs returned by its setup function
+StageSetup = Callable[[tuple[int, int], bool], tuple[Any, ...]]
+Stage = Callable[..., Any]
+
+
+## Stages
+
+def setup_layout(axes_shape: tuple[int, int], axis_prims: bool):
+    return (make_grid_layout(axes_shape, axis_prims),)
+
+def setup_flat_prim(axes_shape: tuple[int, int], axis_prims: bool):
+    layout = make_grid_layout(axes_shape, axis_prims)
+    return (cn.flatten("", layout.root_prim),)
+
+def setup_unique_values(axes_shape: tuple[int, int], axis_prims: bool):
+    layout = make_grid_layout(axes_shape, axis_prims)
+    prim_graph, prim_values = pr.filter_unique_values_from_prim(layout.root_prim)
+    return (cn.flatten("", layout.root_prim), prim_graph, prim_values)
+
+def setup_residual(axes_shape: tuple[int, int], axis_prims: bool):
+    layout = make_grid_layout(axes_shape, axis_prims)
+    return (layout.root_prim, *layout.flat_constraints())
+
+# Stage names mapped to a setup function and the timed stage function
+STAGES: dict[str, tuple[StageSetup, Stage]] = {
+    "build_layout": (
+        lambda axes_shape, axis_prims: (axes_shape, axis_prims),
+        make_grid_layout
+    ),
+    "flatten": (
+        setup_layout,
+        lambda layout: cn.flatten("", layout.root_prim)
+    ),
+    "unflatten": (setup_flat_prim, cn.unflatten),
+    "filter_unique_values": (
+        setup_layout,
+        lambda layout: pr.filter_unique_values_from_prim(layout.root_prim)
+    ),
+    "build_prim_from_unique_values": (
+        setup_unique_values, pr.build_prim_from_unique_values
+    ),
+    "flat_constraints": (
+        setup_layout,
+        lambda layout: layout.flat_constraints()
+    ),
+    "residual": (setup_residual, solver.assem_constraint_residual),
+}
+
+
+## Measurements
+
+def measure_time(stage: Stage, *args, repeat: int = 3) -> float:
+    """
+    Return the minimum time (in seconds) of a stage call
+
+    The stage is called enough times per sample to take at least 0.2 s (see
+    `timeit.Timer.autorange`).
+    """
+    timer = timeit.Timer(lambda: stage(*args))
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+def measure_peak_memory(stage: Stage, *args) -> int:
+    """
+    Return the peak memory (in bytes) allocated by a stage call
+
+    Only memory allocated by python is measured (see `tracemalloc`).
+    """
+    # Call the stage once so one-off allocations (imports, caches) are excluded
+    stage(*args)
+
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        base_size, _ = tracemalloc.get_traced_memory()
+        stage(*args)
+        _, peak_size = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak_size - base_size
+
+def fit_exponent(sizes: NDArray, costs: NDArray) -> float:
+    """
+    Return the exponent `p` of a power-law fit `costs ~ sizes**p`
+
+    The exponent is the slope of a least-squares line through
+    `(log(sizes), log(costs))`.
+    Non-positive costs (for example, no memory allocated) are ignored.
+    """
+    sizes, costs = np.asarray(sizes, dtype=float), np.asarray(costs, dtype=float)
+    is_positive = costs > 0
+    if np.sum(is_positive) < 2:
+        return np.nan
+
+    slope, _ = np.polyfit(np.log(sizes[is_positive]), np.log(costs[is_positive]), 1)
+    return float(slope)
+
+
+## Scaling sweeps
+
+ScalingResult = dict[str, Any]
+
+def measure_scaling(
+    axes_shapes: list[tuple[int, int]] = SCALING_SHAPES,
+    axis_prims: bool = False,
+    stages: Optional[list[str]] = None,
+    max_exponent: float = MAX_EXPONENT,
+    repeat: int = 3
+) -> list[ScalingResult]:
+    """
+    Return scaling curves and fitted complexity exponents for layout stages
+
+    Parameters
+    ----------
+    axes_shapes: list[tuple[int, int]]
+        Grid shapes of axes to sweep
+    axis_prims: bool
+        Whether axes have x/y axis and axis label primitives
+    stages: Optional[list[str]]
+        Names of stages in `STAGES` to measure
+
+        All stages are measured by default.
+    max_exponent: float
+        The maximum allowed time and memory exponent
+    repeat: int
+        The number of timing samples for each size
+
+    Returns
+    -------
+    list[ScalingResult]
+        Results for each stage
+
+        Each result is a dictionary with keys:
+            'stage': the stage name,
+            'sizes': the number of axes for each grid shape,
+            'num_constraints', 'tree_depth': the number of flat constraints
+                and the primitive tree height for each grid shape,
+            'times', 'peak_memory': stage times (in seconds) and peak python
+                memory (in bytes) for each grid shape,
+            'time_exponent', 'memory_exponent': fitted complexity exponents,
+            'passed': whether both exponents are at most `max_exponent`.
+    """
+    if stages is None:
+        stages = list(STAGES.keys())
+
+    layouts = [make_grid_layout(shape, axis_prims) for shape in axes_shapes]
+    sizes = [int(np.prod(shape)) for shape in axes_shapes]
+    num_constraints = [len(layout.flat_constraints()[0]) for layout in layouts]
+    tree_depths = [layout.root_prim.node_height() for layout in layouts]
+
+    results = []
+    for stage_name in stages:
+        setup, stage = STAGES[stage_name]
+        times = []
+        peak_memory = []
+        for shape in axes_shapes:
+            args = setup(shape, axis_prims)
+            times.append(measure_time(stage, *args, repeat=repeat))
+            peak_memory.append(measure_peak_memory(stage, *args))
+
+        time_exponent = fit_exponent(sizes, times)
+        memory_exponent = fit_exponent(sizes, peak_memory)
+        passed = all(
+            np.isnan(exponent) or exponent <= max_exponent
+            for exponent in (time_exponent, memory_exponent)
+        )
+        results.append({
+            "stage": stage_name,
+            "sizes": sizes,
+            "num_constraints": num_constraints,
+            "tree_depth": tree_depths,
+            "times": times,
+            "peak_memory": peak_memory,
+            "time_exponent": time_exponent,
+            "memory_exponent": memory_exponent,
+            "passed": passed
+        })
+    return results
+
+def format_results(results: list[ScalingResult]) -> str:
+    """
+    Return a text table of scaling results
+    """
+    header = (
+        f"{'stage':<32} {'time exp.':>9} {'mem. exp.':>9} "
+        f"{'max time [s]':>12} {'max peak [B]':>12}  status"
+    )
+    lines = [header, "-"*len(header)]
+    for result in results:
+        status = "ok" if result["passed"] else "FAIL"
+        lines.append(
+            f"{result['stage']:<32} {result['time_exponent']:>9.2f} "
+            f"{result['memory_exponent']:>9.2f} {result['times'][-1]:>12.3e} "
+            f"{result['peak_memory'][-1]:>12d}  {status}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--axis-prims", action="store_true",
+        help="use axes with x/y axis primitives (deeper primitive trees)"
+    )
+    parser.add_argument(
+        "--stages", nargs="+", choices=list(STAGES.keys()), default=None,
+        help="stages to measure (default: all)"
+    )
+    parser.add_argument(
+        "--max-axes", type=int, default=None,
+        help="skip grids with more than this number of axes"
+    )
+    parser.add_argument(
+        "--max-exponent", type=float, default=MAX_EXPONENT,
+        help="the maximum allowed complexity exponent"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--json", type=str, default=None,
+        help="a path to write results to as JSON"
+    )
+    args = parser.parse_args()
+
+    axes_shapes = [
+        shape for shape in SCALING_SHAPES
+        if args.max_axes is None or np.prod(shape) <= args.max_axes
+    ]
+    results = measure_scaling(
+        axes_shapes, args.axis_prims, args.stages, args.max_exponent, args.repeat
+    )
+    print(format_results(results))
+
+    if args.json is not None:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+    sys.exit(0 if all(result["passed"] for result in results) else 1)
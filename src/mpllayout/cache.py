@@ -0,0 +1,352 @@
+"""
+Content-addressed cache of solved layouts
+
+Many figures are made from the same layout template with the same
+parameters.
+A `SolutionCache` stores solved primitive trees by a fingerprint of the layout
+(see `fingerprint`) so that repeat solves skip both `jax` compilation and
+solver iterations.
+"""
+
+from typing import Any, Optional
+from numpy.typing import NDArray
+
+import os
+import hashlib
+import collections
+
+import numpy as np
+
+from . import primitives as pr
+from . import containers as cn
+from . import layout as lay
+from . import solver
+from . import serialization as se
+
+
+## Layout fingerprints
+
+def update_hash(hasher: "hashlib._Hash", obj: Any):
+    """
+    Update a hash object with a python object
+
+    Containers (tuples, lists and dicts) are hashed recursively, arrays are
+    hashed by dtype, shape and data, and classes by their path.
+    Any other object is hashed by its `repr` if it's a basic python type or
+    otherwise by its class path only.
+
+    Parameters
+    ----------
+    hasher: hashlib._Hash
+        The hash object
+    obj: Any
+        The object to hash
+    """
+    def update_tagged(tag: str, data: bytes):
+        hasher.update(f"{tag}{len(data)}:".encode())
+        hasher.update(data)
+
+    if isinstance(obj, (tuple, list)):
+        update_tagged(type(obj).__name__, str(len(obj)).encode())
+        for item in obj:
+            update_hash(hasher, item)
+    elif isinstance(obj, dict):
+        update_tagged("dict", str(len(obj)).encode())
+        for key, value in obj.items():
+            update_hash(hasher, key)
+            update_hash(hasher, value)
+    elif isinstance(obj, (str, int, float, bool, complex, type(None), np.generic)):
+        update_tagged(type(obj).__name__, repr(obj).encode())
+    elif isinstance(obj, np.ndarray) or hasattr(obj, "__array__"):
+        array = np.asarray(obj)
+        update_tagged("array", f"{array.dtype.str}{array.shape}".encode())
+        hasher.update(np.ascontiguousarray(array).tobytes())
+    elif isinstance(obj, type):
+        update_tagged("type", se.class_path(obj).encode())
+    else:
+        # Objects like `matplotlib` axes (see `cr.AxisThickness`) are only
+        # used to derive numeric parameters of child constraints.
+        # Child parameters are hashed so the object itself is ignored.
+        update_tagged("object", se.class_path(type(obj)).encode())
+
+def fingerprint(layout: lay.Layout, **solve_kwargs) -> str:
+    """
+    Return a fingerprint of a layout and solver options
+
+    Two layouts with the same fingerprint have the same solution.
+    The fingerprint depends on:
+        the primitive tree structure and initial primitive values,
+        the constraint tree structure and construction functions
+        (see `ConstructionNode.assem_identity`),
+        primitive keys and parameters for every constraint,
+        and `solve_kwargs`.
+
+    Parameters
+    ----------
+    layout: lay.Layout
+        The layout
+    **solve_kwargs
+        Keyword arguments for `solver.solve`
+
+    Returns
+    -------
+    str
+        A hexadecimal digest
+    """
+    hasher = hashlib.blake2b(digest_size=20)
+
+    for key, array in se.encode_prim(layout.root_prim).items():
+        update_hash(hasher, (key, array))
+
+    # The `[1:]` removes the 'root' constraint which is just a container
+    flat_constraints = zip(
+        list(cn.iter_flat("", layout.root_constraint))[1:],
+        list(cn.iter_flat("", layout.root_prim_keys))[1:],
+        list(cn.iter_flat("", layout.root_param))[1:],
+    )
+    for (key, constraint), (_, prim_keys), (_, params) in flat_constraints:
+        update_hash(
+            hasher,
+            (
+                key,
+                constraint.assem_identity(),
+                tuple(constraint.signature),
+                prim_keys.value,
+                params.value
+            )
+        )
+
+    update_hash(hasher, dict(sorted(solve_kwargs.items())))
+    return hasher.hexdigest()
+
+
+## Solution cache
+
+Solution = tuple[pr.PrimitiveNode, solver.SolverInfo]
+
+# `solver.solve` options that don't change the solution
+UNHASHED_SOLVE_KWARGS = (
+    "profile", "hooks", "profile_memory", "count_live_nodes", "num_workers",
+    "jac_chunk_size", "jac_memory_budget", "jac_sparse"
+)
+
+def encode_info(info: solver.SolverInfo, prefix: str = "info_") -> dict[str, NDArray]:
+    """
+    Return arrays representing numeric entries of solver information
+
+    Nested dictionaries (for example, 'presolve' and 'phase_times') are stored
+    with '/' separated keys. Entries that can't be stored as numeric arrays
+    (for example, 'near_duplicate_constraints' keys and `matplotlib` objects)
+    are dropped, so they're missing from solutions loaded from disk.
+    """
+    arrays = {}
+    for key, value in info.items():
+        if isinstance(value, dict):
+            arrays.update(encode_info(value, prefix=f"{prefix}{key}/"))
+            continue
+
+        try:
+            array = np.asarray(value)
+        except ValueError:
+            continue
+        if array.dtype.kind in "biuf":
+            arrays[f"{prefix}{key}"] = array
+    return arrays
+
+def decode_info(arrays: dict[str, NDArray]) -> solver.SolverInfo:
+    """
+    Return solver information from its array representation
+
+    See `encode_info` for entries that aren't stored.
+    """
+    info = {}
+    for key, array in arrays.items():
+        if not key.startswith("info_"):
+            continue
+
+        *parent_keys, child_key = key[len("info_"):].split("/")
+        parent = info
+        for parent_key in parent_keys:
+            parent = parent.setdefault(parent_key, {})
+        parent[child_key] = array.tolist()
+    return info
+
+
+class SolutionCache:
+    """
+    A least-recently-used cache of solved layouts with an optional disk tier
+
+    Parameters
+    ----------
+    max_size: int
+        The maximum number of solutions stored in memory
+    cache_dir: Optional[str | os.PathLike]
+        A directory to store solutions in
+
+        If supplied, solutions evicted from memory (and solutions from other
+        processes) can be loaded from this directory.
+
+    Attributes
+    ----------
+    hits: int
+        The number of solves found in the cache (memory or disk)
+    disk_hits: int
+        The number of solves found in the disk cache
+    misses: int
+        The number of solves not found in the cache
+
+    Notes
+    -----
+    Cached primitive trees are shared between hits and shouldn't be modified.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 128,
+        cache_dir: Optional[str | os.PathLike] = None
+    ):
+        self._max_size = max_size
+        self._cache_dir = cache_dir
+        self._solutions: collections.OrderedDict[str, Solution] = (
+            collections.OrderedDict()
+        )
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._solutions)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._solutions or os.path.isfile(self._disk_path(key))
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """
+        Return cache hit/miss counts and the number of solutions in memory
+        """
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "size": len(self)
+        }
+
+    def _disk_path(self, key: str) -> str:
+        if self._cache_dir is None:
+            return ""
+        return os.path.join(self._cache_dir, f"{key}.npz")
+
+    def get(self, key: str) -> Optional[Solution]:
+        """
+        Return a cached solution (or `None` if there isn't one)
+
+        Parameters
+        ----------
+        key: str
+            The layout fingerprint (see `fingerprint`)
+        """
+        if key in self._solutions:
+            self._solutions.move_to_end(key)
+            return self._solutions[key]
+
+        path = self._disk_path(key)
+        if os.path.isfile(path):
+            with np.load(path, allow_pickle=False) as arrays:
+                se.validate_version(arrays)
+                arrays = dict(arrays)
+            solution = (se.decode_prim(arrays), decode_info(arrays))
+            self.disk_hits += 1
+            self._put_memory(key, solution)
+            return solution
+
+        return None
+
+    def put(self, key: str, root_prim: pr.PrimitiveNode, info: solver.SolverInfo):
+        """
+        Store a solution
+
+        Parameters
+        ----------
+        key: str
+            The layout fingerprint (see `fingerprint`)
+        root_prim: pr.PrimitiveNode
+            The solved primitive tree
+        info: solver.SolverInfo
+            The solver information
+        """
+        self._put_memory(key, (root_prim, info))
+
+        path = self._disk_path(key)
+        if path != "":
+            # Write to a temporary file first so that concurrent readers never
+            # see partially written files
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as file:
+                np.savez(
+                    file,
+                    format_version=se.FORMAT_VERSION,
+                    **se.encode_prim(root_prim),
+                    **encode_info(info)
+                )
+            os.replace(tmp_path, path)
+
+    def _put_memory(self, key: str, solution: Solution):
+        self._solutions[key] = solution
+        self._solutions.move_to_end(key)
+        while len(self._solutions) > self._max_size:
+            self._solutions.popitem(last=False)
+
+    def clear(self):
+        """
+        Remove all solutions from memory
+
+        Solutions stored on disk are not removed.
+        """
+        self._solutions.clear()
+
+    def solve(
+        self,
+        layout: lay.Layout,
+        abs_tol: float = 1e-10,
+        rel_tol: float = 1e-7,
+        max_iter: int = 10,
+        method: str = 'newton',
+        **solve_kwargs
+    ) -> Solution:
+        """
+        Return a solved layout from the cache or `solver.solve`
+
+        Parameters and returns match `solver.solve`.
+
+        Options that don't change the solution (see `UNHASHED_SOLVE_KWARGS`)
+        aren't part of the fingerprint. Profiling options and hooks only apply
+        to cache misses; cache hits return the stored solver information.
+        """
+        solve_kwargs = {
+            "abs_tol": abs_tol,
+            "rel_tol": rel_tol,
+            "max_iter": max_iter,
+            "method": method,
+            **solve_kwargs
+        }
+        key = fingerprint(
+            layout,
+            **{
+                name: value for name, value in solve_kwargs.items()
+                if name not in UNHASHED_SOLVE_KWARGS
+            }
+        )
+
+        solution = self.get(key)
+        if solution is None:
+            self.misses += 1
+            solution = solver.solve(layout, **solve_kwargs)
+            self.put(key, *solution)
+        else:
+            self.hits += 1
+        return solution
@@ -2,18 +2,24 @@
 Geometric constraints
 """
 
-from typing import Optional, Any, Literal
-from matplotlib.axis import XAxis, YAxis
+from typing import Optional, Any, Literal, Union, TYPE_CHECKING
 from numpy.typing import NDArray
 
 import itertools
 
 import numpy as np
-import jax.numpy as jnp
 
+from . import lazy
 from . import primitives as pr
 from . import constructions as con
 
+if TYPE_CHECKING:
+    from matplotlib.axis import XAxis, YAxis
+    from matplotlib.backend_bases import RendererBase
+
+jnp = lazy.LazyModule("jax.numpy")
+maxis = lazy.LazyModule("matplotlib.axis")
+
 PrimKeys = con.PrimKeys
 Params = con.Params
 
@@ -635,13 +641,38 @@ class AspectRatio(con.ConstructionNode):
         return con.transform_constraint(con.AspectRatio())
 
 
-def get_axis_thickness(axis: XAxis | YAxis, side: str):
+def get_axis_thickness(
+    axis: "XAxis | YAxis", side: str, renderer: Optional["RendererBase"] = None
+):
+    """
+    Return the thickness of a `matplotlib` axis (in inches)
 
+    The thickness is the size of the axis bounding box (ticks and tick labels)
+    perpendicular to the axes side, excluding the axis label.
+
+    Parameters
+    ----------
+    axis: XAxis | YAxis
+        The axis
+    side: str
+        The axis side
+    renderer: Optional[RendererBase]
+        The renderer used to measure text
+
+        Passing the same renderer when measuring many axes avoids getting a
+        renderer for each axis.
+        If not supplied, the figure's renderer is used.
+
+    Returns
+    -------
+    float
+        The thickness
+    """
     # Ignore the axis label in the height by temporarily making it invisible
     label_visibility = axis.label.get_visible()
     axis.label.set_visible(False)
 
-    axis_bbox = axis.get_tightbbox()
+    axis_bbox = axis.get_tightbbox(renderer)
 
     if axis_bbox is None:
         dim = 0
@@ -682,16 +713,45 @@ class AxisThickness(
 
     Methods
     -------
-    assem(prims: tuple[pr.Quadrilateral], mpl_axis: XAxis | YAxis)
+    assem(prims: tuple[pr.Quadrilateral], mpl_axis: XAxis | YAxis | float | None)
+        `mpl_axis` can be a `matplotlib` axis, a known thickness, or `None`
+
+        The thickness is found from `mpl_axis` with `thickness`.
     """
 
     def __init__(self, axis: Literal['x', 'y'] = 'x'):
         super().__init__(axis=axis)
 
     @staticmethod
-    def get_axis_thickness(mpl_axis: XAxis | YAxis):
+    def get_axis_thickness(mpl_axis: "XAxis | YAxis"):
         return get_axis_thickness(mpl_axis, mpl_axis.get_ticks_position())
 
+    @classmethod
+    def thickness(cls, mpl_axis: "XAxis | YAxis | float | None") -> float:
+        """
+        Return the thickness for an axis thickness parameter
+
+        Parameters
+        ----------
+        mpl_axis: XAxis | YAxis | float | None
+            A `matplotlib` axis, a known thickness, or `None`
+
+            If `mpl_axis` is an axis, the thickness is measured from it (see
+            `get_axis_thickness`).
+            If `mpl_axis` is `None`, the thickness is 0.
+
+        Returns
+        -------
+        float
+            The axis thickness
+        """
+        if mpl_axis is None:
+            return 0
+        elif isinstance(mpl_axis, (float, int, np.number)):
+            return mpl_axis
+        else:
+            return cls.get_axis_thickness(mpl_axis)
+
     @classmethod
     def init_children(cls, axis: Literal['x', 'y'] = 'x'):
         keys = ("Height",)
@@ -703,23 +763,23 @@ class AxisThickness(
             prim_keys = (("arg0/Line0",),)
 
         def child_params(params: Params) -> tuple[Params, ...]:
-            mpl_axis: XAxis | YAxis | None = params[0]
-            if mpl_axis is None:
-                return ((0,),)
-            else:
-                return ((cls.get_axis_thickness(mpl_axis),),)
+            return ((cls.thickness(params[0]),),)
 
         return keys, constraints, prim_keys, child_params
 
     @classmethod
     def init_signature(cls, axis: Literal['x', 'y'] = 'x'):
         if axis == 'x':
-            return cls.make_signature(0, (XAxis,))
+            return cls.make_signature(0, (Union[maxis.XAxis, float, None],))
         else:
-            return cls.make_signature(0, (YAxis,))
+            return cls.make_signature(0, (Union[maxis.YAxis, float, None],))
 
     @classmethod
-    def assem(cls, prims: tuple[pr.Quadrilateral], mpl_axis: XAxis):
+    def assem(
+        cls,
+        prims: tuple[pr.Quadrilateral],
+        mpl_axis: "XAxis | YAxis | float | None"
+    ):
         return super().assem(prims, mpl_axis)
 
 
@@ -13,12 +13,13 @@ from numpy.typing import NDArray
 import itertools
 
 import numpy as np
-import jax.numpy as jnp
 
+from . import lazy
 from . import primitives as pr
 from .containers import Node, iter_flat, flatten, unflatten
 from .containers import map as node_map, accumulate as node_accumulate
 
+jnp = lazy.LazyModule("jax.numpy")
 
 Param = float | int | NDArray | bool
 Params = tuple[Param, ...]
@@ -418,6 +419,24 @@ class ConstructionNode(Node[ConstructionValue]):
         # so there is some overlap.
         raise NotImplementedError()
 
+    @classmethod
+    def assem_identity(cls) -> tuple:
+        """
+        Return a hashable description of the (local) construction function
+
+        Two constructions with equal identities have the same `assem` function.
+        Constructions defined by a class are identified by the class path.
+        Constructions created by transforms (`transform_sum`, etc.) have
+        dynamically generated classes so these are identified by the transform
+        and its input constructions.
+
+        Returns
+        -------
+        tuple
+            The identity
+        """
+        return (cls.__module__, cls.__qualname__)
+
     ## Special methods
 
     def __neg__(self):
@@ -1418,6 +1437,16 @@ def concatenate_construction_inputs(
     return cat_sig, helper_prims, helper_params
 
 
+def split_sizes(signature: ConstructionSignature) -> tuple[int, int]:
+    """
+    Return the number of primitives and parameters in a signature
+
+    This determines how concatenated construction inputs are split (see
+    `concatenate_construction_inputs`).
+    """
+    return (len(signature.prim_types), len(signature.param_types))
+
+
 def concatenate_signature(
     sig_a: ConstructionSignature, sig_b: ConstructionSignature, value_size: int
 ) -> ConstructionSignature:
@@ -1586,6 +1615,10 @@ def transform_map(
         def assem(cls, prims, *map_params):
             return np.array(())
 
+        @classmethod
+        def assem_identity(cls):
+            return ("Map", construction.assem_identity())
+
     MapConstruction.__name__ = f"Map{type(construction).__name__}"
 
     return MapConstruction()
@@ -1645,6 +1678,13 @@ def transform_sum(cons_a: TCons, cons_b: TCons) -> ConstructionNode:
                 params_a, params_b = split_params(sum_params)
                 return cons_a.assem(prims_a, *params_a) + cons_b.assem(prims_b, *params_b)
 
+            @classmethod
+            def assem_identity(cls):
+                return (
+                    "Sum", cons_a.assem_identity(), cons_b.assem_identity(),
+                    split_sizes(signature_a)
+                )
+
         return SumConstruction, node_value, sum_child_keys
 
     flat_a = [a for a in iter_flat("", cons_a)]
@@ -1694,6 +1734,13 @@ def transform_scalar_mul(
                     * cons_a.assem(prims_a, *params_a)
                 )
 
+            @classmethod
+            def assem_identity(cls):
+                return (
+                    "ScalarMultiple", cons_a.assem_identity(),
+                    cons_b.assem_identity(), split_sizes(signature_a)
+                )
+
         def mul_child_params(params: Params) -> tuple[Params, ...]:
             params_a, params_b = split_params(params)
             return tuple(
@@ -1767,6 +1814,13 @@ def transform_scalar_pow(
                     cons_a.assem(prims_a, *params_a) ** cons_b.assem(prims_b, *params_b)
                 )
 
+            @classmethod
+            def assem_identity(cls):
+                return (
+                    "ScalarPower", cons_a.assem_identity(),
+                    cons_b.assem_identity(), split_sizes(signature_a)
+                )
+
         def mul_child_params(params: Params) -> tuple[Params, ...]:
             params_a, params_b = split_params(params)
             return tuple(
@@ -1833,5 +1887,9 @@ def transform_partial(cons: TCons, *freeze_params: tuple[Param, ...]):
             params = partial_params + freeze_params
             return cons.assem(prims, *params)
 
+        @classmethod
+        def assem_identity(cls):
+            return ("Partial", cons.assem_identity(), freeze_params)
+
     return Partial()
 
@@ -10,7 +10,7 @@ from typing import TypeVar, Generic, Any, Iterable, Callable
 import itertools
 import functools
 
-import jax
+from . import lazy
 
 TValue = TypeVar("TValue")
 TNode = TypeVar("TNode", bound="Node")
@@ -487,18 +487,26 @@ def unflatten(
         This list should be empty if the flat node representation only contains
         nodes that belong to the root node.
     """
-    node_key, node_type, value, child_keys = node_structs[0]
+    node, num_nodes = _unflatten(node_structs, 0)
+    return node, node_structs[num_nodes:]
+
+def _unflatten(
+    node_structs: list[FlatNodeStructure], idx: int
+) -> tuple[TNode, int]:
+    # Nodes are indexed rather than sliced from `node_structs` so unflattening
+    # is linear in the number of nodes
+    node_key, node_type, value, child_keys = node_structs[idx]
 
     children = []
-    node_structs = node_structs[1:]
+    idx = idx + 1
     for _key in child_keys:
-        child, node_structs = unflatten(node_structs)
+        child, idx = _unflatten(node_structs, idx)
         children.append(child)
 
     node = node_type.from_tree(
         value, {key: child for key, child in zip(child_keys, children)}
     )
-    return node, node_structs
+    return node, idx
 
 
 ## pytree flattening/unflattening implementation
@@ -520,8 +528,25 @@ def _make_flatten_unflatten(node_type: type[TNode]):
 
     return _flatten_node, _unflatten_node
 
+def register_pytree_node_types(*node_types: type[TNode]):
+    """
+    Register `Node` classes as `jax.pytree` nodes
+
+    Registration is deferred until `jax` is imported so that importing this
+    package doesn't import `jax` (see `lazy.on_load`).
+
+    Parameters
+    ----------
+    *node_types: type[TNode]
+        The `Node` classes to register
+    """
+    def register(jax):
+        for node_type in node_types:
+            _flatten, _unflatten = _make_flatten_unflatten(node_type)
+            jax.tree_util.register_pytree_node(node_type, _flatten, _unflatten)
+
+    lazy.on_load("jax", register)
+
 
 ## Register `Node` as `jax.pytree`
-for _NodeType in [Node]:
-    _flatten, _unflatten = _make_flatten_unflatten(_NodeType)
-    jax.tree_util.register_pytree_node(_NodeType, _flatten, _unflatten)
+register_pytree_node_types(Node)
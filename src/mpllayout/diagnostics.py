@@ -0,0 +1,482 @@
+"""
+Diagnostics for slowly converging or failing layouts
+
+The global residual of a layout is a concatenation of residual blocks from
+each constraint in `Layout.flat_constraints`.
+`attribute_constraints` maps each block back to its constraint key and
+reports each block's norm per solver iteration, its share of evaluation time
+and the global parameter (Jacobian) columns it depends on.
+Reports can be formatted as a table (`format_table`) or JSON (`to_json`).
+
+`analyze_dofs` checks for under- and over-constrained layouts before solving.
+"""
+
+from typing import Any, Callable, Optional
+from numpy.typing import NDArray
+
+import json
+import time
+
+import numpy as np
+
+from . import lazy
+from . import primitives as pr
+from . import containers as cn
+from . import layout as lay
+from . import solver
+
+jax = lazy.LazyModule("jax")
+jnp = lazy.LazyModule("jax.numpy")
+sparse = lazy.LazyModule("scipy.sparse")
+csgraph = lazy.LazyModule("scipy.sparse.csgraph")
+linalg = lazy.LazyModule("scipy.linalg")
+
+ConstraintAttribution = dict[str, Any]
+DOFAnalysis = dict[str, Any]
+
+
+def constraint_keys(layout: lay.Layout) -> list[str]:
+    """
+    Return keys for each constraint in `layout.flat_constraints()`
+
+    Parameters
+    ----------
+    layout: lay.Layout
+        The layout
+
+    Returns
+    -------
+    list[str]
+        Constraint keys in `layout.root_constraint`
+    """
+    # The `[1:]` removes the 'root' constraint which is just a container
+    return [key[1:] for key, _ in cn.iter_flat("", layout.root_constraint)][1:]
+
+def constraint_columns(layout: lay.Layout) -> list[NDArray]:
+    """
+    Return global parameter indices each constraint depends on
+
+    These are the (possibly) non-zero columns of each constraint's block in
+    the global Jacobian used by `solver.solve_newton`.
+
+    Parameters
+    ----------
+    layout: lay.Layout
+        The layout
+
+    Returns
+    -------
+    list[NDArray]
+        Sorted global parameter indices for each constraint in
+        `layout.flat_constraints()`
+    """
+    prim_columns = make_prim_columns(layout.root_prim)
+    _, constraint_graph, _ = layout.flat_constraints()
+    return [
+        np.unique(
+            np.concatenate(
+                [np.arange(0, 0)] + [prim_columns(key) for key in prim_keys]
+            )
+        )
+        for prim_keys in constraint_graph
+    ]
+
+def make_prim_columns(root_prim: pr.PrimitiveNode) -> Callable[[str], NDArray]:
+    """
+    Return a function mapping primitive keys to global parameter indices
+
+    Global parameters are the concatenated unique primitive values (see
+    `pr.filter_unique_values_from_prim`).
+    A primitive's parameters include parameters of all its child primitives.
+
+    Parameters
+    ----------
+    root_prim: pr.PrimitiveNode
+        The root primitive
+
+    Returns
+    -------
+    Callable[[str], NDArray]
+        A (memoized) function returning global parameter indices for a
+        primitive key
+    """
+    prim_to_idx, prim_values = pr.filter_unique_values_from_prim(root_prim)
+    prim_idx_bounds = np.cumsum([0] + [value.size for value in prim_values])
+
+    prim_key_to_columns: dict[str, NDArray] = {}
+    def prim_columns(prim_key: str) -> NDArray:
+        if prim_key not in prim_key_to_columns:
+            value_idxs = sorted({
+                prim_to_idx[key]
+                for key, _ in cn.iter_flat(f"/{prim_key}", root_prim[prim_key])
+            })
+            prim_key_to_columns[prim_key] = np.concatenate(
+                [np.arange(0, 0)] + [
+                    np.arange(prim_idx_bounds[idx], prim_idx_bounds[idx+1])
+                    for idx in value_idxs
+                ]
+            )
+        return prim_key_to_columns[prim_key]
+
+    return prim_columns
+
+def evaluate_constraints(
+    layout: lay.Layout,
+    root_prim: Optional[pr.PrimitiveNode] = None,
+    num_repeats: int = 1
+) -> tuple[list[NDArray], NDArray]:
+    """
+    Return each constraint's residual and evaluation time
+
+    Constraints are evaluated individually without `jax.jit` so evaluation
+    times are a proxy for each constraint's share of the compiled residual
+    cost.
+    Each constraint is evaluated once before timing.
+
+    Parameters
+    ----------
+    layout: lay.Layout
+        The layout
+    root_prim: Optional[pr.PrimitiveNode]
+        The primitive tree to evaluate constraints on
+
+        This is `layout.root_prim` by default.
+    num_repeats: int
+        The number of evaluations used to average evaluation times
+
+    Returns
+    -------
+    residuals: list[NDArray]
+        Residual vectors for each constraint in `layout.flat_constraints()`
+    eval_times: NDArray
+        Mean evaluation times (in seconds) for each constraint
+    """
+    if root_prim is None:
+        root_prim = layout.root_prim
+
+    residuals = []
+    eval_times = []
+    for constraint, prim_keys, params in zip(*layout.flat_constraints()):
+        prims = tuple(root_prim[key] for key in prim_keys)
+        # The first evaluation is untimed since it includes one-off `jax`
+        # dispatch and compilation costs
+        residual = np.asarray(constraint(prims, *params))
+        time_start = time.perf_counter()
+        for _ in range(num_repeats):
+            residual = np.asarray(constraint(prims, *params))
+        eval_times.append((time.perf_counter() - time_start) / num_repeats)
+        residuals.append(residual)
+    return residuals, np.array(eval_times)
+
+def attribute_constraints(
+    layout: lay.Layout,
+    num_repeats: int = 1,
+    **solve_kwargs
+) -> tuple[list[ConstraintAttribution], pr.PrimitiveNode, solver.SolverInfo]:
+    """
+    Solve a layout and attribute the residual and evaluation cost to constraints
+
+    Parameters
+    ----------
+    layout: lay.Layout
+        The layout
+    num_repeats: int
+        The number of evaluations used to average evaluation times
+    **solve_kwargs
+        Keyword arguments for `solver.solve` (the method must be 'newton'
+        and presolving is disabled)
+
+    Returns
+    -------
+    list[ConstraintAttribution]
+        Attributions for each constraint in `layout.flat_constraints()`
+
+        Each attribution is a dictionary with keys:
+            'key': the constraint key in `layout.root_constraint`,
+            'type': the constraint class name,
+            'start', 'stop': the block indices in the global residual,
+            'norms': the block 2-norm at each solver iteration and at the
+                solution,
+            'eval_time': the mean evaluation time (in seconds, see
+                `evaluate_constraints`),
+            'time_share': the fraction of the total evaluation time,
+            'columns': global parameter indices the block depends on (see
+                `constraint_columns`).
+    pr.PrimitiveNode
+        The solved primitive tree
+    solver.SolverInfo
+        Information about the solution
+    """
+    if solve_kwargs.get("method", "newton") != "newton":
+        raise ValueError("Only the 'newton' method records residuals")
+    # Presolving and dropping duplicates remove residual rows so residual
+    # blocks wouldn't match constraints
+    if solve_kwargs.setdefault("presolve", False):
+        raise ValueError("Residuals can't be attributed with `presolve=True`")
+    if solve_kwargs.setdefault("drop_duplicates", False):
+        raise ValueError(
+            "Residuals can't be attributed with `drop_duplicates=True`"
+        )
+
+    global_residuals = []
+    def hook(event: str, data: dict[str, Any]):
+        if event == "residual":
+            global_residuals.append(data["value"])
+
+    hooks = list(solve_kwargs.pop("hooks", None) or []) + [hook]
+    root_prim, info = solver.solve(layout, hooks=hooks, **solve_kwargs)
+
+    residuals, eval_times = evaluate_constraints(layout, root_prim, num_repeats)
+    block_bounds = np.cumsum([0] + [residual.size for residual in residuals])
+    total_time = np.sum(eval_times)
+
+    # The `[1:]` removes the 'root' constraint which is just a container
+    constraints = [node for _, node in cn.iter_flat("", layout.root_constraint)][1:]
+    flat_constraints = zip(
+        constraint_keys(layout), constraints, constraint_columns(layout)
+    )
+
+    attributions = []
+    for ii, (key, constraint, columns) in enumerate(flat_constraints):
+        start, stop = block_bounds[ii], block_bounds[ii+1]
+        norms = [
+            float(np.linalg.norm(global_res[start:stop]))
+            for global_res in global_residuals
+        ]
+        norms.append(float(np.linalg.norm(residuals[ii])))
+        attributions.append({
+            "key": key,
+            "type": type(constraint).__name__,
+            "start": int(start),
+            "stop": int(stop),
+            "norms": norms,
+            "eval_time": float(eval_times[ii]),
+            "time_share": float(eval_times[ii] / max(total_time, 1e-300)),
+            "columns": columns.tolist(),
+        })
+    return attributions, root_prim, info
+
+
+
+## Degrees of freedom analysis
+
+def assem_global_jacobian(layout: lay.Layout) -> NDArray:
+    """
+    Return the global Jacobian at the layout's initial primitive values
+
+    The Jacobian matches the one used by `solver.solve_newton`.
+
+    Parameters
+    ----------
+    layout: lay.Layout
+        The layout
+
+    Returns
+    -------
+    NDArray
+        The Jacobian with shape `(num_residuals, num_params)`
+    """
+    flat_prim = cn.flatten('', layout.root_prim)
+    prim_graph, prim_values = pr.filter_unique_values_from_prim(layout.root_prim)
+    prim_idx_bounds = np.cumsum([0] + [value.size for value in prim_values])
+    global_param = np.concatenate(prim_values)
+
+    constraints, constraint_graph, constraint_params = layout.flat_constraints()
+
+    def assem_global_res(global_param):
+        new_prim_params = [
+            global_param[idx_start:idx_end]
+            for idx_start, idx_end in zip(prim_idx_bounds[:-1], prim_idx_bounds[1:])
+        ]
+        root_prim = pr.build_prim_from_unique_values(flat_prim, prim_graph, new_prim_params)
+        residuals = solver.assem_constraint_residual(
+            root_prim, constraints, constraint_graph, constraint_params
+        )
+        return jnp.concatenate(residuals)
+
+    return np.asarray(jax.jit(jax.jacfwd(assem_global_res))(global_param))
+
+def analyze_dofs(layout: lay.Layout, rtol: Optional[float] = None) -> DOFAnalysis:
+    """
+    Return degrees of freedom and redundant constraints of a layout
+
+    The analysis uses the global Jacobian at the initial primitive values
+    (see `assem_global_jacobian`).
+    A structural analysis finds a maximum bipartite matching between residual
+    rows and global parameters using the Jacobian sparsity pattern; rows
+    without a match are structurally redundant.
+    A numerical analysis finds the Jacobian rank with a singular value
+    decomposition and independent rows with a column pivoted QR
+    decomposition of the transposed Jacobian; remaining rows are
+    (numerically) redundant.
+
+    Free degrees of freedom are directions in the Jacobian null space.
+    The free degrees of freedom of a primitive are the dimension of the null
+    space restricted to the primitive's parameters.
+
+    Parameters
+    ----------
+    layout: lay.Layout
+        The layout
+    rtol: Optional[float]
+        The singular value tolerance relative to the largest singular value
+
+        By default this is `max(jac.shape) * eps`.
+
+    Returns
+    -------
+    DOFAnalysis
+        A dictionary with keys:
+            'num_params', 'num_residuals':
+                The number of global parameters and residuals
+            'structural_rank':
+                The number of matched residual rows
+            'rank':
+                The numerical Jacobian rank
+            'num_free_dofs':
+                The number of free degrees of freedom (`num_params - rank`)
+            'free_dofs':
+                A mapping from each primitive key in `layout.root_prim` to
+                its number of free degrees of freedom (if non-zero)
+            'redundant_constraints':
+                A mapping from constraint keys to their number of numerically
+                redundant rows
+            'structurally_redundant_constraints':
+                A mapping from constraint keys to their number of unmatched
+                rows
+            'singular_values':
+                The Jacobian singular values
+    """
+    residuals, _ = evaluate_constraints(layout)
+    keys = constraint_keys(layout)
+    row_to_key = np.repeat(keys, [residual.size for residual in residuals])
+
+    jac = assem_global_jacobian(layout)
+    num_residuals, num_params = jac.shape
+    if rtol is None:
+        rtol = max(jac.shape) * np.finfo(jac.dtype).eps
+
+    def count_keys(rows: NDArray) -> dict[str, int]:
+        unique_keys, counts = np.unique(row_to_key[rows], return_counts=True)
+        return {str(key): int(count) for key, count in zip(unique_keys, counts)}
+
+    ## Structural analysis
+    pattern = sparse.csr_matrix(jac != 0)
+    row_matches = csgraph.maximum_bipartite_matching(pattern, perm_type='column')
+    unmatched_rows = np.flatnonzero(row_matches < 0)
+
+    ## Numerical analysis
+    if min(jac.shape) == 0:
+        singular_values = np.zeros(0)
+        rank = 0
+        null_basis = np.eye(num_params)
+        dependent_rows = np.arange(num_residuals)
+    else:
+        _, singular_values, vh = np.linalg.svd(jac)
+        rank = int(np.sum(singular_values > rtol*singular_values[0]))
+        null_basis = vh[rank:].T
+
+        # Column pivoting orders rows of `jac` so that later rows depend on
+        # earlier rows
+        *_, row_order = linalg.qr(jac.T, mode='economic', pivoting=True)
+        dependent_rows = np.sort(row_order[rank:])
+
+    # Find free degrees of freedom for each primitive
+    prim_columns = make_prim_columns(layout.root_prim)
+    free_dofs = {}
+    for key, _ in cn.iter_flat("", layout.root_prim):
+        key = key[1:]
+        if key == "":
+            continue
+        prim_null_basis = null_basis[prim_columns(key)]
+        if prim_null_basis.size > 0:
+            num_dofs = np.linalg.matrix_rank(prim_null_basis, tol=np.sqrt(rtol))
+            if num_dofs > 0:
+                free_dofs[key] = int(num_dofs)
+
+    return {
+        "num_params": num_params,
+        "num_residuals": num_residuals,
+        "structural_rank": int(np.sum(row_matches >= 0)),
+        "rank": rank,
+        "num_free_dofs": num_params - rank,
+        "free_dofs": free_dofs,
+        "redundant_constraints": count_keys(dependent_rows),
+        "structurally_redundant_constraints": count_keys(unmatched_rows),
+        "singular_values": singular_values,
+    }
+
+## Report formatting
+
+def format_table(
+    attributions: list[ConstraintAttribution],
+    sort_by: str = "initial_norm",
+    max_rows: Optional[int] = 20
+) -> str:
+    """
+    Return a text table of constraint attributions
+
+    Constraints with empty residual blocks (containers of child constraints)
+    are omitted.
+
+    Parameters
+    ----------
+    attributions: list[ConstraintAttribution]
+        Constraint attributions (see `attribute_constraints`)
+    sort_by: str
+        The column to sort rows by (in decreasing order)
+
+        One of 'initial_norm', 'final_norm', 'eval_time' or 'num_columns'.
+    max_rows: Optional[int]
+        The maximum number of rows
+
+        If `None`, all constraints are shown.
+
+    Returns
+    -------
+    str
+        The table
+    """
+    rows = [
+        {
+            "key": attr["key"],
+            "type": attr["type"],
+            "size": attr["stop"] - attr["start"],
+            "initial_norm": attr["norms"][0],
+            "final_norm": attr["norms"][-1],
+            "eval_time": attr["eval_time"],
+            "time_share": attr["time_share"],
+            "num_columns": len(attr["columns"]),
+        }
+        for attr in attributions if attr["stop"] > attr["start"]
+    ]
+    rows = sorted(rows, key=lambda row: row[sort_by], reverse=True)
+    if max_rows is not None:
+        rows = rows[:max_rows]
+
+    header = (
+        f"{'key':<40} {'type':<24} {'size':>5} {'initial':>10} {'final':>10} "
+        f"{'time [s]':>10} {'share':>7} {'cols':>5}"
+    )
+    lines = [header, len(header)*"-"]
+    for row in rows:
+        lines.append(
+            f"{row['key'][-40:]:<40} {row['type'][:24]:<24} {row['size']:>5d} "
+            f"{row['initial_norm']:>10.2e} {row['final_norm']:>10.2e} "
+            f"{row['eval_time']:>10.2e} {row['time_share']:>7.1%} "
+            f"{row['num_columns']:>5d}"
+        )
+    return "\n".join(lines)
+
+def to_json(attributions: list[ConstraintAttribution], **kwargs) -> str:
+    """
+    Return constraint attributions as a JSON string
+
+    Parameters
+    ----------
+    attributions: list[ConstraintAttribution]
+        Constraint attributions (see `attribute_constraints`)
+    **kwargs
+        Keyword arguments for `json.dumps`
+    """
+    return json.dumps(attributions, **kwargs)
@@ -0,0 +1,323 @@
+"""
+Instrumentation of solver phases
+
+A `Profiler` records the time spent in named phases of a solve (for example,
+residual evaluation or XLA compilation) and other per-iteration measurements
+(for example, Jacobian ranks).
+Measurements are stored for `SolverInfo` and forwarded to hooks so they can be
+sent to external metrics systems.
+
+In memory profiling mode, a `Profiler` also records the peak memory allocated
+in each phase (see `tracemalloc`) and the memory held by live `jax` arrays.
+"""
+
+from typing import Any, Callable, Iterator, Optional
+
+import sys
+import gc
+import time
+import contextlib
+import tracemalloc
+
+from . import containers as cn
+
+# A hook is called with an event name (see `add_hook`) and event data
+Hook = Callable[[str, dict[str, Any]], None]
+
+# Hooks called by all profilers (see `add_hook`)
+_hooks: list[Hook] = []
+
+
+def add_hook(hook: Hook):
+    """
+    Add a hook that is called with measurements from all solves
+
+    Parameters
+    ----------
+    hook: Hook
+        The hook
+
+        This is called as `hook(event, data)` where `event` is one of:
+            'phase':
+                `data` has keys 'phase' (the phase name) and 'time' (the phase
+                duration in seconds) and, for iterative phases, 'iteration'.
+                In memory profiling mode, `data` also has keys 'peak_bytes'
+                and 'live_buffer_bytes' (see `Profiler`).
+            'record':
+                `data` has keys 'name' (the measurement name) and 'value'
+                and, for iterative measurements, 'iteration'.
+            'residual':
+                `data` has keys 'iteration' and 'value' (the global residual
+                vector at the start of a newton iteration).
+                These are only passed to hooks and aren't recorded.
+    """
+    _hooks.append(hook)
+
+def remove_hook(hook: Hook):
+    """
+    Remove a hook added with `add_hook`
+    """
+    _hooks.remove(hook)
+
+
+class Profiler:
+    """
+    Record durations of named phases and other measurements
+
+    Parameters
+    ----------
+    enabled: bool
+        Whether to record measurements
+
+        Profilers are always enabled if there are any hooks.
+    hooks: Optional[list[Hook]]
+        Hooks called with measurements from this profiler
+
+        Hooks added with `add_hook` are also called.
+    memory: bool
+        Whether to record memory use of phases
+
+        Profilers are always enabled in memory profiling mode.
+        Tracing memory allocations slows down phases so phase durations
+        are less accurate in this mode.
+    live_nodes: bool
+        Whether to count live node objects (see `count_live_nodes`)
+
+        This walks all objects tracked by the garbage collector so it's
+        separate from memory profiling. Profilers are always enabled if
+        counting live nodes.
+
+    Attributes
+    ----------
+    phase_times: dict[str, list[float]]
+        Durations (in seconds) for each call of a phase
+    phase_peak_bytes: dict[str, list[int]]
+        Peak memory (in bytes) allocated by python for each call of a phase
+
+        This is only recorded in memory profiling mode.
+        Phases shouldn't be nested since the peak is tracked globally.
+    phase_live_buffer_bytes: dict[str, list[int]]
+        The memory (in bytes) held by live `jax` arrays after each call of a
+        phase (see `live_buffer_bytes`)
+
+        This is only recorded in memory profiling mode.
+    records: dict[str, list[Any]]
+        Values for each call of a measurement
+    summaries: dict[str, Any]
+        Single values of measurements made once (see `Profiler.summarize`)
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        hooks: Optional[list[Hook]] = None,
+        memory: bool = False,
+        live_nodes: bool = False
+    ):
+        if hooks is None:
+            hooks = []
+        self.hooks = _hooks + hooks
+        self.memory = memory
+        self.live_nodes = live_nodes
+        self.enabled = enabled or memory or live_nodes or len(self.hooks) > 0
+
+        self.phase_times: dict[str, list[float]] = {}
+        self.phase_peak_bytes: dict[str, list[int]] = {}
+        self.phase_live_buffer_bytes: dict[str, list[int]] = {}
+        self.records: dict[str, list[Any]] = {}
+        self.summaries: dict[str, Any] = {}
+
+    @contextlib.contextmanager
+    def phase(self, name: str, **data) -> Iterator[None]:
+        """
+        Return a context manager that records the duration of a phase
+
+        Parameters
+        ----------
+        name: str
+            The phase name
+        **data
+            Additional data passed to hooks (for example, 'iteration')
+        """
+        if not self.enabled:
+            yield
+            return
+
+        try:
+            with contextlib.ExitStack() as stack:
+                if self.memory:
+                    stack.enter_context(self._trace_memory(name, data))
+                stack.enter_context(self._time(name, data))
+                yield
+        finally:
+            self.emit("phase", {"phase": name, **data})
+
+    @contextlib.contextmanager
+    def _time(self, name: str, data: dict[str, Any]) -> Iterator[None]:
+        time_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - time_start
+            self.phase_times.setdefault(name, []).append(duration)
+            data["time"] = duration
+
+    @contextlib.contextmanager
+    def _trace_memory(self, name: str, data: dict[str, Any]) -> Iterator[None]:
+        # Only stop tracing if it wasn't started elsewhere
+        is_tracing = tracemalloc.is_tracing()
+        if not is_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        base_bytes, _ = tracemalloc.get_traced_memory()
+        try:
+            yield
+        finally:
+            _, peak_bytes = tracemalloc.get_traced_memory()
+            if not is_tracing:
+                tracemalloc.stop()
+            peak_bytes = peak_bytes - base_bytes
+            buffer_bytes = live_buffer_bytes()
+
+            self.phase_peak_bytes.setdefault(name, []).append(peak_bytes)
+            self.phase_live_buffer_bytes.setdefault(name, []).append(buffer_bytes)
+            data["peak_bytes"] = peak_bytes
+            data["live_buffer_bytes"] = buffer_bytes
+
+    def record(self, name: str, value: Any, **data):
+        """
+        Record a measurement
+
+        Parameters
+        ----------
+        name: str
+            The measurement name
+        value: Any
+            The measurement value
+        **data
+            Additional data passed to hooks (for example, 'iteration')
+        """
+        if not self.enabled:
+            return
+
+        self.records.setdefault(name, []).append(value)
+        self.emit("record", {"name": name, "value": value, **data})
+
+    def summarize(self, name: str, value: Any):
+        """
+        Record a measurement that is only made once
+
+        Unlike `Profiler.record`, the value is stored directly rather than in
+        a list of values.
+
+        Parameters
+        ----------
+        name: str
+            The measurement name
+        value: Any
+            The measurement value
+        """
+        if not self.enabled:
+            return
+
+        self.summaries[name] = value
+        self.emit("record", {"name": name, "value": value})
+
+    def emit(self, event: str, data: dict[str, Any]):
+        """
+        Call all hooks with an event
+
+        Unlike `Profiler.record`, emitted data isn't stored.
+        """
+        for hook in self.hooks:
+            hook(event, data)
+
+    def info(self) -> dict[str, Any]:
+        """
+        Return measurements as a dictionary for `SolverInfo`
+
+        Returns
+        -------
+        dict[str, Any]
+            The 'phase_times' (see `Profiler.phase_times`), all records
+            (see `Profiler.records`) and summaries (see `Profiler.summaries`)
+
+            In memory profiling mode, this also contains 'phase_peak_bytes'
+            and 'phase_live_buffer_bytes'.
+            This is empty if the profiler isn't enabled.
+        """
+        if not self.enabled:
+            return {}
+        if self.memory:
+            memory_info = {
+                "phase_peak_bytes": self.phase_peak_bytes,
+                "phase_live_buffer_bytes": self.phase_live_buffer_bytes
+            }
+        else:
+            memory_info = {}
+        return {
+            "phase_times": self.phase_times,
+            **memory_info,
+            **self.records,
+            **self.summaries
+        }
+
+
+## Memory measurements
+
+def live_buffer_bytes() -> int:
+    """
+    Return the memory (in bytes) held by live `jax` arrays
+
+    This is 0 if `jax` hasn't been imported.
+    """
+    if "jax" not in sys.modules:
+        return 0
+    jax = sys.modules["jax"]
+    return sum(array.nbytes for array in jax.live_arrays())
+
+def count_nodes(root_node: cn.Node) -> dict[str, int]:
+    """
+    Return the number of unique nodes of each class in a tree
+
+    Nodes shared within the tree (for example, points shared between lines)
+    are only counted once.
+
+    Parameters
+    ----------
+    root_node: cn.Node
+        The root node
+
+    Returns
+    -------
+    dict[str, int]
+        A mapping from node class names to node counts
+    """
+    node_ids = set()
+    counts = {}
+    for _, node in cn.iter_flat("", root_node):
+        if id(node) not in node_ids:
+            node_ids.add(id(node))
+            class_name = type(node).__name__
+            counts[class_name] = counts.get(class_name, 0) + 1
+    return counts
+
+def count_live_nodes() -> dict[str, int]:
+    """
+    Return the number of live node objects of each class
+
+    Unlike `count_nodes`, this counts all nodes tracked by the garbage
+    collector (for example, intermediate primitive trees built by solvers).
+    This inspects every tracked object so it's slow for large processes.
+
+    Returns
+    -------
+    dict[str, int]
+        A mapping from node class names to node counts
+    """
+    counts = {}
+    for obj in gc.get_objects():
+        if isinstance(obj, cn.Node):
+            class_name = type(obj).__name__
+            counts[class_name] = counts.get(class_name, 0) + 1
+    return counts
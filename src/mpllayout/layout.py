@@ -5,16 +5,19 @@ A `Layout` is the class used to represent an arrangement (layout) of figure
 elements.
 """
 
-from typing import Optional, Any
+from typing import Optional, Any, Literal, TYPE_CHECKING
 from numpy.typing import NDArray
 
-from matplotlib.axes import Axes
 import numpy as np
 
 from . import primitives as pr
 from . import constraints as cr
+from . import instrumentation as inst
 from .containers import ItemCounter, iter_flat
 
+if TYPE_CHECKING:
+    from matplotlib.axes import Axes
+
 IntGraph = list[tuple[int, ...]]
 StrGraph = list[tuple[str, ...]]
 
@@ -184,9 +187,69 @@ class Layout:
         self.root_prim_keys.add_child(key, constraint.root_prim_keys(prim_keys))
         self.root_param.add_child(key, constraint.root_params(param))
 
+    def memory_info(self) -> dict[str, Any]:
+        """
+        Return node counts and primitive value sizes to estimate memory use
+
+        Returns
+        -------
+        dict[str, Any]
+            A dictionary with keys:
+                'prim_counts', 'constraint_counts': the number of unique nodes
+                    of each class in `root_prim` and `root_constraint` (see
+                    `inst.count_nodes`),
+                'num_unique_prims': the number of unique primitive values
+                    (see `pr.filter_unique_values_from_prim`),
+                'prim_value_bytes': the total size (in bytes) of unique
+                    primitive values.
+        """
+        _, prim_values = pr.filter_unique_values_from_prim(self.root_prim)
+        return {
+            "prim_counts": inst.count_nodes(self.root_prim),
+            "constraint_counts": inst.count_nodes(self.root_constraint),
+            "num_unique_prims": len(prim_values),
+            "prim_value_bytes": sum(np.asarray(value).nbytes for value in prim_values)
+        }
+
+def find_axis_thickness_constraints(
+    layout: Layout
+) -> dict[str, tuple[str, Literal['x', 'y']]]:
+    """
+    Return keys of axis thickness constraints and the axis they measure
+
+    Parameters
+    ----------
+    layout: Layout
+        The layout
+
+    Returns
+    -------
+    dict[str, tuple[str, Literal['x', 'y']]]
+        A mapping from `XAxisThickness`/`YAxisThickness` constraint keys to
+        the axes key and axis ('x' or 'y') that the constraint applies to
+    """
+    constraintkey_to_axis = {}
+    for key, constraint in iter_flat('', layout.root_constraint):
+        # `key[1:]` removes the initial "/" from the key
+        key = key[1:]
+        if key != "":
+            prim_keys = layout.root_prim_keys[key]
+
+            if isinstance(constraint, cr.XAxisThickness):
+                axis_key, = prim_keys.value
+                axes_key = axis_key.split("/", 1)[0]
+                constraintkey_to_axis[key] = (axes_key, 'x')
+
+            if isinstance(constraint, cr.YAxisThickness):
+                axis_key, = prim_keys.value
+                axes_key = axis_key.split("/", 1)[0]
+                constraintkey_to_axis[key] = (axes_key, 'y')
+
+    return constraintkey_to_axis
+
 def update_layout_constraints(
     layout: Layout,
-    axs: dict[str, Axes]
+    axs: dict[str, "Axes"]
 ) -> Layout:
     """
     Update layout constraints that depend on `matplotlib` elements
@@ -212,23 +275,33 @@ def update_layout_constraints(
         The layout with updated constraint parameters
     """
     constraintkey_to_param = {}
-    for key, constraint in iter_flat('', layout.root_constraint):
-        # `key[1:]` removes the initial "/" from the key
-        key = key[1:]
-        if key != "":
-            prim_keys = layout.root_prim_keys[key]
-            constraint_param = layout.root_param[key]
+    for key, (axes_key, axis) in find_axis_thickness_constraints(layout).items():
+        if axis == 'x':
+            constraintkey_to_param[key] = (axs[axes_key].xaxis,)
+        else:
+            constraintkey_to_param[key] = (axs[axes_key].yaxis,)
 
-            if isinstance(constraint, cr.XAxisThickness):
-                axis_key, = prim_keys.value
-                axes_key = axis_key.split("/", 1)[0]
-                constraintkey_to_param[key] = (axs[axes_key].xaxis,)
+    return update_layout_params(layout, constraintkey_to_param)
 
-            if isinstance(constraint, cr.YAxisThickness):
-                axis_key, = prim_keys.value
-                axes_key = axis_key.split("/", 1)[0]
-                constraintkey_to_param[key] = (axs[axes_key].yaxis,)
+def update_layout_params(
+    layout: Layout,
+    constraintkey_to_param: dict[str, cr.Params]
+) -> Layout:
+    """
+    Return a layout with replaced constraint parameters
 
+    Parameters
+    ----------
+    layout: Layout
+        The layout
+    constraintkey_to_param: dict[str, cr.Params]
+        A mapping of constraint keys to replacement constraint parameters
+
+    Returns
+    -------
+    Layout
+        The layout with updated constraint parameters
+    """
     new_root_param = update_root_param(
         layout.root_constraint,
         layout.root_param,
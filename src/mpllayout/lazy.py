@@ -0,0 +1,167 @@
+"""
+Deferred imports of heavy dependencies
+
+Importing `jax`, `scipy` and `matplotlib` takes a long time, and importing
+`matplotlib.pyplot` also initializes a GUI backend.
+Modules in this package refer to these dependencies through `LazyModule`
+proxies so the dependencies are only imported when they are first used
+(for example, on the first solve or render).
+Set-up that needs a dependency (for example, registering `jax` pytree nodes)
+is deferred with `on_load` until the dependency is imported, whether by this
+package or by user code.
+An import hook is only installed in `sys.meta_path` while set-up is waiting
+and is removed once every waiting hook has run.
+"""
+
+from typing import Callable
+from types import ModuleType
+
+import sys
+import importlib
+import importlib.abc
+
+LoadHook = Callable[[ModuleType], None]
+
+# Hooks waiting for a module (the key) to be imported
+_load_hooks: dict[str, list[LoadHook]] = {}
+
+
+class LazyModule:
+    """
+    A proxy for a module that is only imported on first attribute access
+
+    Parameters
+    ----------
+    name: str
+        The absolute module name (for example, 'jax.numpy')
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    @property
+    def is_loaded(self) -> bool:
+        """
+        Return whether the module has been imported
+        """
+        return self._module is not None or self._name in sys.modules
+
+    def load(self) -> ModuleType:
+        """
+        Import (if needed) and return the module
+        """
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+            run_load_hooks()
+        return self._module
+
+    def __getattr__(self, name: str):
+        return getattr(self.load(), name)
+
+    def __dir__(self) -> list[str]:
+        return dir(self.load())
+
+    def __repr__(self) -> str:
+        status = "loaded" if self.is_loaded else "not loaded"
+        return f"{type(self).__name__}({self._name!r}, {status})"
+
+
+def on_load(name: str, hook: LoadHook):
+    """
+    Call a function once a module has been imported
+
+    If the module is already imported, `hook` is called immediately.
+    Otherwise, `hook` is called as soon as the module is imported (see
+    `_PostImportFinder`), which is installed until all waiting hooks are run.
+
+    Parameters
+    ----------
+    name: str
+        The absolute module name
+    hook: LoadHook
+        The function to call
+
+        This is called with the imported module as its only argument.
+    """
+    if name in sys.modules:
+        hook(sys.modules[name])
+    else:
+        _load_hooks.setdefault(name, []).append(hook)
+        _install_finder()
+
+
+def run_load_hooks():
+    """
+    Call any waiting hooks for modules that have been imported
+
+    Hooks are normally run automatically when a module is imported so this
+    only needs to be called if a module was imported in a way that bypasses
+    `sys.meta_path` (for example, by inserting it into `sys.modules` directly).
+    """
+    loaded_names = [name for name in _load_hooks if name in sys.modules]
+    for name in loaded_names:
+        for hook in _load_hooks.pop(name):
+            hook(sys.modules[name])
+
+    if not _load_hooks:
+        _remove_finder()
+
+
+class _PostImportLoader(importlib.abc.Loader):
+    """
+    A loader that runs waiting hooks after another loader executes a module
+
+    Other loader attributes (for example, resource readers) are forwarded to
+    the wrapped loader.
+    """
+
+    def __init__(self, loader: importlib.abc.Loader):
+        self._loader = loader
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module: ModuleType):
+        # Restore the original loader so the module doesn't keep this wrapper
+        module.__loader__ = self._loader
+        module.__spec__.loader = self._loader
+        self._loader.exec_module(module)
+        run_load_hooks()
+
+    def __getattr__(self, name: str):
+        return getattr(self._loader, name)
+
+
+class _PostImportFinder(importlib.abc.MetaPathFinder):
+    """
+    A finder that wraps the loaders of modules with waiting hooks
+
+    This only intercepts modules in `_load_hooks`; the module spec is found
+    with the remaining finders in `sys.meta_path`.
+    """
+
+    def find_spec(self, fullname: str, path, target=None):
+        if fullname not in _load_hooks:
+            return None
+
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None:
+                    spec.loader = _PostImportLoader(spec.loader)
+                return spec
+        return None
+
+
+def _install_finder():
+    if not any(isinstance(finder, _PostImportFinder) for finder in sys.meta_path):
+        sys.meta_path.insert(0, _PostImportFinder())
+
+def _remove_finder():
+    sys.meta_path[:] = [
+        finder for finder in sys.meta_path
+        if not isinstance(finder, _PostImportFinder)
+    ]
@@ -2,18 +2,35 @@
 Utilities for creating `matplotlib` elements from geometric primitives
 """
 
-from typing import Optional
+from typing import Any, Callable, Iterable, Iterator, Optional, TYPE_CHECKING
 from numpy.typing import NDArray
+import os
+import time
+import itertools
+import collections
+import contextlib
 import warnings
+import multiprocessing
+import concurrent.futures
 
 import numpy as np
 
-from matplotlib import pyplot as plt
-from matplotlib.figure import Figure
-from matplotlib.axes import Axes
-
+from . import lazy
 from . import primitives as pr
 from . import constraints as cr
+from . import layout as lay
+from . import solver
+from . import serialization as se
+
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure
+    from matplotlib.axes import Axes
+    from matplotlib.backend_bases import RendererBase
+
+mpl = lazy.LazyModule("matplotlib")
+mfigure = lazy.LazyModule("matplotlib.figure")
+plt = lazy.LazyModule("matplotlib.pyplot")
+backend_agg = lazy.LazyModule("matplotlib.backends.backend_agg")
 
 # TODO: (not critical) Should special primitive classes indicate `matplotlib` figures and axes?
 # I'm not certain if that would be that beneficial here.
@@ -22,7 +39,8 @@ def subplots(
     root_prim: pr.Primitive,
     fig_key: str = "Figure",
     axs_keys: Optional[list[str]] = None,
-) -> tuple[Figure, dict[str, Axes]]:
+    pool: Optional["FigurePool"] = None
+) -> tuple["Figure", dict[str, "Axes"]]:
     """
     Create matplotlib `Figure` and `Axes` objects from geometric primitives
 
@@ -41,6 +59,11 @@ def subplots(
         Axes keys
 
         If supplied, only these axes keys will be used to generate `Axes` instances.
+    pool: Optional[FigurePool]
+        A pool of figures to reuse
+
+        If supplied, the figure and axes are taken from the pool (see
+        `FigurePool.subplots`) and should be returned with `FigurePool.release`.
 
     Returns
     -------
@@ -49,25 +72,40 @@ def subplots(
     axs: dict[str, Axes]
         The matplotlib `Axes` instances
     """
+    if pool is not None:
+        return pool.subplots(root_prim, fig_key, axs_keys)
+
     # Create the `Figure` instance
     fig = plt.figure(figsize=(1, 1))
 
     # Assume all axes are prefixed by "Axes" if there are no keys provided
     if axs_keys is None:
-        axs_keys = [key for key in root_prim.keys() if "Axes" in key]
+        axs_keys = find_axs_keys(root_prim)
 
     # Create all `Axes` instances
-    unit_rect = (0, 0, 1, 1)
-    key_to_ax = {key: fig.add_axes(unit_rect) for key in axs_keys}
+    key_to_ax = add_axes(fig, axs_keys)
 
     # Update positions figures and axes
     fig, key_to_ax = update_subplots(root_prim, fig_key, fig, key_to_ax)
 
     return fig, key_to_ax
 
+def find_axs_keys(root_prim: pr.Primitive) -> list[str]:
+    """
+    Return default axes keys (all keys containing "Axes") in a primitive tree
+    """
+    return [key for key in root_prim.keys() if "Axes" in key]
+
+def add_axes(fig: "Figure", axs_keys: list[str]) -> dict[str, "Axes"]:
+    """
+    Add unpositioned axes to a figure for each axes key
+    """
+    unit_rect = (0, 0, 1, 1)
+    return {key: fig.add_axes(unit_rect) for key in axs_keys}
+
 
 def update_subplots(
-    root_prim: pr.Primitive, fig_key: str, fig: Figure, axs: dict[str, Axes],
+    root_prim: pr.Primitive, fig_key: str, fig: "Figure", axs: dict[str, "Axes"],
 ):
     """
     Update matplotlib `Figure` and `Axes` object positions from primitives
@@ -94,37 +132,59 @@ def update_subplots(
         The updated matplotlib `Axes` instances
     """
     # Set Figure position
-    quad = root_prim[fig_key]
-    fig_origin = quad['Line0/Point0'].value
-    fig_size = np.array(width_and_height_from_quad(quad))
+    fig_coords = quad_coords(root_prim[fig_key])
+    fig_origin = fig_coords[0]
+    fig_size = fig_coords[2] - fig_coords[0]
     fig.set_size_inches(fig_size)
 
+    # Gather frame coordinates for all axes and compute positions in bulk
+    axs_prims = [root_prim[key] for key in axs.keys()]
+    frame_coords = np.reshape(
+        [quad_coords(axes_prim["Frame"]) for axes_prim in axs_prims], (-1, 4, 2)
+    )
+    rects = rects_from_coords(frame_coords, fig_origin, fig_size)
+
+    # Gather x/y axis label coordinates and tick positions
+    # These map axes indices to label coordinates and tick positions
+    axis_label_coords: dict[str, dict[int, NDArray]] = {}
+    axis_tick_positions: dict[str, dict[int, str]] = {}
+    for axis_prefix in ("X", "Y"):
+        label_idxs = [
+            idx for idx, axes_prim in enumerate(axs_prims)
+            if f"{axis_prefix}AxisLabel" in axes_prim
+        ]
+        label_coords = np.reshape(
+            [axs_prims[idx][f"{axis_prefix}AxisLabel"].value for idx in label_idxs],
+            (-1, 2)
+        )
+        axis_label_coords[axis_prefix] = dict(zip(label_idxs, label_coords / fig_size))
+
+        axis_idxs = [
+            idx for idx, axes_prim in enumerate(axs_prims)
+            if f"{axis_prefix}Axis" in axes_prim
+        ]
+        axis_coords = np.reshape(
+            [quad_coords(axs_prims[idx][f"{axis_prefix}Axis"]) for idx in axis_idxs],
+            (-1, 4, 2)
+        )
+        tick_positions = find_axis_positions(frame_coords[axis_idxs], axis_coords)
+        axis_tick_positions[axis_prefix] = dict(zip(axis_idxs, tick_positions))
+
     # Set Axes properties/position
-    for key, ax in axs.items():
-        # Set Axes dimensions
-        quad = root_prim[f"{key}/Frame"]
-        ax.set_position(rect_from_box(quad, fig_origin, fig_size))
-
-        # Set x/y axis properties
-        axis_prefixes = ("X", "Y")
-        axis_tuple = (ax.xaxis, ax.yaxis)
-
-        for axis_prefix, axis in zip(axis_prefixes, axis_tuple):
-            # Set the axis label position
-            axis_label = f"{axis_prefix}AxisLabel"
-            if axis_label in root_prim[key]:
-                axis_label_point: pr.Point = root_prim[f"{key}/{axis_label}"]
-                label_coords = axis_label_point.value
+    for idx, ax in enumerate(axs.values()):
+        ax.set_position(tuple(rects[idx]))
+
+        for axis_prefix, axis in zip(("X", "Y"), (ax.xaxis, ax.yaxis)):
+            if idx in axis_label_coords[axis_prefix]:
                 axis.set_label_coords(
-                    *(label_coords / fig_size), transform=fig.transFigure
+                    *axis_label_coords[axis_prefix][idx], transform=fig.transFigure
                 )
 
-            # Set the axis tick position
-            axis_bbox = f"{axis_prefix}Axis"
-            if axis_bbox in root_prim[key]:
-                axis_quad = root_prim[f"{key}/{axis_bbox}"]
-                axis_tick_position = find_axis_position(quad, axis_quad)
-                axis.set_ticks_position(axis_tick_position)
+            # Setting tick positions updates every tick so skip unchanged ones
+            if idx in axis_tick_positions[axis_prefix]:
+                tick_position = axis_tick_positions[axis_prefix][idx]
+                if axis.get_ticks_position() != tick_position:
+                    axis.set_ticks_position(tick_position)
 
     return fig, axs
 
@@ -146,23 +206,66 @@ def find_axis_position(axes_frame: pr.Quadrilateral, axis: pr.Quadrilateral) ->
     position: str
         One of ('bottom', 'top', 'left', 'right') indicating the axis position
     """
-    coincident_line = cr.CoincidentLines()
-    params = {"reverse": True}
-    bottom_res = coincident_line((axes_frame["Line0"], axis["Line2"]), params)
-    top_res = coincident_line((axes_frame["Line2"], axis["Line0"]), params)
-    left_res = coincident_line((axes_frame["Line3"], axis["Line1"]), params)
-    right_res = coincident_line((axes_frame["Line1"], axis["Line3"]), params)
-
-    residuals = tuple(
-        np.linalg.norm(res) for res in (bottom_res, top_res, left_res, right_res)
+    (position,) = find_axis_positions(
+        quad_coords(axes_frame)[None], quad_coords(axis)[None]
     )
-    residual_positions = ("bottom", "top", "left", "right")
+    return position
 
-    if not np.isclose(np.min(residuals), 0):
+def find_axis_positions(frame_coords: NDArray, axis_coords: NDArray) -> list[str]:
+    """
+    Return axis positions relative to frames from quadrilateral coordinates
+
+    Parameters
+    ----------
+    frame_coords: NDArray
+        Axes frame vertex coordinates with shape `(n, 4, 2)`
+
+        See `quad_coords` for the vertex order.
+    axis_coords: NDArray
+        Axis vertex coordinates with shape `(n, 4, 2)`
+
+    Returns
+    -------
+    positions: list[str]
+        One of ('bottom', 'top', 'left', 'right') for each axis
+    """
+    # For each side, these are the frame and axis vertex indices that coincide
+    # if the axis is on that side (see `cr.CoincidentLines` with `reverse=True`)
+    # For example, an axis at the bottom has its top line (vertices 2 and 3)
+    # coincident with the frame bottom line (vertices 1 and 0).
+    side_positions = ("bottom", "top", "left", "right")
+    frame_idxs = np.array([[0, 1], [2, 3], [3, 0], [1, 2]])
+    axis_idxs = np.array([[3, 2], [1, 0], [2, 1], [0, 3]])
+
+    # `residuals` has shape `(n, 4)` for each axis and side
+    diffs = frame_coords[:, frame_idxs, :] - axis_coords[:, axis_idxs, :]
+    residuals = np.linalg.norm(diffs.reshape(*diffs.shape[:2], 4), axis=-1)
+
+    if len(residuals) == 0:
+        return []
+
+    if not np.all(np.isclose(np.min(residuals, axis=-1), 0)):
         warnings.warn("The axis isn't closely aligned with any of the axes sides")
-    position = residual_positions[np.argmin(residuals)]
-    return position
+    return [side_positions[idx] for idx in np.argmin(residuals, axis=-1)]
+
+
+def quad_coords(quad: pr.Quadrilateral) -> NDArray:
+    """
+    Return the vertex coordinates of a quadrilateral
 
+    Parameters
+    ----------
+    quad: pr.Quadrilateral
+
+    Returns
+    -------
+    NDArray
+        Vertex coordinates with shape `(4, 2)`
+
+        Vertices are ordered bottom left, bottom right, top right, top left
+        (the start points of 'Line0', 'Line1', 'Line2' and 'Line3').
+    """
+    return np.array([quad[f"Line{n}/Point0"].value for n in range(4)])
 
 def width_and_height_from_quad(quad: pr.Quadrilateral) -> tuple[float, float]:
     """
@@ -224,3 +327,606 @@ def rect_from_box(
     height = ymax - ymin
 
     return (xmin, ymin, width, height)
+
+
+## Figure pools
+
+FigureStructure = tuple[str, tuple[str, ...]]
+
+class FigurePool:
+    """
+    A pool of reusable figures and axes
+
+    Creating figures and axes is a large part of rendering costs.
+    A pool keeps released figures and axes for each layout structure (figure
+    and axes keys) and reuses them for later figures with the same structure.
+    Reused figures have their artists cleared and positions re-applied with
+    `update_subplots`.
+
+    Pool figures are not registered with `pyplot` so they don't accumulate in
+    the global figure registry (and don't need `plt.close`); use
+    `Figure.savefig` to render them.
+
+    Parameters
+    ----------
+    max_size: int
+        The maximum number of released figures kept for each structure
+
+    Attributes
+    ----------
+    num_created, num_reused: int
+        The number of figures created and reused
+    """
+
+    def __init__(self, max_size: int = 4):
+        self._max_size = max_size
+        self._free: dict[FigureStructure, list[tuple["Figure", dict[str, "Axes"]]]] = {}
+        # Figures in use mapped to their structure and axes (by figure id)
+        self._in_use: dict[int, tuple[FigureStructure, "Figure", dict[str, "Axes"]]] = {}
+
+        self.num_created = 0
+        self.num_reused = 0
+
+    def __len__(self) -> int:
+        """
+        Return the number of released figures in the pool
+        """
+        return sum(len(figs) for figs in self._free.values())
+
+    def subplots(
+        self,
+        root_prim: pr.Primitive,
+        fig_key: str = "Figure",
+        axs_keys: Optional[list[str]] = None
+    ) -> tuple["Figure", dict[str, "Axes"]]:
+        """
+        Return a figure and axes from the pool positioned from primitives
+
+        Parameters and returns match `subplots`.
+        """
+        if axs_keys is None:
+            axs_keys = find_axs_keys(root_prim)
+        structure = (fig_key, tuple(axs_keys))
+
+        free_figs = self._free.get(structure, [])
+        if len(free_figs) > 0:
+            fig, axs = free_figs.pop()
+            self.num_reused += 1
+        else:
+            fig = mfigure.Figure(figsize=(1, 1))
+            axs = add_axes(fig, axs_keys)
+            self.num_created += 1
+
+        self._in_use[id(fig)] = (structure, fig, axs)
+        return update_subplots(root_prim, fig_key, fig, axs)
+
+    def release(self, fig: "Figure"):
+        """
+        Clear a figure from `FigurePool.subplots` and return it to the pool
+
+        Parameters
+        ----------
+        fig: Figure
+            The figure
+        """
+        structure, fig, axs = self._in_use.pop(id(fig))
+        free_figs = self._free.setdefault(structure, [])
+        if len(free_figs) < self._max_size:
+            clear_figure_artists(fig, axs)
+            free_figs.append((fig, axs))
+
+    @contextlib.contextmanager
+    def figure(
+        self,
+        root_prim: pr.Primitive,
+        fig_key: str = "Figure",
+        axs_keys: Optional[list[str]] = None
+    ) -> Iterator[tuple["Figure", dict[str, "Axes"]]]:
+        """
+        Return a context manager for a pool figure that is released on exit
+
+        Parameters match `subplots`.
+        """
+        fig, axs = self.subplots(root_prim, fig_key, axs_keys)
+        try:
+            yield fig, axs
+        finally:
+            self.release(fig)
+
+    def clear(self):
+        """
+        Remove all released figures from the pool
+        """
+        self._free.clear()
+
+def clear_figure_artists(fig: "Figure", axs: dict[str, "Axes"]):
+    """
+    Remove all artists from a figure and its axes but keep the axes
+
+    Axes that aren't in `axs` (for example, axes added by `Figure.colorbar`,
+    `Axes.twinx` or `Axes.inset_axes`) are removed.
+
+    Parameters
+    ----------
+    fig: Figure
+        The figure
+    axs: dict[str, Axes]
+        The figure axes
+    """
+    layout_axs = {id(ax) for ax in axs.values()}
+    # Inset axes are children of their parent axes so remove them before
+    # clearing the parent
+    for ax in list(fig.axes):
+        if id(ax) not in layout_axs:
+            ax.remove()
+    for ax in axs.values():
+        for child_ax in list(ax.child_axes):
+            child_ax.remove()
+        ax.clear()
+
+    fig_artists = (
+        fig.texts, fig.legends, fig.images, fig.lines, fig.patches, fig.artists
+    )
+    for artist in [artist for artists in fig_artists for artist in artists]:
+        artist.remove()
+
+    # `Figure.suptitle` etc. reuse existing text artists so forget removed ones
+    for name in ("_suptitle", "_supxlabel", "_supylabel"):
+        if getattr(fig, name, None) is not None:
+            setattr(fig, name, None)
+
+
+## Layouts with `matplotlib`-dependent constraints
+
+TextExtent = tuple[float, float, float]
+
+class TextExtentCache:
+    """
+    A memo of text extents (width, height and descent in pixels)
+
+    Text extents are memoized by (string, font properties, math mode, dpi).
+    A cache can be shared between renderers and figures; for example,
+    between figures made from the same layout template with the same tick
+    labels.
+
+    Attributes
+    ----------
+    hits, misses: int
+        The number of text extents found and not found in the cache
+    """
+
+    def __init__(self):
+        self._extents: dict[tuple, TextExtent] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._extents)
+
+    def memoize(self, renderer: "RendererBase") -> "RendererBase":
+        """
+        Return a renderer with memoized text extents
+
+        Parameters
+        ----------
+        renderer: RendererBase
+            The renderer
+
+            The renderer's `get_text_width_height_descent` is replaced with a
+            memoized version.
+        """
+        get_extent = renderer.get_text_width_height_descent
+
+        def get_text_width_height_descent(s, prop, ismath):
+            # `prop` is copied since `FontProperties` are mutable
+            key = (s, prop.copy(), ismath, renderer.dpi)
+            if key in self._extents:
+                self.hits += 1
+            else:
+                self.misses += 1
+                self._extents[key] = get_extent(s, prop, ismath)
+            return self._extents[key]
+
+        renderer.get_text_width_height_descent = get_text_width_height_descent
+        return renderer
+
+
+class AxisThicknessMeasurer:
+    """
+    Measure all axis thicknesses in a layout with a shared Agg renderer
+
+    Axis thickness constraints are found once when the measurer is created.
+    Each `measure` call measures all axes in one pass using a single Agg
+    renderer that is reused while the figure dpi doesn't change.
+    Text extents are memoized (see `TextExtentCache`) so unchanged tick labels
+    aren't re-measured between calls.
+
+    Parameters
+    ----------
+    constraintkey_to_axis: dict[str, tuple[str, str]]
+        A mapping of axis thickness constraint keys to axes keys and axis
+
+        See `lay.find_axis_thickness_constraints`.
+    fig: Figure
+        The figure
+    axs: dict[str, Axes]
+        The axes
+    text_cache: Optional[TextExtentCache]
+        A text extent cache
+
+        If not supplied, a new cache is used.
+    """
+
+    def __init__(
+        self,
+        constraintkey_to_axis: dict[str, tuple[str, str]],
+        fig: "Figure",
+        axs: dict[str, "Axes"],
+        text_cache: Optional[TextExtentCache] = None
+    ):
+        if text_cache is None:
+            text_cache = TextExtentCache()
+
+        self._fig = fig
+        self._text_cache = text_cache
+        self._renderer = None
+
+        self._key_to_axis = {}
+        for key, (axes_key, axis_name) in constraintkey_to_axis.items():
+            ax = axs[axes_key]
+            self._key_to_axis[key] = ax.xaxis if axis_name == 'x' else ax.yaxis
+
+    @classmethod
+    def from_layout(
+        cls,
+        layout: lay.Layout,
+        fig: "Figure",
+        axs: dict[str, "Axes"],
+        text_cache: Optional[TextExtentCache] = None
+    ) -> "AxisThicknessMeasurer":
+        """
+        Return a measurer for all axis thickness constraints in a layout
+        """
+        return cls(
+            lay.find_axis_thickness_constraints(layout), fig, axs, text_cache
+        )
+
+    @property
+    def text_cache(self) -> TextExtentCache:
+        return self._text_cache
+
+    @property
+    def renderer(self) -> "RendererBase":
+        """
+        Return the Agg renderer used for measurements
+
+        Measurements only depend on the renderer dpi (not its size), so the
+        renderer is only recreated if the figure dpi changes.
+        """
+        dpi = self._fig.dpi
+        if self._renderer is None or self._renderer.dpi != dpi:
+            width, height = self._fig.bbox.size
+            renderer = backend_agg.RendererAgg(
+                max(int(width), 1), max(int(height), 1), dpi
+            )
+            self._renderer = self._text_cache.memoize(renderer)
+        return self._renderer
+
+    def measure(self) -> dict[str, float]:
+        """
+        Return measured axis thicknesses for each axis thickness constraint
+
+        Returns
+        -------
+        dict[str, float]
+            A mapping of axis thickness constraint keys to thicknesses
+        """
+        renderer = self.renderer
+        return {
+            key: cr.get_axis_thickness(axis, axis.get_ticks_position(), renderer)
+            for key, axis in self._key_to_axis.items()
+        }
+
+def solve_axis_thickness(
+    layout: lay.Layout,
+    fig: "Figure",
+    axs: dict[str, "Axes"],
+    fig_key: str = "Figure",
+    thickness_tol: float = 1e-3,
+    max_thickness_iter: int = 5,
+    text_cache: Optional[TextExtentCache] = None,
+    **solve_kwargs
+) -> tuple[lay.Layout, pr.PrimitiveNode, solver.SolverInfo]:
+    """
+    Solve a layout with axis thickness constraints until thicknesses are stable
+
+    Axis thicknesses (see `cr.XAxisThickness` and `cr.YAxisThickness`) depend
+    on tick labels, which depend on axes sizes, which depend on the solved
+    layout.
+    This function repeatedly solves the layout, updates the figure and axes
+    and measures all axis thicknesses (see `AxisThicknessMeasurer`) until the
+    measured thicknesses change by less than `thickness_tol`.
+
+    Parameters
+    ----------
+    layout: lay.Layout
+        The layout
+    fig: Figure
+        The figure
+    axs: dict[str, Axes]
+        The axes
+
+        These should already contain any plotted data so that tick labels
+        are known.
+    fig_key: str
+        The quadrilateral key in `layout.root_prim` corresponding to the figure
+    thickness_tol: float
+        The tolerance for changes in axis thicknesses (in inches)
+    max_thickness_iter: int
+        The maximum number of solves (at least 1)
+    text_cache: Optional[TextExtentCache]
+        A text extent cache used to measure axes
+
+        This can be shared between calls for figures with similar text.
+    **solve_kwargs
+        Keyword arguments for `solver.solve`
+
+    Returns
+    -------
+    lay.Layout
+        The layout with measured axis thickness parameters
+    pr.PrimitiveNode
+        The solved primitive tree
+
+        The figure and axes are updated to match this.
+    solver.SolverInfo
+        Information about the solution
+
+        This is the information for the last solve with additional keys:
+            'thickness_errs':
+                The maximum change in axis thicknesses for each solve
+            'num_thickness_iter':
+                The number of solves
+    """
+    if max_thickness_iter < 1:
+        raise ValueError(
+            f"`max_thickness_iter` must be at least 1, not {max_thickness_iter}"
+        )
+
+    measurer = AxisThicknessMeasurer.from_layout(layout, fig, axs, text_cache)
+
+    def current_thickness(key: str) -> float:
+        (mpl_axis,) = layout.root_param[key].value
+        return cr.AxisThickness.thickness(mpl_axis)
+
+    thickness_errs = []
+    for n in range(max_thickness_iter):
+        root_prim, solve_info = solver.solve(layout, **solve_kwargs)
+        update_subplots(root_prim, fig_key, fig, axs)
+
+        thicknesses = measurer.measure()
+        thickness_err = max(
+            (
+                abs(thickness - current_thickness(key))
+                for key, thickness in thicknesses.items()
+            ),
+            default=0.0
+        )
+        thickness_errs.append(thickness_err)
+
+        # Don't update thicknesses on the last iteration so the returned
+        # layout matches the solved primitives
+        if thickness_err < thickness_tol or n == max_thickness_iter - 1:
+            break
+
+        layout = lay.update_layout_params(
+            layout,
+            {key: (thickness,) for key, thickness in thicknesses.items()}
+        )
+
+    solve_info = {
+        **solve_info,
+        "thickness_errs": thickness_errs,
+        "num_thickness_iter": n + 1
+    }
+    return layout, root_prim, solve_info
+
+def rects_from_coords(
+    coords: NDArray,
+    fig_origin: NDArray,
+    fig_size: NDArray = np.array((1, 1))
+) -> NDArray:
+    """
+    Return `rect` arrays, `(left, bottom, width, height)`, from quadrilaterals
+
+    This is a vectorized version of `rect_from_box`.
+
+    Parameters
+    ----------
+    coords: NDArray
+        Quadrilateral vertex coordinates with shape `(n, 4, 2)`
+
+        See `quad_coords` for the vertex order.
+    fig_origin: NDArray
+        Coordinates for the figure bottom left corner
+    fig_size: NDArray
+        The width and height of the figure
+
+    Returns
+    -------
+    NDArray
+        Rect arrays with shape `(n, 4)`
+    """
+    coord_botleft = (coords[:, 0, :] - fig_origin) / fig_size
+    coord_topright = (coords[:, 2, :] - fig_origin) / fig_size
+    return np.concatenate([coord_botleft, coord_topright - coord_botleft], axis=-1)
+
+
+## Batch rendering
+
+PlotFunction = Callable[["Figure", dict[str, "Axes"], Any], None]
+RenderInfo = dict[str, Any]
+
+# Rendering state for worker processes (see `_init_render_worker`)
+_render_state: dict[str, Any] = {}
+
+def iter_render_figures(
+    root_prim: pr.PrimitiveNode,
+    plot: PlotFunction,
+    items: Iterable[Any],
+    paths: Iterable[str | os.PathLike],
+    fig_key: str = "Figure",
+    axs_keys: Optional[list[str]] = None,
+    num_workers: Optional[int] = None,
+    mp_context: Optional[str] = "spawn",
+    chunksize: int = 1,
+    max_pending: Optional[int] = None,
+    **savefig_kwargs
+) -> Iterator[RenderInfo]:
+    """
+    Render and save one figure per item from a solved layout in parallel
+
+    The solved primitive tree is sent to each worker process once (as arrays,
+    see `se.encode_prim`) and each worker uses the headless 'Agg' backend.
+    For each item, a worker takes a figure and axes positioned from the
+    primitive tree (reused between items, see `FigurePool`), calls
+    `plot(fig, axs, item)` and saves the figure to the corresponding path.
+
+    Parameters
+    ----------
+    root_prim: pr.PrimitiveNode
+        The solved primitive tree
+    plot: PlotFunction
+        A function that plots an item on a figure and axes
+
+        This must be picklable (for example, a module level function).
+    items: Iterable[Any]
+        Items to plot (for example, data or plotting options)
+
+        These must be picklable.
+    paths: Iterable[str | os.PathLike]
+        Output paths for each item
+    fig_key, axs_keys:
+        Figure and axes keys (see `subplots`)
+    num_workers: Optional[int]
+        The number of worker processes
+
+        If `None`, the number of CPUs is used.
+        If `0`, figures are rendered serially in the current process with the
+        current backend.
+    mp_context: Optional[str]
+        The `multiprocessing` start method for worker processes
+
+        The default 'spawn' method avoids forking processes that have started
+        threads (for example, after `jax` is used).
+    chunksize: int
+        The number of items sent to a worker at a time
+    max_pending: Optional[int]
+        The maximum number of chunks submitted to workers but not yet yielded
+
+        Items are only taken from `items` as earlier results are yielded, so
+        memory use is bounded for long (or infinite) iterables.
+        If `None`, this is twice the number of workers.
+    **savefig_kwargs
+        Keyword arguments for `Figure.savefig`
+
+    Yields
+    ------
+    RenderInfo
+        Information about each rendered figure (in order of `items`)
+
+        This has keys:
+            'index': the item index,
+            'path': the output path,
+            'pid': the rendering process id,
+            'subplots_time', 'plot_time', 'save_time', 'total_time':
+                times (in seconds) to position, plot, save and render the figure
+    """
+    prim_arrays = se.encode_prim(root_prim)
+    state_args = (prim_arrays, plot, fig_key, axs_keys, savefig_kwargs)
+    tasks = zip(itertools.count(), items, paths)
+
+    if num_workers == 0:
+        state = _make_render_state(*state_args)
+        for task in tasks:
+            yield _render_figure(state, task)
+    else:
+        if num_workers is None:
+            num_workers = os.cpu_count() or 1
+        if max_pending is None:
+            max_pending = 2*num_workers
+
+        executor = concurrent.futures.ProcessPoolExecutor(
+            num_workers,
+            mp_context=multiprocessing.get_context(mp_context),
+            initializer=_init_render_worker,
+            initargs=state_args
+        )
+        chunks = iter(lambda: list(itertools.islice(tasks, chunksize)), [])
+        with executor:
+            pending = collections.deque()
+            for chunk in chunks:
+                pending.append(executor.submit(_render_worker_chunk, chunk))
+                if len(pending) >= max_pending:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+def render_figures(*args, **kwargs) -> list[RenderInfo]:
+    """
+    Render and save one figure per item from a solved layout in parallel
+
+    This returns a list of rendering information once all figures are saved.
+    See `iter_render_figures` for parameters.
+    """
+    return list(iter_render_figures(*args, **kwargs))
+
+def _make_render_state(
+    prim_arrays: se.Arrays,
+    plot: PlotFunction,
+    fig_key: str,
+    axs_keys: Optional[list[str]],
+    savefig_kwargs: dict[str, Any]
+) -> dict[str, Any]:
+    return {
+        "root_prim": se.decode_prim(prim_arrays),
+        "plot": plot,
+        "fig_key": fig_key,
+        "axs_keys": axs_keys,
+        "savefig_kwargs": savefig_kwargs,
+        "pool": FigurePool(max_size=1)
+    }
+
+def _init_render_worker(*state_args):
+    mpl.use("Agg")
+    _render_state.update(_make_render_state(*state_args))
+
+def _render_worker_chunk(
+    tasks: list[tuple[int, Any, str | os.PathLike]]
+) -> list[RenderInfo]:
+    return [_render_figure(_render_state, task) for task in tasks]
+
+def _render_figure(
+    state: dict[str, Any], task: tuple[int, Any, str | os.PathLike]
+) -> RenderInfo:
+    index, item, path = task
+
+    pool: FigurePool = state["pool"]
+    time_start = time.perf_counter()
+    fig_context = pool.figure(state["root_prim"], state["fig_key"], state["axs_keys"])
+    with fig_context as (fig, axs):
+        time_subplots = time.perf_counter()
+        state["plot"](fig, axs, item)
+        time_plot = time.perf_counter()
+        fig.savefig(path, **state["savefig_kwargs"])
+        time_save = time.perf_counter()
+
+    return {
+        "index": index,
+        "path": os.fspath(path),
+        "pid": os.getpid(),
+        "subplots_time": time_subplots - time_start,
+        "plot_time": time_plot - time_subplots,
+        "save_time": time_save - time_plot,
+        "total_time": time_save - time_start
+    }
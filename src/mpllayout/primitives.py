@@ -5,12 +5,16 @@ Geometric primitive definitions
 from typing import Optional, TypeVar, Any
 from numpy.typing import NDArray
 
+import hashlib
+
 import numpy as np
-import jax
 
+from . import lazy
 # from .containers import Node, _make_flatten_unflatten, iter_flat, unflatten, FlatNodeStructure
 import mpllayout.containers as cn
 
+jax = lazy.LazyModule("jax")
+
 
 ## Generic primitive class/interface
 # You can create specific primitive definitions by inheriting from these and
@@ -102,11 +106,18 @@ class PrimitiveNode(cn.Node[NDArray[np.float64]]):
             ``(param_size, prim_types) = signature``,
         where `param_size` is the size of the parameter vector and `prim_types`
         indicates valid child primitives.
+    derived_children: bool
+        Whether child prims are derived from the parameter vector
+
+        Derived child prims don't have independent parameters (see
+        `filter_unique_values_from_prim`) and are rebuilt from the parameter
+        vector with `derive_children`.
     """
 
     # NOTE: I used `None` to indicate `PrimitiveNode` because the name isn't
     # available within the class itself
     signature: PrimNodeSignature = (0, (None, ...))
+    derived_children: bool = False
 
     def __init__(self, value: PrimValue, children: dict[str, TPrim]):
 
@@ -144,6 +155,27 @@ class PrimitiveNode(cn.Node[NDArray[np.float64]]):
 
         super().__init__(value, children)
 
+    @classmethod
+    def derive_children(cls, value: PrimValue) -> dict[str, TPrim]:
+        """
+        Return child primitives derived from a parameter vector
+
+        This is only defined for primitives with `derived_children`.
+
+        Parameters
+        ----------
+        value: PrimValue
+            The parameter vector
+
+        Returns
+        -------
+        dict[str, TPrim]
+            Child primitives
+        """
+        raise NotImplementedError(
+            f"{cls.__name__} doesn't derive child primitives"
+        )
+
 
 class Primitive(PrimitiveNode):
     """
@@ -179,7 +211,10 @@ class Primitive(PrimitiveNode):
             value = self.default_value(**kwargs)
         elif isinstance(value, (list, tuple)):
             value = np.array(value)
-        elif isinstance(value, (np.ndarray, jax.numpy.ndarray)):
+        elif isinstance(value, np.ndarray):
+            value = value
+        elif jax.is_loaded and isinstance(value, jax.numpy.ndarray):
+            # A jax array can only be passed if `jax` is already imported
             value = value
         else:
             raise TypeError()
@@ -424,6 +459,276 @@ class Quadrilateral(Polygon):
         ys = [0, 0, 1, 1]
         return [Point((x, y)) for x, y in zip(xs, ys)]
 
+
+class Rectangle(Quadrilateral):
+    """
+    An axis-aligned rectangle
+
+    A rectangle is parameterized by its bottom left corner, width and height
+    rather than by its vertices.
+    Child lines and points are the same as for a `Quadrilateral` but are
+    derived from the rectangle parameters so they don't add parameters to a
+    solve.
+    A rectangle is always a box so it doesn't need a `Box` constraint.
+
+    Child primitives are derived when the rectangle is created so changing
+    child values doesn't change the rectangle.
+
+    Parameters
+    ----------
+    value: Optional[NDArray] with shape (4,)
+        The bottom left corner coordinates, width and height,
+        `(x0, y0, width, height)`
+    """
+
+    signature = (4, (Line, Line, Line, Line))
+    derived_children = True
+
+    def __init__(self, value: Optional[NDArray] = None):
+        if value is None:
+            value = self.default_value()
+        elif isinstance(value, (list, tuple)):
+            value = np.array(value)
+        super().__init__(value, [Point(coord) for coord in rectangle_vertices(value)])
+
+    @classmethod
+    def derive_children(cls, value: PrimValue) -> dict[str, TPrim]:
+        points = [
+            Point.from_tree(coord, {}) for coord in rectangle_vertices(value)
+        ]
+        return {
+            f"Line{n}": Line.from_tree(
+                np.array(()), {"Point0": pointa, "Point1": pointb}
+            )
+            for n, (pointa, pointb)
+            in enumerate(zip(points, points[1:] + points[:1]))
+        }
+
+    @classmethod
+    def default_value(cls, size: int=4):
+        return np.array([0.0, 0.0, 1.0, 1.0])
+
+def rectangle_vertices(value: PrimValue) -> list[PrimValue]:
+    """
+    Return rectangle vertices from rectangle parameters
+
+    Parameters
+    ----------
+    value: PrimValue with shape (4,)
+        The bottom left corner coordinates, width and height
+
+    Returns
+    -------
+    list[PrimValue]
+        The bottom left, bottom right, top right and top left vertices
+    """
+    origin = value[:2]
+    width = value[2] * np.array([1, 0])
+    height = value[3] * np.array([0, 1])
+    return [origin, origin + width, origin + width + height, origin + height]
+
+class RigidBlock(Primitive):
+    """
+    A rigid (or uniformly scalable) copy of a solved primitive tree
+
+    A rigid block places a template primitive tree, usually a solved
+    sub-layout, with a translation and optional scale.
+    Child primitives are the template root's children and are derived from the
+    block parameters so they don't add parameters to a solve.
+
+    Rigid blocks for a template are created with a block type from
+    `make_rigid_block_type`.
+
+    Parameters
+    ----------
+    value: Optional[NDArray] with shape (2,) or (3,)
+        The coordinates of the template origin, `(x, y)`, and the scale, `s`,
+        for scalable blocks, `(x, y, s)`
+
+    Attributes
+    ----------
+    template: list[cn.FlatNodeStructure]
+        The flat template primitive tree with coordinates relative to the
+        template origin
+    origin: NDArray
+        The template origin
+    scalable: bool
+        Whether the block has a scale parameter
+    """
+
+    signature = (2, (None, ...))
+    derived_children = True
+
+    template: list[cn.FlatNodeStructure] = []
+    origin: NDArray = np.zeros(2)
+    scalable: bool = False
+
+    def __init__(self, value: Optional[NDArray] = None):
+        if self.template == []:
+            raise TypeError(
+                "`RigidBlock` must be created from a type from `make_rigid_block_type`"
+            )
+        if value is None:
+            value = self.default_value()
+        elif isinstance(value, (list, tuple)):
+            value = np.array(value)
+        super().__init__(value, list(self.derive_children(value).values()))
+
+    @classmethod
+    def derive_children(cls, value: PrimValue) -> dict[str, TPrim]:
+        """
+        Return child primitives placed with the block parameters
+
+        Parameters
+        ----------
+        value: PrimValue
+            The block parameters
+
+        Returns
+        -------
+        dict[str, TPrim]
+            Child primitives
+        """
+        translation = value[:2]
+        scale = value[2] if cls.scalable else 1.0
+        # This maps a translation to rectangle parameters, `(x0, y0, 0, 0)`
+        rect_translation = np.eye(4, 2)
+
+        placed_structs = []
+        for key, PrimType, rel_value, child_keys in cls.template:
+            if issubclass(PrimType, Point):
+                new_value = translation + scale * rel_value
+            elif issubclass(PrimType, Rectangle):
+                new_value = rect_translation @ translation + scale * rel_value
+            else:
+                new_value = rel_value
+            placed_structs.append((key, PrimType, new_value, child_keys))
+        return cn.unflatten(placed_structs)[0].children
+
+    @classmethod
+    def init_children(cls, prims: list[TPrim]):
+        return list(cls.template[0][3]), prims
+
+    @classmethod
+    def default_value(cls):
+        if cls.scalable:
+            return np.concatenate([cls.origin, [1.0]])
+        else:
+            return np.array(cls.origin)
+
+def make_rigid_block_type(
+    root_prim: PrimitiveNode,
+    origin: Optional[NDArray] = None,
+    scalable: bool = False
+) -> type[RigidBlock]:
+    """
+    Return a `RigidBlock` type placing copies of a primitive tree
+
+    Parameters
+    ----------
+    root_prim: PrimitiveNode
+        The template primitive tree
+
+        Primitives with values must be `Point`s or `Rectangle`s (or derived
+        from these).
+    origin: Optional[NDArray]
+        The template origin (the point placed by the block translation)
+
+        This defaults to `(0, 0)`.
+    scalable: bool
+        Whether the block has a scale parameter
+
+    Returns
+    -------
+    type[RigidBlock]
+        The block type
+
+        Instances of the type with the default value have the same geometry
+        as `root_prim`.
+    """
+    origin = np.zeros(2) if origin is None else np.array(origin, dtype=float)
+
+    rect_origin = np.concatenate([origin, [0, 0]])
+    template = []
+    for key, PrimType, value, child_keys in cn.flatten("", root_prim):
+        value = np.array(value, dtype=float)
+        if issubclass(PrimType, Point):
+            value = value - origin
+        elif issubclass(PrimType, Rectangle):
+            value = value - rect_origin
+        elif value.size != 0:
+            raise ValueError(
+                f"Can't place primitive {key} of type {PrimType.__name__}"
+            )
+        template.append((key, PrimType, value, child_keys))
+
+    return make_rigid_block_type_from_template(template, origin, scalable)
+
+# Rigid block types by name so the same template gives the same type
+_RIGID_BLOCK_TYPES: dict[str, type[RigidBlock]] = {}
+
+def make_rigid_block_type_from_template(
+    template: list[cn.FlatNodeStructure],
+    origin: NDArray,
+    scalable: bool = False
+) -> type[RigidBlock]:
+    """
+    Return a `RigidBlock` type from a template
+
+    Types are created once for each template, so calls with an equal template
+    return the same type (for example, when loading stored blocks).
+
+    Parameters
+    ----------
+    template: list[cn.FlatNodeStructure]
+        The flat template primitive tree with coordinates relative to the
+        template origin (see `RigidBlock.template`)
+    origin: NDArray
+        The template origin
+    scalable: bool
+        Whether the block has a scale parameter
+
+    Returns
+    -------
+    type[RigidBlock]
+        The block type
+    """
+    origin = np.array(origin, dtype=float)
+    template = [
+        (key, PrimType, np.array(value, dtype=float), list(child_keys))
+        for key, PrimType, value, child_keys in template
+    ]
+
+    # Block types are named by their template so different templates are
+    # distinguished (for example, in `cache.fingerprint`)
+    hasher = hashlib.blake2b(digest_size=8)
+    hasher.update(repr((origin.tolist(), bool(scalable))).encode())
+    for key, PrimType, value, _ in template:
+        hasher.update(f"{key}:{PrimType.__qualname__}".encode())
+        hasher.update(value.tobytes())
+    name = f"RigidBlock_{hasher.hexdigest()}"
+
+    if name not in _RIGID_BLOCK_TYPES:
+        root_key, _, _, root_child_keys = template[0]
+        key_to_type = {key: PrimType for key, PrimType, *_ in template}
+        child_types = tuple(
+            key_to_type[f"{root_key}/{key}"] for key in root_child_keys
+        )
+        BlockType = type(
+            name,
+            (RigidBlock,),
+            {
+                "signature": (3 if scalable else 2, child_types),
+                "template": template,
+                "origin": origin,
+                "scalable": bool(scalable),
+            }
+        )
+        cn.register_pytree_node_types(BlockType)
+        _RIGID_BLOCK_TYPES[name] = BlockType
+    return _RIGID_BLOCK_TYPES[name]
+
+
 AxisPrims = tuple[Quadrilateral, Point]
 AxesChildPrims = (
     tuple[Quadrilateral]
@@ -567,13 +872,11 @@ _PrimitiveClasses = [
     Line,
     Polygon,
     Quadrilateral,
+    Rectangle,
+    RigidBlock,
     Axes,
 ]
-for _PrimitiveClass in _PrimitiveClasses:
-    _flatten_primitive, _unflatten_primitive = cn._make_flatten_unflatten(_PrimitiveClass)
-    jax.tree_util.register_pytree_node(
-        _PrimitiveClass, _flatten_primitive, _unflatten_primitive
-    )
+cn.register_pytree_node_types(*_PrimitiveClasses)
 
 
 ## Primitive value vector methods
@@ -582,6 +885,7 @@ for _PrimitiveClass in _PrimitiveClasses:
 
 def filter_unique_values_from_prim(
     root_prim: Primitive,
+    merge_keys: Optional[list[tuple[str, str]]] = None
 ) -> tuple[dict[str, int], list[Primitive]]:
     """
     Return unique primitives from a root primitive and indicate their indices
@@ -592,6 +896,22 @@ def filter_unique_values_from_prim(
     When solving a set of geometric constraints, the geometric constraint
     residual should be linked to a function of unique primitives only.
 
+    Primitives derived from a parent primitive's parameters (see
+    `PrimitiveNode.derived_children`) map to the parent's unique primitive
+    index.
+
+    Parameters
+    ----------
+    root_prim: Primitive
+        The root primitive
+    merge_keys: Optional[list[tuple[str, str]]]
+        Pairs of primitive keys to merge into one unique primitive
+
+        Merged primitives (for example, coincident points) share a unique
+        primitive whose value is the mean of the merged primitive values.
+        Pairs of primitives with different value shapes or that are derived
+        from a parent primitive aren't merged.
+
     Returns
     -------
     prim_to_idx: dict[str, int]
@@ -602,8 +922,19 @@ def filter_unique_values_from_prim(
     value_id_to_idx = {}
     values = []
     prim_to_idx = {}
+    derived_keys = set()
+
+    # The key prefix and value index of the current primitive with derived
+    # children
+    derived_prefix = None
+    derived_idx = None
 
     for key, prim in cn.iter_flat("", root_prim):
+        if derived_prefix is not None and key.startswith(derived_prefix):
+            prim_to_idx[key] = derived_idx
+            derived_keys.add(key)
+            continue
+
         value_id = id(prim.value)
 
         if value_id not in value_id_to_idx:
@@ -615,7 +946,51 @@ def filter_unique_values_from_prim(
 
         prim_to_idx[key] = value_idx
 
-    return prim_to_idx, values
+        if getattr(prim, "derived_children", False):
+            derived_prefix = f"{key}/"
+            derived_idx = value_idx
+        else:
+            derived_prefix = None
+
+    if merge_keys is None:
+        return prim_to_idx, values
+
+    ## Merge unique values with union-find
+    parents = list(range(len(values)))
+
+    def find(idx: int) -> int:
+        root_idx = idx
+        while parents[root_idx] != root_idx:
+            root_idx = parents[root_idx]
+        # Compress the path to the root
+        while parents[idx] != root_idx:
+            parents[idx], idx = root_idx, parents[idx]
+        return root_idx
+
+    for key_a, key_b in merge_keys:
+        if key_a in derived_keys or key_b in derived_keys:
+            continue
+        idx_a, idx_b = find(prim_to_idx[key_a]), find(prim_to_idx[key_b])
+        if idx_a != idx_b and np.shape(values[idx_a]) == np.shape(values[idx_b]):
+            parents[max(idx_a, idx_b)] = min(idx_a, idx_b)
+
+    roots = [find(idx) for idx in range(len(values))]
+    root_to_new_idx = {}
+    groups = []
+    for idx, root_idx in enumerate(roots):
+        if root_idx not in root_to_new_idx:
+            root_to_new_idx[root_idx] = len(groups)
+            groups.append([])
+        groups[root_to_new_idx[root_idx]].append(values[idx])
+
+    merged_values = [
+        group[0] if len(group) == 1 else np.mean(group, axis=0)
+        for group in groups
+    ]
+    merged_prim_to_idx = {
+        key: root_to_new_idx[roots[idx]] for key, idx in prim_to_idx.items()
+    }
+    return merged_prim_to_idx, merged_values
 
 def build_prim_from_unique_values(
     flat_prim: list[cn.FlatNodeStructure], prim_to_idx: dict[str, int], values: list[NDArray]
@@ -636,13 +1011,33 @@ def build_prim_from_unique_values(
     -------
     Primitive
         The new primitive with updated values
-    """
-    prim_keys = (flat_struct[0] for flat_struct in flat_prim)
-    new_prim_values = (values[prim_to_idx[key]] for key in prim_keys)
 
-    new_prim_structs = [
-        (prim_key, PrimType, new_value, child_keys)
-        for (prim_key, PrimType, _old_value, child_keys), new_value
-        in zip(flat_prim, new_prim_values)
-    ]
-    return cn.unflatten(new_prim_structs)[0]
+        Children of primitives with `derived_children` are rebuilt from the
+        parent's new value with `derive_children`.
+    """
+    return _build_prim_from_unique_values(flat_prim, prim_to_idx, values, 0)[0]
+
+def _build_prim_from_unique_values(
+    flat_prim: list[cn.FlatNodeStructure],
+    prim_to_idx: dict[str, int],
+    values: list[NDArray],
+    idx: int
+) -> tuple[Primitive, int]:
+    # Like `cn.unflatten`, nodes are indexed rather than sliced from `flat_prim`
+    prim_key, PrimType, _old_value, child_keys = flat_prim[idx]
+    value = values[prim_to_idx[prim_key]]
+
+    idx = idx + 1
+    if getattr(PrimType, "derived_children", False):
+        # Skip the flat structures of derived children
+        prefix = f"{prim_key}/"
+        while idx < len(flat_prim) and flat_prim[idx][0].startswith(prefix):
+            idx = idx + 1
+        children = PrimType.derive_children(value)
+    else:
+        children = {}
+        for child_key in child_keys:
+            children[child_key], idx = _build_prim_from_unique_values(
+                flat_prim, prim_to_idx, values, idx
+            )
+    return PrimType.from_tree(value, children), idx
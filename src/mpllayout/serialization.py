@@ -0,0 +1,692 @@
+"""
+Binary serialization of primitive trees and layouts
+
+Primitive trees are stored using the flat node structures from
+`containers.flatten` as a set of numpy arrays:
+- node keys and primitive class names are interned into string tables,
+- unique primitive values (see `pr.filter_unique_values_from_prim`) are
+    stored contiguously in a single `float64` array.
+
+The arrays are written to an uncompressed `.npz` file which doesn't need
+`pickle` to load.
+Primitive classes are stored by name and only classes in a registry of known
+primitive types are loaded (see `register_prim_type`), so loading a file
+can't import or call arbitrary code.
+Rigid block classes (see `pr.make_rigid_block_type`) are created at runtime
+so their templates are stored instead and the classes are rebuilt on load.
+Loaded primitive values are views into the contiguous value array and
+primitive values that are shared in the original tree (for example, polygon
+vertices) are shared in the loaded tree.
+
+Constraints are trees of dynamically generated construction classes and
+can't be stored as data.
+A stored `Layout` contains the primitive tree, the primitive keys and
+parameters of each top-level constraint; the constraints themselves must be
+supplied when the layout is loaded (see `load_layout`).
+"""
+
+from typing import Any, BinaryIO, Iterator
+from numpy.typing import NDArray
+
+import os
+import itertools
+
+import numpy as np
+
+from . import primitives as pr
+from . import constraints as cr
+from . import containers as cn
+from . import layout as lay
+
+# Increment this if the array format changes
+FORMAT_VERSION = 1
+
+File = str | os.PathLike | BinaryIO
+Arrays = dict[str, NDArray]
+
+
+class StringTable:
+    """
+    A table of unique (interned) strings
+
+    Parameters
+    ----------
+    strings: Optional[list[str]]
+        Initial strings in the table
+
+    Attributes
+    ----------
+    strings: list[str]
+        The unique strings in the order they were added
+    """
+
+    def __init__(self, strings: list[str] | None = None):
+        self._strings = []
+        self._string_to_idx = {}
+        if strings is not None:
+            for string in strings:
+                self.add(string)
+
+    @property
+    def strings(self) -> list[str]:
+        return self._strings
+
+    def __contains__(self, string: str) -> bool:
+        return string in self._string_to_idx
+
+    def add(self, string: str) -> int:
+        """
+        Add a string (if it doesn't exist) and return its index
+        """
+        if string not in self._string_to_idx:
+            self._string_to_idx[string] = len(self._strings)
+            self._strings.append(string)
+        return self._string_to_idx[string]
+
+    def to_array(self) -> NDArray:
+        return np.array(self._strings, dtype=str)
+
+
+## Primitive tree serialization
+
+def class_path(cls: type) -> str:
+    """
+    Return an importable path, 'module:qualname', for a class
+    """
+    return f"{cls.__module__}:{cls.__qualname__}"
+
+# Primitive types that can be loaded, keyed by their class path
+_PRIM_TYPES: dict[str, type[pr.PrimitiveNode]] = {}
+
+def register_prim_type(PrimType: type[pr.PrimitiveNode]):
+    """
+    Register a primitive class so it can be loaded (see `prim_type_from_path`)
+
+    Built-in primitive classes are registered when this module is imported.
+    Custom primitive classes must be registered before loading files that
+    contain them (including in worker processes).
+    """
+    if not (isinstance(PrimType, type) and issubclass(PrimType, pr.PrimitiveNode)):
+        raise TypeError(f"{PrimType} is not a `PrimitiveNode` subclass")
+    _PRIM_TYPES[class_path(PrimType)] = PrimType
+
+def prim_type_from_path(path: str) -> type[pr.PrimitiveNode]:
+    """
+    Return a registered primitive class from its path (see `class_path`)
+    """
+    try:
+        return _PRIM_TYPES[path]
+    except KeyError as err:
+        raise ValueError(
+            f"Unknown primitive type {path!r}; custom primitive types must be "
+            "registered with `register_prim_type`"
+        ) from err
+
+for _PrimType in pr._PrimitiveClasses:
+    register_prim_type(_PrimType)
+
+def encode_prim(root_prim: pr.PrimitiveNode, prefix: str = "prim_") -> Arrays:
+    """
+    Return arrays representing a primitive tree
+
+    Parameters
+    ----------
+    root_prim: pr.PrimitiveNode
+        The primitive tree
+    prefix: str
+        A prefix for the array names
+
+    Returns
+    -------
+    Arrays
+        A dictionary of named arrays
+
+        Nodes are ordered depth-first (see `containers.flatten`) and the arrays
+        are:
+            'types': The table of primitive class paths
+            'names': The table of node names
+            'node_type': The class index of each node in 'types'
+            'node_name': The name index of each node in 'names'
+            'node_num_child': The number of child nodes of each node
+            'node_value': The unique value index of each node
+            'value_bounds': The bounds of each unique value in 'values'
+            'values': All unique values concatenated
+        and rigid block templates are stored in arrays prefixed by 'block_'
+        (see `encode_block_types`).
+    """
+    flat_prim = cn.flatten("", root_prim)
+    prim_to_idx, values = pr.filter_unique_values_from_prim(root_prim)
+
+    types = StringTable()
+    names = StringTable()
+    block_types = {}
+    node_type = [
+        add_prim_type(types, block_types, PrimType) for _, PrimType, *_ in flat_prim
+    ]
+    node_name = [names.add(key.split("/")[-1]) for key, *_ in flat_prim]
+    node_num_child = [len(child_keys) for *_, child_keys in flat_prim]
+    node_value = [prim_to_idx[key] for key, *_ in flat_prim]
+    # This adds template strings so it must be done before the tables are stored
+    block_arrays = encode_block_types(types, names, block_types)
+
+    value_bounds = np.cumsum([0] + [np.size(value) for value in values])
+    if len(values) == 0:
+        cat_values = np.zeros(0)
+    else:
+        cat_values = np.concatenate([np.ravel(value) for value in values])
+
+    arrays = {
+        "types": types.to_array(),
+        "names": names.to_array(),
+        "node_type": np.array(node_type, dtype=np.int32),
+        "node_name": np.array(node_name, dtype=np.int32),
+        "node_num_child": np.array(node_num_child, dtype=np.int32),
+        "node_value": np.array(node_value, dtype=np.int32),
+        "value_bounds": np.array(value_bounds, dtype=np.int64),
+        "values": np.asarray(cat_values, dtype=np.float64),
+        **block_arrays
+    }
+    return {f"{prefix}{key}": array for key, array in arrays.items()}
+
+def decode_prim(arrays: Arrays, prefix: str = "prim_") -> pr.PrimitiveNode:
+    """
+    Return a primitive tree from its array representation
+
+    Parameters
+    ----------
+    arrays: Arrays
+        Arrays representing the primitive tree (see `encode_prim`)
+    prefix: str
+        The prefix for the array names
+
+    Returns
+    -------
+    pr.PrimitiveNode
+        The primitive tree
+    """
+    names = [str(name) for name in arrays[f"{prefix}names"]]
+    types = decode_types(arrays, names, prefix)
+    node_type = arrays[f"{prefix}node_type"]
+    node_name = arrays[f"{prefix}node_name"]
+    node_num_child = arrays[f"{prefix}node_num_child"]
+    node_value = arrays[f"{prefix}node_value"]
+    value_bounds = arrays[f"{prefix}value_bounds"]
+    cat_values = arrays[f"{prefix}values"]
+
+    values = [
+        cat_values[start:stop]
+        for start, stop in zip(value_bounds[:-1], value_bounds[1:])
+    ]
+
+    # Recover full node keys and child keys from the depth-first node order
+    num_node = len(node_type)
+    keys = []
+    child_keys = [[] for _ in range(num_node)]
+    # `parents` is a stack of [node index, number of children left to visit]
+    parents = []
+    for n in range(num_node):
+        name = names[node_name[n]]
+        if len(parents) == 0:
+            key = name
+        else:
+            parent = parents[-1]
+            child_keys[parent[0]].append(name)
+            key = f"{keys[parent[0]]}/{name}"
+            parent[1] -= 1
+            if parent[1] == 0:
+                parents.pop()
+        keys.append(key)
+
+        if node_num_child[n] > 0:
+            parents.append([n, int(node_num_child[n])])
+
+    flat_prim = [
+        (key, types[type_idx], None, ckeys)
+        for key, type_idx, ckeys in zip(keys, node_type, child_keys)
+    ]
+    prim_to_idx = {key: int(idx) for key, idx in zip(keys, node_value)}
+    return pr.build_prim_from_unique_values(flat_prim, prim_to_idx, values)
+
+def add_prim_type(
+    types: StringTable,
+    block_types: dict[int, type[pr.RigidBlock]],
+    PrimType: type[pr.PrimitiveNode]
+) -> int:
+    """
+    Add a primitive class to a type table and return its index
+
+    Rigid block classes are also added to `block_types`. Classes in their
+    templates are added first so they can be rebuilt in table order.
+    """
+    path = class_path(PrimType)
+    if path in types:
+        return types.add(path)
+
+    if issubclass(PrimType, pr.RigidBlock):
+        for _, ChildType, *_ in PrimType.template:
+            add_prim_type(types, block_types, ChildType)
+        idx = types.add(path)
+        block_types[idx] = PrimType
+    else:
+        idx = types.add(path)
+    return idx
+
+def encode_block_types(
+    types: StringTable,
+    names: StringTable,
+    block_types: dict[int, type[pr.RigidBlock]]
+) -> Arrays:
+    """
+    Return arrays representing rigid block templates
+
+    Template nodes are stored in their flat order (see `RigidBlock.template`)
+    and the arrays are:
+        'block_type': The class index of each block in 'types'
+        'block_origin': The template origin of each block
+        'block_scalable': Whether each block is scalable
+        'block_node_bounds': The bounds of each block's template nodes
+        'block_node_type': The class index of each template node
+        'block_node_key': The key index of each template node in 'names'
+        'block_child_bounds': The bounds of each template node's child keys
+        'block_child_key': The name index of each child key in 'names'
+        'block_value_bounds': The bounds of each template node value
+        'block_values': All template node values concatenated
+    """
+    block_type = []
+    block_origin = []
+    block_scalable = []
+    node_bounds = [0]
+    node_type = []
+    node_key = []
+    child_bounds = [0]
+    child_key = []
+    value_bounds = [0]
+    values = []
+    for type_idx, BlockType in block_types.items():
+        block_type.append(type_idx)
+        block_origin.append(BlockType.origin)
+        block_scalable.append(BlockType.scalable)
+        for key, PrimType, value, child_keys in BlockType.template:
+            node_type.append(types.add(class_path(PrimType)))
+            node_key.append(names.add(key))
+            child_key += [names.add(child) for child in child_keys]
+            child_bounds.append(len(child_key))
+            values.append(np.ravel(value))
+            value_bounds.append(value_bounds[-1] + np.size(value))
+        node_bounds.append(len(node_type))
+
+    return {
+        "block_type": np.array(block_type, dtype=np.int32),
+        "block_origin": np.array(block_origin, dtype=np.float64).reshape(-1, 2),
+        "block_scalable": np.array(block_scalable, dtype=bool),
+        "block_node_bounds": np.array(node_bounds, dtype=np.int64),
+        "block_node_type": np.array(node_type, dtype=np.int32),
+        "block_node_key": np.array(node_key, dtype=np.int32),
+        "block_child_bounds": np.array(child_bounds, dtype=np.int64),
+        "block_child_key": np.array(child_key, dtype=np.int32),
+        "block_value_bounds": np.array(value_bounds, dtype=np.int64),
+        "block_values": np.concatenate([np.zeros(0)] + values).astype(np.float64),
+    }
+
+def decode_types(
+    arrays: Arrays, names: list[str], prefix: str = "prim_"
+) -> list[type[pr.PrimitiveNode]]:
+    """
+    Return the primitive classes of a type table
+
+    Registered classes are looked up (see `prim_type_from_path`) and rigid
+    block classes are rebuilt from their templates (see `encode_block_types`).
+    """
+    paths = [str(path) for path in arrays[f"{prefix}types"]]
+    block_type = arrays.get(f"{prefix}block_type", np.zeros(0, dtype=np.int32))
+    type_to_block = {int(type_idx): n for n, type_idx in enumerate(block_type)}
+
+    types = []
+    for type_idx, path in enumerate(paths):
+        if type_idx not in type_to_block:
+            types.append(prim_type_from_path(path))
+            continue
+
+        n = type_to_block[type_idx]
+        node_bounds = arrays[f"{prefix}block_node_bounds"]
+        child_bounds = arrays[f"{prefix}block_child_bounds"]
+        value_bounds = arrays[f"{prefix}block_value_bounds"]
+        template = []
+        for m in range(node_bounds[n], node_bounds[n+1]):
+            node_type_idx = int(arrays[f"{prefix}block_node_type"][m])
+            if node_type_idx >= type_idx:
+                raise ValueError(f"Invalid rigid block template for {path!r}")
+            child_keys = [
+                names[idx] for idx in
+                arrays[f"{prefix}block_child_key"][child_bounds[m]:child_bounds[m+1]]
+            ]
+            value = arrays[f"{prefix}block_values"][value_bounds[m]:value_bounds[m+1]]
+            template.append((
+                names[arrays[f"{prefix}block_node_key"][m]],
+                types[node_type_idx],
+                value,
+                child_keys
+            ))
+
+        BlockType = pr.make_rigid_block_type_from_template(
+            template,
+            arrays[f"{prefix}block_origin"][n],
+            bool(arrays[f"{prefix}block_scalable"][n])
+        )
+        if class_path(BlockType) != path:
+            raise ValueError(f"Rigid block template doesn't match {path!r}")
+        types.append(BlockType)
+    return types
+
+def save_prim(file: File, root_prim: pr.PrimitiveNode):
+    """
+    Save a primitive tree to a `.npz` file
+
+    Parameters
+    ----------
+    file: File
+        The file name or file object
+    root_prim: pr.PrimitiveNode
+        The primitive tree
+    """
+    arrays = encode_prim(root_prim)
+    np.savez(file, format_version=FORMAT_VERSION, **arrays)
+
+def load_prim(file: File) -> pr.PrimitiveNode:
+    """
+    Load a primitive tree from a `.npz` file
+
+    Parameters
+    ----------
+    file: File
+        The file name or file object
+
+    Returns
+    -------
+    pr.PrimitiveNode
+        The primitive tree
+    """
+    with np.load(file, allow_pickle=False) as arrays:
+        validate_version(arrays)
+        return decode_prim(dict(arrays))
+
+def validate_version(arrays: Arrays):
+    """
+    Raise an exception if arrays have an unsupported format version
+    """
+    if "format_version" not in arrays:
+        raise ValueError("Missing format version")
+
+    version = int(arrays["format_version"])
+    if version != FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported format version {version}; expected {FORMAT_VERSION}"
+        )
+
+
+## Layout serialization
+
+# Parameter kinds
+(
+    PARAM_NONE, PARAM_FLOAT, PARAM_INT, PARAM_BOOL, PARAM_ARRAY, PARAM_LIST,
+    PARAM_TUPLE, PARAM_SCALAR
+) = range(8)
+
+# An encoded parameter entry with a kind, dtype, shape and values
+ParamEntry = tuple[int, str, tuple[int, ...], NDArray]
+
+def encode_param(param: Any) -> list[ParamEntry]:
+    """
+    Return entries representing a constraint parameter
+
+    Parameters must be `None`, numbers, numeric arrays or (nested) lists and
+    tuples of these.
+    Other parameters (for example, `matplotlib` axis objects) raise a
+    `TypeError` since they can't be stored; replace them by numeric values
+    (for example, a measured axis thickness) before saving.
+
+    Python numbers, `numpy` scalars and arrays keep their type (and dtype)
+    and lists and tuples are stored element by element so decoded parameters
+    compare (and hash, see `cache.fingerprint`) equal to the originals.
+
+    Returns
+    -------
+    list[ParamEntry]
+        Entries of the kind, dtype, shape and values of the parameter
+
+        A list or tuple entry has the sequence length as its shape and is
+        followed by entries for its elements.
+    """
+    float_dtype = np.dtype(np.float64).str
+    if param is None:
+        return [(PARAM_NONE, float_dtype, (0,), np.zeros(0))]
+    # `numpy` scalars are checked first since `np.float64` is a `float`
+    elif isinstance(param, np.generic):
+        kind = PARAM_SCALAR
+    elif isinstance(param, bool):
+        return [(PARAM_BOOL, float_dtype, (1,), np.array([param], dtype=np.float64))]
+    elif isinstance(param, int):
+        return [(PARAM_INT, float_dtype, (1,), np.array([param], dtype=np.float64))]
+    elif isinstance(param, float):
+        return [(PARAM_FLOAT, float_dtype, (1,), np.array([param], dtype=np.float64))]
+    elif isinstance(param, (list, tuple)):
+        kind = PARAM_LIST if isinstance(param, list) else PARAM_TUPLE
+        entries = [(kind, float_dtype, (len(param),), np.zeros(0))]
+        for item in param:
+            entries += encode_param(item)
+        return entries
+    elif isinstance(param, np.ndarray) or hasattr(param, "__array__"):
+        kind = PARAM_ARRAY
+    else:
+        raise TypeError(f"Can't store constraint parameter of type {type(param)}")
+
+    array = np.asarray(param)
+    if array.dtype.kind not in "biuf":
+        raise TypeError(f"Can't store non-numeric constraint parameter {param!r}")
+    return [(kind, array.dtype.str, array.shape, array.astype(np.float64).ravel())]
+
+def decode_param(entries: Iterator[ParamEntry]) -> Any:
+    """
+    Return a constraint parameter from entries representing it
+
+    Entries for the parameter are consumed from the iterator (see
+    `encode_param`).
+    """
+    kind, dtype, shape, value = next(entries)
+    if kind == PARAM_BOOL:
+        return bool(value[0])
+    elif kind == PARAM_INT:
+        return int(value[0])
+    elif kind == PARAM_FLOAT:
+        return float(value[0])
+    elif kind == PARAM_ARRAY:
+        return value.reshape(shape).astype(dtype)
+    elif kind == PARAM_SCALAR:
+        return value.reshape(shape).astype(dtype)[()]
+    elif kind in (PARAM_LIST, PARAM_TUPLE):
+        (size,) = shape
+        items = [decode_param(entries) for _ in range(size)]
+        return items if kind == PARAM_LIST else tuple(items)
+    else:
+        return None
+
+def encode_layout(layout: lay.Layout) -> Arrays:
+    """
+    Return arrays representing a layout
+
+    Only top-level constraints are stored since child constraint primitive
+    keys and parameters are derived from these.
+
+    Parameters
+    ----------
+    layout: lay.Layout
+        The layout
+
+    Returns
+    -------
+    Arrays
+        A dictionary of named arrays
+
+        Arrays for the primitive tree are prefixed by 'prim_' (see
+        `encode_prim`).
+        Arrays for constraints are prefixed by 'constraint_'.
+    """
+    strings = StringTable()
+
+    constraint_key = []
+    prim_key_bounds = [0]
+    prim_keys = []
+    param_bounds = [0]
+    param_kinds = []
+    param_dtypes = []
+    param_shape_bounds = [0]
+    param_shapes = []
+    param_value_bounds = [0]
+    param_values = []
+    for key in layout.root_constraint.keys():
+        constraint_key.append(strings.add(key))
+
+        _prim_keys = layout.root_prim_keys[key].value
+        prim_keys += [strings.add(prim_key) for prim_key in _prim_keys]
+        prim_key_bounds.append(len(prim_keys))
+
+        params = layout.root_param[key].value
+        for param in params:
+            for kind, dtype, shape, value in encode_param(param):
+                param_kinds.append(kind)
+                param_dtypes.append(strings.add(dtype))
+                param_shapes += shape
+                param_shape_bounds.append(len(param_shapes))
+                param_values.append(value)
+                param_value_bounds.append(param_value_bounds[-1] + value.size)
+        param_bounds.append(len(param_kinds))
+
+    if len(param_values) == 0:
+        cat_param_values = np.zeros(0)
+    else:
+        cat_param_values = np.concatenate(param_values)
+
+    arrays = {
+        "strings": strings.to_array(),
+        "key": np.array(constraint_key, dtype=np.int32),
+        "prim_key_bounds": np.array(prim_key_bounds, dtype=np.int64),
+        "prim_keys": np.array(prim_keys, dtype=np.int32),
+        "param_bounds": np.array(param_bounds, dtype=np.int64),
+        "param_kinds": np.array(param_kinds, dtype=np.int8),
+        "param_dtypes": np.array(param_dtypes, dtype=np.int32),
+        "param_shape_bounds": np.array(param_shape_bounds, dtype=np.int64),
+        "param_shapes": np.array(param_shapes, dtype=np.int64),
+        "param_value_bounds": np.array(param_value_bounds, dtype=np.int64),
+        "param_values": cat_param_values,
+    }
+    return {
+        **encode_prim(layout.root_prim),
+        **{f"constraint_{key}": array for key, array in arrays.items()}
+    }
+
+def decode_layout(
+    arrays: Arrays, root_constraint: cr.ConstraintNode
+) -> lay.Layout:
+    """
+    Return a layout from its array representation
+
+    Parameters
+    ----------
+    arrays: Arrays
+        Arrays representing the layout (see `encode_layout`)
+    root_constraint: cr.ConstraintNode
+        The root constraint of the layout
+
+        This must contain a child constraint for every stored constraint key.
+        You can get this from the layout template (before solving) through
+        `Layout.root_constraint`.
+
+    Returns
+    -------
+    lay.Layout
+        The layout
+    """
+    root_prim = decode_prim(arrays)
+
+    strings = [str(string) for string in arrays["constraint_strings"]]
+    constraint_key = arrays["constraint_key"]
+    prim_key_bounds = arrays["constraint_prim_key_bounds"]
+    prim_keys = arrays["constraint_prim_keys"]
+    param_bounds = arrays["constraint_param_bounds"]
+    param_kinds = arrays["constraint_param_kinds"]
+    param_dtypes = arrays["constraint_param_dtypes"]
+    param_shape_bounds = arrays["constraint_param_shape_bounds"]
+    param_shapes = arrays["constraint_param_shapes"]
+    param_value_bounds = arrays["constraint_param_value_bounds"]
+    param_values = arrays["constraint_param_values"]
+
+    shapes = [
+        tuple(int(dim) for dim in param_shapes[start:stop])
+        for start, stop in zip(param_shape_bounds[:-1], param_shape_bounds[1:])
+    ]
+    entries = [
+        (kind, strings[dtype_idx], shape, param_values[start:stop])
+        for kind, dtype_idx, shape, start, stop in zip(
+            param_kinds, param_dtypes, shapes,
+            param_value_bounds[:-1], param_value_bounds[1:]
+        )
+    ]
+
+    layout = lay.Layout(root_prim)
+    for n, key_idx in enumerate(constraint_key):
+        key = strings[key_idx]
+        try:
+            constraint = root_constraint[key]
+        except KeyError as err:
+            raise KeyError(f"`root_constraint` is missing constraint {key}") from err
+
+        _prim_keys = tuple(
+            strings[idx]
+            for idx in prim_keys[prim_key_bounds[n]:prim_key_bounds[n+1]]
+        )
+        # Each top-level parameter consumes the entries of its elements
+        _entries = iter(entries[param_bounds[n]:param_bounds[n+1]])
+        _params = tuple(
+            decode_param(itertools.chain([entry], _entries)) for entry in _entries
+        )
+        layout.add_constraint(constraint, _prim_keys, _params, key=key)
+
+    return layout
+
+def save_layout(file: File, layout: lay.Layout):
+    """
+    Save a layout to a `.npz` file
+
+    See `encode_layout` for more details.
+
+    Parameters
+    ----------
+    file: File
+        The file name or file object
+    layout: lay.Layout
+        The layout
+    """
+    arrays = encode_layout(layout)
+    np.savez(file, format_version=FORMAT_VERSION, **arrays)
+
+def load_layout(file: File, root_constraint: cr.ConstraintNode) -> lay.Layout:
+    """
+    Load a layout from a `.npz` file
+
+    See `decode_layout` for more details.
+
+    Parameters
+    ----------
+    file: File
+        The file name or file object
+    root_constraint: cr.ConstraintNode
+        The root constraint of the layout
+
+    Returns
+    -------
+    lay.Layout
+        The layout
+    """
+    with np.load(file, allow_pickle=False) as arrays:
+        validate_version(arrays)
+        return decode_layout(dict(arrays), root_constraint)
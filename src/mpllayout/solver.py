@@ -2,20 +2,31 @@
 Solvers for constrained geometric primitives
 """
 
-from typing import Any
+from typing import Any, Callable, Optional, TYPE_CHECKING
 from numpy.typing import NDArray
 
 import warnings
+import contextlib
+import concurrent.futures
 
-import jax
-from jax import numpy as jnp
 import numpy as np
-from scipy.optimize import minimize, OptimizeResult
 
+from . import lazy
 from . import primitives as pr
 from . import constraints as cr
 from . import containers as cn
 from . import layout as lay
+from . import instrumentation as inst
+
+if TYPE_CHECKING:
+    from scipy.optimize import OptimizeResult
+
+jax = lazy.LazyModule("jax")
+jnp = lazy.LazyModule("jax.numpy")
+optimize = lazy.LazyModule("scipy.optimize")
+sparse = lazy.LazyModule("scipy.sparse")
+csgraph = lazy.LazyModule("scipy.sparse.csgraph")
+sparse_linalg = lazy.LazyModule("scipy.sparse.linalg")
 
 IntGraph = list[tuple[int, ...]]
 StrGraph = list[tuple[str, ...]]
@@ -27,7 +38,19 @@ def solve(
     abs_tol: float = 1e-10,
     rel_tol: float = 1e-7,
     max_iter: int = 10,
-    method: str='newton'
+    method: str='newton',
+    profile: bool = False,
+    hooks: Optional[list[inst.Hook]] = None,
+    profile_memory: bool = False,
+    count_live_nodes: bool = False,
+    presolve: bool = False,
+    drop_duplicates: bool = True,
+    linear_solver: str = 'lstsq',
+    num_workers: Optional[int] = None,
+    jac_chunk_size: Optional[int] = None,
+    jac_memory_budget: Optional[int] = None,
+    jac_sparse: bool = False,
+    krylov_options: Optional[dict[str, Any]] = None
 ) -> tuple[pr.PrimitiveNode, SolverInfo]:
     """
     Return geometric primitives that satisfy constraints
@@ -44,7 +67,77 @@ def solve(
     max_iter: int
         The maximum number of iterations for the iterative solution
     method: Optional[str]
-        A solver method (one of 'newton', 'minimize')
+        A solver method (one of 'newton', 'newton-krylov', 'minimize')
+
+        'newton-krylov' never forms the Jacobian (see `solve_newton_krylov`).
+    profile: bool
+        Whether to record solver phase timings and Jacobian information
+    hooks: Optional[list[inst.Hook]]
+        Hooks called with profiling measurements (see `inst.add_hook`)
+
+        Profiling is enabled if there are any hooks.
+    profile_memory: bool
+        Whether to record memory use of solver phases and node counts
+
+        This also enables profiling.
+    count_live_nodes: bool
+        Whether to count live node objects at the end of the solve
+
+        This walks all objects tracked by the garbage collector (see
+        `inst.count_live_nodes`) and also enables profiling.
+    presolve: bool
+        Whether to simplify the problem before solving (see `presolve_layout`)
+
+        This merges coincident points and is off by default since merged
+        points start from the mean of their initial values, which can change
+        the solution of under-determined layouts.
+        Presolving removes residual rows so residuals passed to hooks don't
+        match `layout.flat_constraints()` if this is enabled.
+
+        Unique values that no constraint references are pruned from the
+        solve whether or not this is enabled.
+    drop_duplicates: bool
+        Whether to remove constraints that duplicate an earlier constraint
+        (see `find_duplicate_constraints`)
+
+        Duplicate constraints only add redundant residual rows so removing
+        them doesn't change the solution.
+        This removes residual rows so residuals passed to hooks don't match
+        `layout.flat_constraints()` if there are duplicates.
+    linear_solver: str
+        The linear solver for newton steps ('newton' only)
+
+        This is one of 'lstsq' (see `solve_block_lstsq`),
+        'block_triangular' (see `solve_block_triangular`) or 'schur' (see
+        `solve_schur`).
+    num_workers: Optional[int]
+        The number of threads used to solve subdomains ('schur' only)
+
+        The threads are created once per solve and shared by all newton
+        iterations. If `None` or at most 1, subdomains are solved serially.
+    jac_chunk_size: Optional[int]
+        The number of Jacobian columns evaluated at once ('newton' only)
+
+        If this or `jac_memory_budget` is given, the Jacobian is assembled
+        from column chunks (see `assem_chunked_jacobian`) instead of
+        evaluating all columns at once with `jax.jacfwd`.
+    jac_memory_budget: Optional[int]
+        A memory budget (in bytes) for evaluating a Jacobian chunk ('newton'
+        only)
+
+        This picks the chunk size (see `find_jacobian_chunk_size`). If
+        `jac_chunk_size` is also given, it's the largest allowed chunk size.
+    jac_sparse: bool
+        Whether to store the Jacobian as a sparse array ('newton' only)
+
+        This needs chunked assembly (`jac_chunk_size` or `jac_memory_budget`)
+        so the dense Jacobian is never formed. The linear solvers only make
+        independent blocks of the Jacobian dense.
+    krylov_options: Optional[dict[str, Any]]
+        Options for the inner LSMR solves ('newton-krylov' only)
+
+        Keys are the keyword arguments 'max_krylov_iter', 'krylov_atol' and
+        'rebuild_factor' of `solve_newton_krylov`.
 
     Returns
     -------
@@ -61,11 +154,96 @@ def solve(
                 A list of relative errors for each solver iteration.
                 This is the absolute error at each iteration, relative to the
                 initial absolute error.
+
+            'presolve':
+                A dictionary of presolve counts, including the number of
+                unconstrained values pruned from the solve (see
+                `presolve_layout`).
+
+        If profiling, additional keys are:
+            'phase_times':
+                A dictionary of durations (in seconds) for each call of the
+                solver phases:
+                    'flatten' (flattening the primitive tree),
+                    'flat_constraints' (flattening the constraint tree),
+                    'presolve' (simplifying the problem),
+                    'filter_unique_values' (finding unique primitive values),
+                    'trace' (tracing and lowering `jax` functions),
+                    'compile' (XLA compilation),
+                    'jac_chunk_size' (picking the Jacobian chunk size for a
+                    memory budget and compiling the chunk function),
+                    'residual' and 'jacobian' (evaluation per iteration),
+                    'lstsq' (the least squares solve per iteration),
+                    'preconditioner' and 'krylov' (preconditioner set-up when
+                    it's rebuilt and the inner LSMR solve per iteration for
+                    'newton-krylov'),
+                    'objective' (objective and gradient evaluations for
+                    'minimize'),
+                    'write_back' (building the solved primitive tree).
+            'jac_shape', 'jac_rank', 'jac_singular_values':
+                Lists of the Jacobian shape, numerical rank and singular
+                values for each iteration ('newton' only).
+            'jac_num_blocks':
+                A list of the number of Jacobian blocks solved for each
+                iteration ('newton' only, see `solve_block_lstsq` and
+                `solve_block_triangular`).
+            'jac_chunk_size':
+                A list with the number of Jacobian columns evaluated at once
+                (only if assembling the Jacobian in chunks).
+
+            With `linear_solver='block_triangular'`, 'jac_rank' and
+            'jac_singular_values' are replaced by:
+            'jac_max_block_size':
+                A list of the largest number of parameters in a block for
+                each iteration.
+
+            With `linear_solver='schur'`, 'jac_rank' and
+            'jac_singular_values' are replaced by:
+            'jac_interface_size':
+                A list of the number of interface parameters for each
+                iteration ('jac_num_blocks' is the number of subdomains).
+
+            With `method='newton-krylov'`, the Jacobian keys are replaced by:
+            'krylov_iters', 'forcing_terms':
+                Lists of the number of LSMR iterations and the relative
+                tolerance of the inner solve for each iteration.
+            'preconditioner_rebuilds':
+                A list of whether the preconditioner was rebuilt for each
+                iteration.
+
+        If profiling memory, additional keys are:
+            'phase_peak_bytes', 'phase_live_buffer_bytes':
+                Dictionaries of the peak python memory (in bytes) allocated
+                during, and memory held by live `jax` arrays after, each call
+                of the solver phases (see `inst.Profiler`).
+            'layout_memory':
+                A dictionary of the layout's node counts and primitive value
+                sizes (see `lay.Layout.memory_info`).
+
+        If counting live nodes, additional keys are:
+            'live_node_counts':
+                A dictionary of the number of live node objects of each class
+                at the end of the solve (see `inst.count_live_nodes`).
     """
+    profiler = inst.Profiler(profile, hooks, profile_memory, count_live_nodes)
     if method == 'newton':
-        return solve_newton(layout, abs_tol, rel_tol, max_iter)
+        return solve_newton(
+            layout, abs_tol, rel_tol, max_iter, profiler, presolve,
+            drop_duplicates, linear_solver, num_workers, jac_chunk_size,
+            jac_memory_budget, jac_sparse
+        )
+    elif method == 'newton-krylov':
+        if krylov_options is None:
+            krylov_options = {}
+        return solve_newton_krylov(
+            layout, abs_tol, rel_tol, max_iter, profiler, presolve,
+            drop_duplicates, **krylov_options
+        )
     elif method == 'minimize':
-        return solve_minimize(layout, abs_tol, rel_tol, max_iter)
+        return solve_minimize(
+            layout, abs_tol, rel_tol, max_iter, profiler, presolve,
+            drop_duplicates
+        )
     else:
         raise ValueError(f"Invalid `method` {method}")
 
@@ -76,13 +254,23 @@ def solve_newton(
     abs_tol: float = 1e-10,
     rel_tol: float = 1e-7,
     max_iter: int = 10,
+    profiler: Optional[inst.Profiler] = None,
+    presolve: bool = False,
+    drop_duplicates: bool = True,
+    linear_solver: str = 'lstsq',
+    num_workers: Optional[int] = None,
+    jac_chunk_size: Optional[int] = None,
+    jac_memory_budget: Optional[int] = None,
+    jac_sparse: bool = False
 ) -> tuple[pr.PrimitiveNode, SolverInfo]:
     """
     Return geometric primitives that satisfy constraints using a newton method
 
     Parameters
     ----------
-    Parameters match those for `solve` except for `method`
+    Parameters match those for `solve` except for `method`, `profile`,
+    `hooks`, `profile_memory` and `count_live_nodes`, which are replaced by
+    an optional `inst.Profiler`
 
     See `solve` for more details.
 
@@ -94,23 +282,248 @@ def solve_newton(
     ## Set-up assembly function for the global residual as a function of a global
     ## parameter list
 
-    # `prim_idx_bounds` stores the right/left indices for each primitive's
-    # parameter vector in the global parameter vector array
-    # For primitive with index `n`, for example,
-    # `prim_idx_bounds[n], prim_idx_bounds[n+1]` are the indices between which
-    # the parameter vectors are stored.
-    flat_prim = cn.flatten('', layout.root_prim)
-    prim_graph, prim_values = pr.filter_unique_values_from_prim(layout.root_prim)
-    prim_idx_bounds = np.cumsum([0] + [value.size for value in prim_values])
-    global_param_n = np.concatenate(prim_values)
+    # The global parameter vector stores free unique primitive values (see
+    # `pack_global_param`)
+    if profiler is None:
+        profiler = inst.Profiler(enabled=False)
 
-    constraints, constraint_graph, constraint_params = layout.flat_constraints()
+    if linear_solver not in ('lstsq', 'block_triangular', 'schur'):
+        raise ValueError(f"Invalid `linear_solver` {linear_solver}")
+    if jac_chunk_size is not None and jac_chunk_size < 1:
+        raise ValueError(f"Invalid `jac_chunk_size` {jac_chunk_size}")
+    is_chunked = jac_chunk_size is not None or jac_memory_budget is not None
+    if jac_sparse and not is_chunked:
+        raise ValueError(
+            "`jac_sparse` needs `jac_chunk_size` or `jac_memory_budget`"
+        )
+
+    (
+        flat_prim, prim_graph, prim_values, is_free,
+        (constraints, constraint_graph, constraint_params),
+        presolve_info
+    ) = presolve_layout(
+        layout, presolve, drop_duplicates, profiler
+    )
+    global_param_n, unpack_global_param = pack_global_param(prim_values, is_free)
 
-    @jax.jit
     def assem_global_res(global_param):
-        new_prim_params = [
+        new_prim_params = unpack_global_param(global_param)
+        root_prim = pr.build_prim_from_unique_values(flat_prim, prim_graph, new_prim_params)
+        residuals = assem_constraint_residual(
+            root_prim, constraints, constraint_graph, constraint_params
+        )
+        return jnp.concatenate(residuals)
+
+    def assem_global_jac_chunk(global_param, tangents):
+        return jax.vmap(
+            lambda tangent: jax.jvp(assem_global_res, (global_param,), (tangent,))[1],
+            out_axes=1
+        )(tangents)
+
+    num_param = global_param_n.size
+
+    def lower_global_jac_chunk(chunk_size):
+        tangents = np.zeros((chunk_size, num_param))
+        return jax.jit(assem_global_jac_chunk).lower(global_param_n, tangents)
+
+    # Trace and compile ahead of time so tracing and compilation are timed
+    # separately from evaluation
+    with profiler.phase("trace"):
+        lowered_global_res = jax.jit(assem_global_res).lower(global_param_n)
+        if not is_chunked:
+            lowered_global_jac = (
+                jax.jit(jax.jacfwd(assem_global_res)).lower(global_param_n)
+            )
+        elif jac_memory_budget is None:
+            lowered_global_jac = lower_global_jac_chunk(jac_chunk_size)
+        else:
+            # The chunk size is picked from the memory use of a single column
+            lowered_global_jac = lower_global_jac_chunk(1)
+    with profiler.phase("compile"):
+        assem_global_jac = lowered_global_jac.compile()
+        compiled_global_res = lowered_global_res.compile()
+    # This is timed separately so compile times don't depend on the budget
+    if jac_memory_budget is not None:
+        with profiler.phase("jac_chunk_size"):
+            jac_chunk_size = find_jacobian_chunk_size(
+                assem_global_jac, num_param, jac_memory_budget,
+                max_chunk_size=jac_chunk_size
+            )
+            if jac_chunk_size > 1:
+                assem_global_jac = lower_global_jac_chunk(jac_chunk_size).compile()
+    # `lower_global_jac_chunk` traces the uncompiled residual function so it's
+    # only replaced here
+    assem_global_res = compiled_global_res
+
+    if is_chunked:
+        profiler.record("jac_chunk_size", jac_chunk_size)
+        compiled_global_jac_chunk = assem_global_jac
+
+        def assem_global_jac(global_param):
+            return assem_chunked_jacobian(
+                compiled_global_jac_chunk, global_param, jac_chunk_size,
+                sparse_storage=jac_sparse
+            )
+
+    ## Iteratively minimize the global residual as function of the global parameter vector
+    abs_errs = []
+    rel_errs = []
+
+    n = 0
+    abs_err = np.inf
+    rel_err = np.inf
+
+    # Subdomain threads are shared by all iterations (see `solve_schur`)
+    if linear_solver == 'schur' and num_workers is not None and num_workers > 1:
+        executor_context = concurrent.futures.ThreadPoolExecutor(num_workers)
+    else:
+        executor_context = contextlib.nullcontext()
+    with executor_context as executor:
+        while (abs_err > abs_tol) and (rel_err > rel_tol) and (n < max_iter):
+
+            with profiler.phase("residual", iteration=n):
+                global_res = np.asarray(assem_global_res(global_param_n))
+            profiler.emit("residual", {"iteration": n, "value": global_res})
+            with profiler.phase("jacobian", iteration=n):
+                global_jac = assem_global_jac(global_param_n)
+                if not jac_sparse:
+                    global_jac = np.asarray(global_jac)
+
+            profiler.record("jac_shape", global_jac.shape, iteration=n)
+            if linear_solver == 'lstsq':
+                with profiler.phase("lstsq", iteration=n):
+                    dglobal_param, rank, s, num_blocks = solve_block_lstsq(
+                        global_jac, -global_res
+                    )
+                profiler.record("jac_rank", int(rank), iteration=n)
+                profiler.record("jac_singular_values", s, iteration=n)
+                profiler.record("jac_num_blocks", num_blocks, iteration=n)
+            elif linear_solver == 'block_triangular':
+                with profiler.phase("lstsq", iteration=n):
+                    dglobal_param, block_sizes = solve_block_triangular(
+                        global_jac, -global_res
+                    )
+                profiler.record("jac_num_blocks", len(block_sizes), iteration=n)
+                profiler.record(
+                    "jac_max_block_size", max(block_sizes, default=0), iteration=n
+                )
+            else:
+                with profiler.phase("lstsq", iteration=n):
+                    dglobal_param, num_subdomains, interface_size = solve_schur(
+                        global_jac, -global_res, executor
+                    )
+                profiler.record("jac_num_blocks", num_subdomains, iteration=n)
+                profiler.record("jac_interface_size", interface_size, iteration=n)
+            global_param_n = global_param_n + dglobal_param
+
+            n += 1
+            abs_err = np.linalg.norm(global_res)
+            abs_errs.append(abs_err)
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                rel_err = abs_errs[-1] / abs_errs[0]
+            rel_errs.append(rel_err)
+
+    ## Build a new primitive tree from the global parameter vector
+    with profiler.phase("write_back"):
+        prim_params_n = [
+            np.array(value) for value in unpack_global_param(global_param_n)
+        ]
+        root_prim_n = pr.build_prim_from_unique_values(flat_prim, prim_graph, prim_params_n)
+
+    if profiler.live_nodes:
+        profiler.summarize("live_node_counts", inst.count_live_nodes())
+
+    nonlinear_solve_info = {
+        "abs_errs": abs_errs,
+        "rel_errs": rel_errs,
+        **presolve_info,
+        **profiler.info()
+    }
+
+    return root_prim_n, nonlinear_solve_info
+
+
+def solve_newton_krylov(
+    layout: lay.Layout,
+    abs_tol: float = 1e-10,
+    rel_tol: float = 1e-7,
+    max_iter: int = 10,
+    profiler: Optional[inst.Profiler] = None,
+    presolve: bool = False,
+    drop_duplicates: bool = True,
+    max_krylov_iter: Optional[int] = None,
+    krylov_atol: float = 1e-6,
+    rebuild_factor: float = 2.0
+) -> tuple[pr.PrimitiveNode, SolverInfo]:
+    """
+    Return geometric primitives that satisfy constraints using a matrix-free
+    newton-krylov method
+
+    Newton steps are solved inexactly with LSMR, using Jacobian-vector
+    products (`jax.jvp`) and vector-Jacobian products (`jax.vjp`) of the
+    global residual instead of an assembled Jacobian. Memory use therefore
+    scales with the residual and parameter sizes rather than their product.
+    The inner solve is right-preconditioned with a block-Jacobi preconditioner
+    over free unique primitive values (see `make_block_jacobi`), which is
+    reused across newton steps while it stays effective, and stopped
+    with Eisenstat-Walker forcing terms (see `forcing_term`).
+
+    Parameters
+    ----------
+    Parameters match those for `solve` except for `method`, `profile`,
+    `hooks`, `profile_memory` and `count_live_nodes`, which are replaced by
+    an optional `inst.Profiler`
+
+    max_krylov_iter: Optional[int]
+        The maximum number of LSMR iterations per newton step
+
+        If `None`, this is the number of free parameters.
+    krylov_atol: float
+        The LSMR tolerance for least squares (inconsistent) newton steps
+
+        The forcing term is only used as the LSMR tolerance for consistent
+        newton steps (`btol`) since the linearized constraints can be
+        inconsistent when there are redundant constraints.
+    rebuild_factor: float
+        The preconditioner is reused across newton steps and only rebuilt
+        once a step needs more than `rebuild_factor` times the LSMR iterations
+        of the first step after the last rebuild
+
+    See `solve` for more details.
+
+    Returns
+    -------
+    Returns match those for `solve`
+    """
+    if profiler is None:
+        profiler = inst.Profiler(enabled=False)
+
+    (
+        flat_prim, prim_graph, prim_values, is_free,
+        (constraints, constraint_graph, constraint_params),
+        presolve_info
+    ) = presolve_layout(
+        layout, presolve, drop_duplicates, profiler
+    )
+    global_param_n, unpack_global_param = pack_global_param(prim_values, is_free)
+    block_sizes = [value.size for value, free in zip(prim_values, is_free) if free]
+    idx_bounds = np.cumsum([0] + block_sizes)
+
+    # Residuals are differentiated with respect to a list of free values,
+    # rather than the global parameter vector, since transposing the slices of
+    # the global parameter vector makes `jax.vjp` very slow to compile
+    def split_global_param(global_param):
+        return [
             global_param[idx_start:idx_end]
-            for idx_start, idx_end in zip(prim_idx_bounds[:-1], prim_idx_bounds[1:])
+            for idx_start, idx_end in zip(idx_bounds[:-1], idx_bounds[1:])
+        ]
+
+    def assem_global_res(free_values):
+        free_values = iter(free_values)
+        new_prim_params = [
+            next(free_values) if free else value
+            for value, free in zip(prim_values, is_free)
         ]
         root_prim = pr.build_prim_from_unique_values(flat_prim, prim_graph, new_prim_params)
         residuals = assem_constraint_residual(
@@ -118,7 +531,32 @@ def solve_newton(
         )
         return jnp.concatenate(residuals)
 
-    assem_global_jac = jax.jacfwd(assem_global_res)
+    def assem_global_jvp(free_values, free_tangents):
+        return jax.jvp(assem_global_res, (free_values,), (free_tangents,))[1]
+
+    def assem_global_vjp(free_values, cotangent):
+        _, vjp = jax.vjp(assem_global_res, free_values)
+        return jnp.concatenate([jnp.zeros(0)] + vjp(cotangent)[0])
+
+    free_values_n = split_global_param(global_param_n)
+    with profiler.phase("trace"):
+        res_shape = jax.eval_shape(assem_global_res, free_values_n).shape
+        lowered_global_res = jax.jit(assem_global_res).lower(free_values_n)
+        lowered_global_jvp = (
+            jax.jit(assem_global_jvp).lower(free_values_n, free_values_n)
+        )
+        lowered_global_vjp = (
+            jax.jit(assem_global_vjp).lower(free_values_n, np.zeros(res_shape))
+        )
+    with profiler.phase("compile"):
+        assem_global_res = lowered_global_res.compile()
+        assem_global_jvp = lowered_global_jvp.compile()
+        assem_global_vjp = lowered_global_vjp.compile()
+
+    num_param = global_param_n.size
+    num_res = res_shape[0]
+    if max_krylov_iter is None:
+        max_krylov_iter = max(num_param, 1)
 
     ## Iteratively minimize the global residual as function of the global parameter vector
     abs_errs = []
@@ -127,15 +565,65 @@ def solve_newton(
     n = 0
     abs_err = np.inf
     rel_err = np.inf
+    eta = None
+    block_colors = None
+    precondition = None
+    num_krylov_iter = built_krylov_iter = 0
     while (abs_err > abs_tol) and (rel_err > rel_tol) and (n < max_iter):
 
-        global_res = assem_global_res(global_param_n)
-        global_jac = assem_global_jac(global_param_n)
+        with profiler.phase("residual", iteration=n):
+            global_res = np.asarray(
+                assem_global_res(split_global_param(global_param_n))
+            )
+        profiler.emit("residual", {"iteration": n, "value": global_res})
+
+        eta = forcing_term(
+            np.linalg.norm(global_res), abs_errs[-1] if abs_errs else None,
+            eta, abs_tol
+        )
+
+        # Bind the current parameters since `global_param_n` changes each step
+        def jvp(tangent, free_values=split_global_param(global_param_n)):
+            return np.asarray(
+                assem_global_jvp(free_values, split_global_param(tangent)),
+                dtype=float
+            )
+
+        def vjp(cotangent, free_values=split_global_param(global_param_n)):
+            return np.asarray(assem_global_vjp(free_values, cotangent), dtype=float)
 
-        dglobal_param, err, rank, s = np.linalg.lstsq(
-            global_jac, -global_res, rcond=None
+        # Reuse the preconditioner until inner solves become much harder
+        rebuild = (
+            precondition is None
+            or num_krylov_iter > rebuild_factor*max(built_krylov_iter, 1)
         )
-        global_param_n = global_param_n + dglobal_param
+        if rebuild:
+            with profiler.phase("preconditioner", iteration=n):
+                if block_colors is None:
+                    block_colors = color_free_blocks(
+                        prim_graph, constraint_graph, is_free
+                    )
+                precondition = make_block_jacobi(
+                    lambda x: vjp(jvp(x)), block_sizes, block_colors
+                )
+        profiler.record("preconditioner_rebuilds", rebuild, iteration=n)
+
+        global_jac = sparse_linalg.LinearOperator(
+            (num_res, num_param),
+            matvec=lambda y: jvp(precondition(np.ravel(y))),
+            rmatvec=lambda z: precondition(vjp(np.ravel(z))),
+            dtype=float
+        )
+        with profiler.phase("krylov", iteration=n):
+            y, _, num_krylov_iter, *_ = sparse_linalg.lsmr(
+                global_jac, -global_res.astype(float), atol=krylov_atol, btol=eta,
+                maxiter=max_krylov_iter
+            )
+        if rebuild:
+            built_krylov_iter = num_krylov_iter
+        profiler.record("krylov_iters", int(num_krylov_iter), iteration=n)
+        profiler.record("forcing_terms", eta, iteration=n)
+        global_param_n = global_param_n + precondition(y)
 
         n += 1
         abs_err = np.linalg.norm(global_res)
@@ -145,14 +633,22 @@ def solve_newton(
             rel_err = abs_errs[-1] / abs_errs[0]
         rel_errs.append(rel_err)
 
-    nonlinear_solve_info = {"abs_errs": abs_errs, "rel_errs": rel_errs}
-
     ## Build a new primitive tree from the global parameter vector
-    prim_params_n = [
-        np.array(global_param_n[idx_start:idx_end])
-        for idx_start, idx_end in zip(prim_idx_bounds[:-1], prim_idx_bounds[1:])
-    ]
-    root_prim_n = pr.build_prim_from_unique_values(flat_prim, prim_graph, prim_params_n)
+    with profiler.phase("write_back"):
+        prim_params_n = [
+            np.array(value) for value in unpack_global_param(global_param_n)
+        ]
+        root_prim_n = pr.build_prim_from_unique_values(flat_prim, prim_graph, prim_params_n)
+
+    if profiler.live_nodes:
+        profiler.summarize("live_node_counts", inst.count_live_nodes())
+
+    nonlinear_solve_info = {
+        "abs_errs": abs_errs,
+        "rel_errs": rel_errs,
+        **presolve_info,
+        **profiler.info()
+    }
 
     return root_prim_n, nonlinear_solve_info
 
@@ -162,6 +658,9 @@ def solve_minimize(
     abs_tol: float = 1e-10,
     rel_tol: float = 1e-7,
     max_iter: int = 10,
+    profiler: Optional[inst.Profiler] = None,
+    presolve: bool = False,
+    drop_duplicates: bool = True
 ) -> tuple[pr.PrimitiveNode, SolverInfo]:
     """
     Return geometric primitives that satisfy constraints using minimization (L-BFGS-B)
@@ -170,7 +669,9 @@ def solve_minimize(
 
     Parameters
     ----------
-    Parameters match those for `solve` except for `method`
+    Parameters match those for `solve` except for `method`, `profile`,
+    `hooks`, `profile_memory` and `count_live_nodes`, which are replaced by
+    an optional `inst.Profiler`
 
     See `solve` for more details.
 
@@ -182,24 +683,22 @@ def solve_minimize(
     ## Set-up assembly function for the global residual as a function of a global
     ## parameter list
 
-    # `prim_idx_bounds` stores the right/left indices for each primitive's
-    # parameter vector in the global parameter vector array
-    # For primitive with index `n`, for example,
-    # `prim_idx_bounds[n], prim_idx_bounds[n+1]` are the indices between which
-    # the parameter vectors are stored.
-    flat_prim = cn.flatten('', layout.root_prim)
-    prim_graph, prim_values = pr.filter_unique_values_from_prim(layout.root_prim)
-    prim_idx_bounds = np.cumsum([0] + [value.size for value in prim_values])
-    global_param_n = np.concatenate(prim_values)
+    # The global parameter vector stores free unique primitive values (see
+    # `pack_global_param`)
+    if profiler is None:
+        profiler = inst.Profiler(enabled=False)
 
-    constraints, constraint_graph, constraint_params = layout.flat_constraints()
+    (
+        flat_prim, prim_graph, prim_values, is_free,
+        (constraints, constraint_graph, constraint_params),
+        presolve_info
+    ) = presolve_layout(
+        layout, presolve, drop_duplicates, profiler
+    )
+    global_param_n, unpack_global_param = pack_global_param(prim_values, is_free)
 
-    @jax.jit
     def assem_objective(global_param):
-        new_prim_params = [
-            global_param[idx_start:idx_end]
-            for idx_start, idx_end in zip(prim_idx_bounds[:-1], prim_idx_bounds[1:])
-        ]
+        new_prim_params = unpack_global_param(global_param)
         root_prim = pr.build_prim_from_unique_values(flat_prim, prim_graph, new_prim_params)
         residuals = assem_constraint_residual(
             root_prim, constraints, constraint_graph, constraint_params
@@ -212,7 +711,7 @@ def solve_minimize(
             self.abs_errs = []
             self.rel_errs = []
 
-        def callback(self, intermediate_result: OptimizeResult):
+        def callback(self, intermediate_result: "OptimizeResult"):
             abs_err = intermediate_result['fun']
             self.abs_errs.append(abs_err)
 
@@ -226,9 +725,21 @@ def solve_minimize(
 
     ## Iteratively minimize the global residual as function of the global parameter vector
 
+    with profiler.phase("trace"):
+        lowered_objective = (
+            jax.jit(jax.value_and_grad(assem_objective)).lower(global_param_n)
+        )
+    with profiler.phase("compile"):
+        compiled_objective = lowered_objective.compile()
+
+    def assem_objective_and_grad(global_param):
+        with profiler.phase("objective"):
+            objective, grad = compiled_objective(global_param)
+            return np.asarray(objective), np.asarray(grad)
+
     # TODO: (not critical) Implement other optimization solvers besides 'L-BFGS-B'
-    res = minimize(
-        jax.value_and_grad(assem_objective),
+    res = optimize.minimize(
+        assem_objective_and_grad,
         global_param_n,
         method='L-BFGS-B',
         jac=True,
@@ -237,19 +748,1296 @@ def solve_minimize(
     )
     global_param_n = res['x']
 
-    prim_params_n = [
-        np.array(global_param_n[idx_start:idx_end])
-        for idx_start, idx_end in zip(prim_idx_bounds[:-1], prim_idx_bounds[1:])
-    ]
-    root_prim_n = pr.build_prim_from_unique_values(flat_prim, prim_graph, prim_params_n)
+    with profiler.phase("write_back"):
+        prim_params_n = [
+            np.array(value) for value in unpack_global_param(global_param_n)
+        ]
+        root_prim_n = pr.build_prim_from_unique_values(flat_prim, prim_graph, prim_params_n)
+
+    if profiler.live_nodes:
+        profiler.summarize("live_node_counts", inst.count_live_nodes())
 
     nonlinear_solve_info = {
-        "abs_errs": min_hist.abs_errs, "rel_errs": min_hist.rel_errs
+        "abs_errs": min_hist.abs_errs,
+        "rel_errs": min_hist.rel_errs,
+        **presolve_info,
+        **profiler.info()
     }
 
     return root_prim_n, nonlinear_solve_info
 
 
+## Rigid blocks
+
+def solve_rigid_block(
+    layout: lay.Layout,
+    origin: Optional[str] = None,
+    scalable: bool = False,
+    **solve_kwargs
+) -> type[pr.RigidBlock]:
+    """
+    Return a rigid block type from a solved sub-layout
+
+    The sub-layout is solved once and its solved geometry is stored in the
+    block type (see `pr.make_rigid_block_type`).
+    Blocks of the type can be added to parent layouts where they only add
+    placement parameters (translation and optional scale) to the parent solve.
+
+    Parameters
+    ----------
+    layout: lay.Layout
+        The sub-layout
+
+        The solved geometry must only depend on the sub-layout's own
+        constraints.
+    origin: Optional[str]
+        The key of a `pr.Point` placed by the block translation
+
+        If not supplied, the block translation places the sub-layout's `(0, 0)`
+        coordinate.
+    scalable: bool
+        Whether blocks have a scale parameter
+    **solve_kwargs
+        Keyword arguments for `solve`
+
+    Returns
+    -------
+    type[pr.RigidBlock]
+        The block type
+    """
+    root_prim, _ = solve(layout, **solve_kwargs)
+    origin_coord = None if origin is None else root_prim[origin].value
+    return pr.make_rigid_block_type(root_prim, origin_coord, scalable)
+
+
+## Presolve
+
+FlatConstraints = tuple[list[cr.Constraint], list[cr.PrimKeys], list[cr.Params]]
+
+def presolve_layout(
+    layout: lay.Layout,
+    presolve: bool = False,
+    drop_duplicates: bool = True,
+    profiler: Optional[inst.Profiler] = None
+) -> tuple[
+    list[cn.FlatNodeStructure],
+    dict[str, int],
+    list[NDArray],
+    NDArray,
+    FlatConstraints,
+    SolverInfo
+]:
+    """
+    Return the flat primitive tree, unique primitive values and constraints to solve
+
+    If presolving, points that must be equal because of `Coincident` or
+    `CoincidentLines` constraints are merged into one unique value (see
+    `pr.filter_unique_values_from_prim`) and the constraints, which are then
+    always satisfied, are removed.
+    If dropping duplicates, constraints that duplicate an earlier constraint
+    are removed (see `find_duplicate_constraints`).
+    Unique values that no remaining constraint references are always pruned
+    from the solve (see `find_constrained_values`). Pruning doesn't change
+    the solution since the residual doesn't depend on unreferenced values.
+
+    Parameters
+    ----------
+    layout: lay.Layout
+        The layout
+    presolve: bool
+        Whether to merge coincident points
+    drop_duplicates: bool
+        Whether to remove duplicate constraints
+    profiler: Optional[inst.Profiler]
+        A profiler for the 'flatten', 'flat_constraints', 'presolve' and
+        'filter_unique_values' phases
+
+    Returns
+    -------
+    flat_prim: list[cn.FlatNodeStructure]
+        The flat primitive tree (see `cn.flatten`)
+    prim_graph: dict[str, int]
+        A mapping from primitive keys to unique primitive values
+    prim_values: list[NDArray]
+        Unique primitive values
+    is_free: NDArray
+        Whether each unique primitive value is solved for
+
+        Values that aren't solved for are passed through unchanged.
+    FlatConstraints
+        Constraints, primitive keys and parameters to solve (see
+        `lay.Layout.flat_constraints`)
+    SolverInfo
+        Presolve information
+
+        This has a key 'presolve' with a dictionary of:
+            'num_merged_values': the number of unique values removed by
+                merging,
+            'num_dropped_constraints': the number of removed constraints,
+            'num_dropped_rows': the number of removed residual rows,
+            'num_duplicate_constraints': the number of removed duplicate
+                constraints,
+            'near_duplicate_constraints': pairs of constraint keys for
+                constraints that only differ by parameters,
+            'num_pruned_values': the number of unique values not solved for,
+            'num_pruned_params': the number of parameters not solved for.
+    """
+    if profiler is None:
+        profiler = inst.Profiler(enabled=False)
+
+    with profiler.phase("flatten"):
+        flat_prim = cn.flatten('', layout.root_prim)
+
+    with profiler.phase("flat_constraints"):
+        constraints, constraint_graph, constraint_params = layout.flat_constraints()
+
+    if profiler.memory:
+        profiler.summarize("layout_memory", layout.memory_info())
+
+    if presolve:
+        with profiler.phase("presolve"):
+            constraint_merge_keys = find_coincident_points(layout)
+            merge_keys = [
+                pair for pairs in constraint_merge_keys if pairs is not None
+                for pair in pairs
+            ]
+            num_values = len(pr.filter_unique_values_from_prim(layout.root_prim)[1])
+    else:
+        constraint_merge_keys = len(constraints)*[None]
+        merge_keys = []
+
+    with profiler.phase("filter_unique_values"):
+        prim_graph, prim_values = pr.filter_unique_values_from_prim(
+            layout.root_prim, merge_keys
+        )
+    if not presolve:
+        num_values = len(prim_values)
+
+    with profiler.phase("presolve"):
+        # Remove constraints where all points are merged
+        is_merged = [
+            pairs is not None
+            and all(prim_graph[key_a] == prim_graph[key_b] for key_a, key_b in pairs)
+            for pairs in constraint_merge_keys
+        ]
+        num_dropped_rows = sum(
+            sum(prim_values[prim_graph[key_a]].size for key_a, _ in pairs)
+            for pairs, merged in zip(constraint_merge_keys, is_merged) if merged
+        )
+
+        # Remove duplicate constraints
+        if drop_duplicates:
+            is_duplicate, near_duplicates = find_duplicate_constraints(
+                layout, prim_graph
+            )
+        else:
+            is_duplicate, near_duplicates = len(constraints)*[False], []
+        num_dropped_rows += sum(
+            constraint.signature.value_size
+            for (_, constraint), duplicate, merged in zip(
+                list(cn.iter_flat("", layout.root_constraint))[1:],
+                is_duplicate,
+                is_merged
+            )
+            if duplicate and not merged
+        )
+
+        is_dropped = [
+            merged or duplicate
+            for merged, duplicate in zip(is_merged, is_duplicate)
+        ]
+        constraints, constraint_graph, constraint_params = (
+            [item for item, dropped in zip(items, is_dropped) if not dropped]
+            for items in (constraints, constraint_graph, constraint_params)
+        )
+
+        is_free = find_constrained_values(
+            prim_graph, constraint_graph, len(prim_values)
+        )
+
+    presolve_info = {
+        "num_merged_values": num_values - len(prim_values),
+        "num_dropped_constraints": sum(is_dropped),
+        "num_dropped_rows": num_dropped_rows,
+        "num_duplicate_constraints": sum(is_duplicate),
+        "near_duplicate_constraints": near_duplicates,
+        "num_pruned_values": int(np.sum(~is_free)),
+        "num_pruned_params": sum(
+            value.size for value, free in zip(prim_values, is_free) if not free
+        )
+    }
+    return (
+        flat_prim, prim_graph, prim_values, is_free,
+        (constraints, constraint_graph, constraint_params),
+        {"presolve": presolve_info}
+    )
+
+def find_coincident_points(
+    layout: lay.Layout
+) -> list[Optional[list[tuple[str, str]]]]:
+    """
+    Return pairs of coincident point keys for each constraint
+
+    Parameters
+    ----------
+    layout: lay.Layout
+        The layout
+
+    Returns
+    -------
+    list[Optional[list[tuple[str, str]]]]
+        Pairs of point keys (in `pr.filter_unique_values_from_prim` format)
+        that a constraint makes coincident for each constraint in
+        `layout.flat_constraints()`
+
+        This is `None` for constraints that aren't `Coincident` or
+        `CoincidentLines`.
+    """
+    # The `[1:]` removes the 'root' constraint which is just a container
+    flat_constraints = zip(
+        list(cn.iter_flat("", layout.root_constraint))[1:],
+        list(cn.iter_flat("", layout.root_prim_keys))[1:],
+        list(cn.iter_flat("", layout.root_param))[1:],
+    )
+
+    constraint_pairs = []
+    for (_, constraint), (_, prim_keys), (_, params) in flat_constraints:
+        if isinstance(constraint, cr.Coincident):
+            key_a, key_b = prim_keys.value
+            pairs = [(f"/{key_a}", f"/{key_b}")]
+        elif isinstance(constraint, cr.CoincidentLines):
+            key_a, key_b = prim_keys.value
+            reverse, = params.value
+            if reverse:
+                point_keys = (("Point0", "Point1"), ("Point1", "Point0"))
+            else:
+                point_keys = (("Point0", "Point0"), ("Point1", "Point1"))
+            pairs = [
+                (f"/{key_a}/{point_a}", f"/{key_b}/{point_b}")
+                for point_a, point_b in point_keys
+            ]
+        else:
+            pairs = None
+        constraint_pairs.append(pairs)
+    return constraint_pairs
+
+def find_duplicate_constraints(
+    layout: lay.Layout, prim_graph: dict[str, int]
+) -> tuple[list[bool], list[tuple[str, str]]]:
+    """
+    Return whether each constraint duplicates an earlier constraint
+
+    Constraints are compared by their (local) construction function (see
+    `ConstructionNode.assem_identity`), the unique primitive values they act
+    on and their parameters.
+    Constraints that don't add residual rows (for example, the parents of
+    compound constraints) are never duplicates.
+
+    Parameters
+    ----------
+    layout: lay.Layout
+        The layout
+    prim_graph: dict[str, int]
+        A mapping from primitive keys to unique primitive values (see
+        `pr.filter_unique_values_from_prim`)
+
+    Returns
+    -------
+    is_duplicate: list[bool]
+        Whether each constraint in `layout.flat_constraints()` is a duplicate
+    near_duplicates: list[tuple[str, str]]
+        Pairs of constraint keys where the first constraint only differs from
+        the second, earlier constraint by its parameters
+
+        These constraints are redundant or conflicting.
+    """
+    def resolve_prim_key(prim_key: str) -> tuple[int, str]:
+        # Derived primitives (see `PrimitiveNode.derived_children`) share the
+        # unique value of their parent so they're resolved relative to it
+        key = f"/{prim_key}"
+        idx = prim_graph[key]
+        parent_key, _, _ = key.rpartition("/")
+        while parent_key and prim_graph[parent_key] == idx:
+            key = parent_key
+            parent_key, _, _ = key.rpartition("/")
+        return idx, f"/{prim_key}"[len(key):]
+
+    def hashable_params(params: Any) -> Any:
+        if isinstance(params, (tuple, list)):
+            return tuple(hashable_params(param) for param in params)
+        elif isinstance(params, np.ndarray) or hasattr(params, "__array__"):
+            array = np.asarray(params)
+            return (array.dtype.str, array.shape, array.tobytes())
+        try:
+            hash(params)
+        except TypeError:
+            return ("object", id(params))
+        return params
+
+    # The `[1:]` removes the 'root' constraint which is just a container
+    flat_constraints = zip(
+        list(cn.iter_flat("", layout.root_constraint))[1:],
+        list(cn.iter_flat("", layout.root_prim_keys))[1:],
+        list(cn.iter_flat("", layout.root_param))[1:],
+    )
+
+    # Map each construction acting on primitives to the keys of constraints
+    # with each set of parameters
+    seen_constraints: dict[Any, dict[Any, str]] = {}
+    is_duplicate = []
+    near_duplicates = []
+    for (key, constraint), (_, prim_keys), (_, params) in flat_constraints:
+        if constraint.signature.value_size == 0:
+            is_duplicate.append(False)
+            continue
+
+        construction_id = (
+            constraint.assem_identity(),
+            tuple(constraint.signature),
+            tuple(resolve_prim_key(prim_key) for prim_key in prim_keys.value)
+        )
+        params_id = hashable_params(params.value)
+
+        seen_params = seen_constraints.setdefault(construction_id, {})
+        if params_id in seen_params:
+            is_duplicate.append(True)
+        else:
+            is_duplicate.append(False)
+            if len(seen_params) > 0:
+                near_duplicates.append((key, next(iter(seen_params.values()))))
+            seen_params[params_id] = key
+    return is_duplicate, near_duplicates
+
+def find_constrained_values(
+    prim_graph: dict[str, int],
+    constraint_graph: list[cr.PrimKeys],
+    num_values: int
+) -> NDArray:
+    """
+    Return whether each unique primitive value is referenced by a constraint
+
+    A unique value is referenced if a constraint acts on one of its
+    primitives or on a parent of one of its primitives.
+
+    Parameters
+    ----------
+    prim_graph: dict[str, int]
+        A mapping from primitive keys to unique primitive values (see
+        `pr.filter_unique_values_from_prim`)
+    constraint_graph: list[cr.PrimKeys]
+        A list of primitive keys for each constraint
+    num_values: int
+        The number of unique primitive values
+
+    Returns
+    -------
+    NDArray
+        A boolean array indicating referenced unique values
+    """
+    constrained_keys = {
+        f"/{key}" for prim_keys in constraint_graph for key in prim_keys
+    }
+    is_constrained = np.zeros(num_values, dtype=bool)
+    for key, idx in prim_graph.items():
+        parent_key = key
+        while parent_key and not is_constrained[idx]:
+            is_constrained[idx] = parent_key in constrained_keys
+            parent_key, _, _ = parent_key.rpartition("/")
+    return is_constrained
+
+def color_free_blocks(
+    prim_graph: dict[str, int],
+    constraint_graph: list[cr.PrimKeys],
+    is_free: NDArray
+) -> NDArray:
+    """
+    Return colors of free unique primitive values so that values sharing a
+    constraint have different colors
+
+    A constraint acts on the unique values of its primitives and their
+    children (see `find_constrained_values`). Colors are assigned greedily so
+    values with the same color never appear in the same constraint residual.
+
+    Parameters
+    ----------
+    prim_graph: dict[str, int]
+        A mapping from primitive keys to unique primitive values (see
+        `pr.filter_unique_values_from_prim`)
+    constraint_graph: list[cr.PrimKeys]
+        A list of primitive keys for each constraint
+    is_free: NDArray
+        A boolean array indicating free unique values
+
+    Returns
+    -------
+    NDArray
+        The color of each free unique value
+    """
+    key_to_constraints = {}
+    for constraint_idx, prim_keys in enumerate(constraint_graph):
+        for key in prim_keys:
+            key_to_constraints.setdefault(f"/{key}", set()).add(constraint_idx)
+
+    free_idxs = np.cumsum(is_free) - 1
+    constraint_blocks = [set() for _ in constraint_graph]
+    for key, idx in prim_graph.items():
+        if not is_free[idx]:
+            continue
+        parent_key = key
+        while parent_key:
+            for constraint_idx in key_to_constraints.get(parent_key, ()):
+                constraint_blocks[constraint_idx].add(free_idxs[idx])
+            parent_key, _, _ = parent_key.rpartition("/")
+
+    num_blocks = int(np.sum(is_free))
+    neighbours = [set() for _ in range(num_blocks)]
+    for blocks in constraint_blocks:
+        for block in blocks:
+            neighbours[block].update(blocks)
+
+    colors = np.full(num_blocks, -1, dtype=int)
+    for block in range(num_blocks):
+        used_colors = {colors[neighbour] for neighbour in neighbours[block]}
+        color = 0
+        while color in used_colors:
+            color += 1
+        colors[block] = color
+    return colors
+
+def pack_global_param(
+    prim_values: list[NDArray], is_free: NDArray
+) -> tuple[NDArray, Callable[[NDArray], list[NDArray]]]:
+    """
+    Return the global parameter vector and a function to unpack it
+
+    Parameters
+    ----------
+    prim_values: list[NDArray]
+        Unique primitive values
+    is_free: NDArray
+        Whether each unique primitive value is in the global parameter vector
+
+    Returns
+    -------
+    global_param: NDArray
+        The concatenated free unique primitive values
+    unpack_global_param: Callable[[NDArray], list[NDArray]]
+        A function returning all unique primitive values from a global
+        parameter vector
+
+        Values that aren't free are returned unchanged.
+    """
+    free_values = [value for value, free in zip(prim_values, is_free) if free]
+    # `idx_bounds[n], idx_bounds[n+1]` are the indices between which the
+    # `n`th free value is stored
+    idx_bounds = np.cumsum([0] + [value.size for value in free_values])
+
+    def unpack_global_param(global_param: NDArray) -> list[NDArray]:
+        free_params = (
+            global_param[idx_start:idx_end]
+            for idx_start, idx_end in zip(idx_bounds[:-1], idx_bounds[1:])
+        )
+        return [
+            next(free_params) if free else value
+            for value, free in zip(prim_values, is_free)
+        ]
+
+    return np.concatenate([np.zeros(0)] + free_values), unpack_global_param
+
+
+## Jacobian assembly
+
+def find_jacobian_chunk_size(
+    compiled_jac_column: "jax.stages.Compiled",
+    num_param: int,
+    memory_budget: int,
+    max_chunk_size: Optional[int] = None
+) -> int:
+    """
+    Return the number of Jacobian columns that can be evaluated within a memory budget
+
+    The memory needed per column is estimated from the XLA memory analysis of
+    a compiled function evaluating a single column. Argument, output and
+    temporary buffers are all assumed to scale with the number of columns,
+    which over-estimates memory use for larger chunks.
+
+    Parameters
+    ----------
+    compiled_jac_column: jax.stages.Compiled
+        A compiled function evaluating one Jacobian column
+    num_param: int
+        The number of Jacobian columns
+    memory_budget: int
+        The memory budget (in bytes)
+    max_chunk_size: Optional[int]
+        An optional upper bound for the chunk size
+
+    Returns
+    -------
+    int
+        The chunk size
+
+        This is at least 1, even if a single column exceeds the budget.
+    """
+    memory = compiled_jac_column.memory_analysis()
+    if memory is None:
+        # Some backends don't support memory analysis so only count the column
+        out_info = compiled_jac_column.out_info
+        column_bytes = np.prod(out_info.shape) * np.dtype(out_info.dtype).itemsize
+    else:
+        column_bytes = (
+            memory.argument_size_in_bytes
+            + memory.output_size_in_bytes
+            + memory.temp_size_in_bytes
+        )
+
+    chunk_size = memory_budget // max(int(column_bytes), 1)
+    if max_chunk_size is not None:
+        chunk_size = min(chunk_size, max_chunk_size)
+    return int(max(min(chunk_size, num_param), 1))
+
+
+def assem_chunked_jacobian(
+    assem_jac_chunk: Callable[[NDArray, NDArray], NDArray],
+    global_param: NDArray,
+    chunk_size: int,
+    sparse_storage: bool = False
+) -> "NDArray | sparse.csr_array":
+    """
+    Return a Jacobian assembled from chunks of columns
+
+    Columns are evaluated in chunks of `chunk_size` tangent vectors so that
+    memory for forward-mode tangents is bounded by the chunk size rather than
+    the number of parameters. The last chunk is padded with zero tangents so
+    every chunk has the same (compiled) shape.
+
+    Parameters
+    ----------
+    assem_jac_chunk: Callable[[NDArray, NDArray], NDArray]
+        A function returning Jacobian-tangent products, with shape
+        `(num_res, chunk_size)`, given a parameter vector and `(chunk_size,
+        num_param)` tangents
+    global_param: NDArray
+        The parameter vector to evaluate the Jacobian at
+    chunk_size: int
+        The number of columns evaluated at once
+    sparse_storage: bool
+        Whether to store the Jacobian as a sparse (CSR) array
+
+        Only nonzeros of each chunk are kept, which is useful if the Jacobian
+        is too large to store densely.
+
+    Returns
+    -------
+    NDArray | sparse.csr_array
+        The Jacobian
+    """
+    num_param = global_param.size
+
+    jac = None
+    sparse_chunks = []
+    for idx_start in range(0, num_param, chunk_size):
+        idx_end = min(idx_start + chunk_size, num_param)
+        num_col = idx_end - idx_start
+
+        tangents = np.zeros((chunk_size, num_param))
+        tangents[np.arange(num_col), np.arange(idx_start, idx_end)] = 1
+        jac_chunk = np.asarray(assem_jac_chunk(global_param, tangents))[:, :num_col]
+
+        if sparse_storage:
+            sparse_chunks.append(sparse.csc_array(jac_chunk))
+        else:
+            if jac is None:
+                jac = np.zeros((jac_chunk.shape[0], num_param), dtype=jac_chunk.dtype)
+            jac[:, idx_start:idx_end] = jac_chunk
+
+    if num_param == 0:
+        num_res = np.asarray(assem_jac_chunk(global_param, np.zeros((chunk_size, 0)))).shape[0]
+        jac = np.zeros((num_res, 0))
+        sparse_chunks = [sparse.csc_array(jac)]
+
+    if sparse_storage:
+        # Linear solvers slice rows so CSR is used for the whole Jacobian
+        return sparse.hstack(sparse_chunks, format='csr')
+    else:
+        return jac
+
+
+## Linear solves
+
+def dense_jacobian_block(
+    jac: "NDArray | sparse.sparray", rows: NDArray, cols: NDArray
+) -> NDArray:
+    """
+    Return a dense block of a dense or sparse Jacobian
+
+    Linear solvers for newton steps accept sparse Jacobians (see
+    `assem_chunked_jacobian`) and only make them dense one block at a time.
+
+    Parameters
+    ----------
+    jac: NDArray | sparse.sparray
+        The Jacobian with shape `(m, n)`
+    rows, cols: NDArray
+        Row and column indices of the block
+
+    Returns
+    -------
+    NDArray
+        The block with shape `(rows.size, cols.size)`
+    """
+    if sparse.issparse(jac):
+        return jac[rows][:, cols].toarray()
+    else:
+        return jac[np.ix_(rows, cols)]
+
+def find_jacobian_blocks(
+    jac: "NDArray | sparse.sparray"
+) -> list[tuple[NDArray, NDArray]]:
+    """
+    Return independent blocks of a Jacobian
+
+    Blocks are connected components of the graph linking residual rows to the
+    parameter columns they depend on (non-zero entries).
+    For example, layouts with only horizontal and vertical relations have
+    separate blocks for x and y coordinates.
+
+    Parameters
+    ----------
+    jac: NDArray | sparse.sparray
+        The (dense or sparse) Jacobian with shape `(m, n)`
+
+    Returns
+    -------
+    list[tuple[NDArray, NDArray]]
+        Row and column indices for each block
+
+        Rows and columns without any non-zero entries aren't in any block.
+    """
+    num_row, num_col = jac.shape
+    rows, cols = np.nonzero(jac)
+    graph = sparse.coo_array(
+        (np.ones(rows.size), (rows, num_row + cols)),
+        shape=(num_row + num_col, num_row + num_col)
+    )
+    _, labels = csgraph.connected_components(graph, directed=False)
+    row_labels, col_labels = labels[:num_row], labels[num_row:]
+
+    # Only components with non-zero entries are blocks
+    block_labels = np.unique(labels[rows])
+    row_order = np.argsort(row_labels, kind='stable')
+    col_order = np.argsort(col_labels, kind='stable')
+    row_bounds = np.searchsorted(row_labels[row_order], [block_labels, block_labels+1])
+    col_bounds = np.searchsorted(col_labels[col_order], [block_labels, block_labels+1])
+    return [
+        (row_order[row_start:row_stop], col_order[col_start:col_stop])
+        for row_start, row_stop, col_start, col_stop
+        in zip(*row_bounds, *col_bounds)
+    ]
+
+def solve_block_lstsq(
+    jac: "NDArray | sparse.sparray", res: NDArray
+) -> tuple[NDArray, int, NDArray, int]:
+    """
+    Return the minimum norm least squares solution of `jac @ x = res`
+
+    The Jacobian is split into independent blocks (see `find_jacobian_blocks`)
+    which are solved separately.
+    This gives the same solution as `np.linalg.lstsq` for the whole system but
+    is faster when there are several blocks since dense solve costs grow
+    cubically with the block size.
+
+    Parameters
+    ----------
+    jac: NDArray | sparse.sparray
+        The (dense or sparse) Jacobian with shape `(m, n)`
+    res: NDArray
+        The right hand side with shape `(m,)`
+
+    Returns
+    -------
+    x: NDArray
+        The solution with shape `(n,)`
+    rank: int
+        The numerical rank of `jac`
+    s: NDArray
+        The `min(m, n)` singular values of `jac` in decreasing order
+    num_blocks: int
+        The number of blocks
+    """
+    blocks = find_jacobian_blocks(jac)
+    if len(blocks) == 1 and all(
+        idxs.size == size for idxs, size in zip(blocks[0], jac.shape)
+    ):
+        x, _, rank, s = np.linalg.lstsq(
+            dense_jacobian_block(jac, *blocks[0]), res, rcond=None
+        )
+        return x, rank, s, 1
+
+    x = np.zeros(jac.shape[1], dtype=np.result_type(jac.dtype, res))
+    rank = 0
+    s = [np.zeros(min(jac.shape), dtype=jac.dtype)]
+    for rows, cols in blocks:
+        x[cols], _, block_rank, block_s = np.linalg.lstsq(
+            dense_jacobian_block(jac, rows, cols), res[rows], rcond=None
+        )
+        rank += block_rank
+        s.append(block_s)
+    s = np.sort(np.concatenate(s))[::-1][:min(jac.shape)]
+    return x, rank, s, len(blocks)
+
+
+def match_rows_to_cols(jac: "NDArray | sparse.sparray") -> NDArray:
+    """
+    Return a maximum matching of Jacobian rows to columns
+
+    The matching maximizes the product of absolute values of matched entries if
+    every row or every column can be matched.
+    This tends to give numerically non-singular diagonal blocks in
+    `find_block_triangular_order`.
+
+    Parameters
+    ----------
+    jac: NDArray | sparse.sparray
+        The (dense or sparse) Jacobian with shape `(m, n)`
+
+    Returns
+    -------
+    NDArray
+        The column matched to each row (or -1 for unmatched rows)
+    """
+    rows, cols = np.nonzero(jac)
+    abs_values = np.abs(jac[rows, cols])
+    # Weights are positive since zero weights are treated as missing edges
+    weights = 1 + np.log(np.max(abs_values, initial=1)) - np.log(abs_values)
+    try:
+        matched_rows, matched_cols = csgraph.min_weight_full_bipartite_matching(
+            sparse.csr_array((weights, (rows, cols)), shape=jac.shape)
+        )
+    except ValueError:
+        return csgraph.maximum_bipartite_matching(
+            sparse.csr_array((jac != 0).astype(float)), perm_type='column'
+        )
+    row_to_col = np.full(jac.shape[0], -1)
+    row_to_col[matched_rows] = matched_cols
+    return row_to_col
+
+def find_block_triangular_order(
+    jac: "NDArray | sparse.sparray"
+) -> list[tuple[NDArray, NDArray]]:
+    """
+    Return blocks of a Jacobian in block triangular (Dulmage-Mendelsohn) order
+
+    Rows and columns of the Jacobian are matched with a maximum bipartite
+    matching.
+    Rows and columns that can't all be matched (the under-determined part) form
+    the last block.
+    The remaining matched rows and columns are split into strongly connected
+    components where each component only depends on columns of earlier
+    components.
+    Unmatched rows (redundant or over-determined rows) are added to the last
+    component they depend on.
+
+    For "constructive" layouts (for example, a figure positioned relative to
+    an origin and axes positioned relative to the figure) most blocks are
+    small.
+
+    Parameters
+    ----------
+    jac: NDArray | sparse.sparray
+        The (dense or sparse) Jacobian with shape `(m, n)`
+
+    Returns
+    -------
+    list[tuple[NDArray, NDArray]]
+        Row and column indices for each block in solve order
+
+        Residual rows of a block only depend on columns of that block and
+        earlier blocks.
+        Rows without any non-zero entries aren't in any block.
+    """
+    num_row, num_col = jac.shape
+    jac_nonzero = sparse.csr_array((jac != 0).astype(float))
+    row_to_col = match_rows_to_cols(jac)
+    is_matched_row = row_to_col >= 0
+    col_to_row = np.full(num_col, -1)
+    col_to_row[row_to_col[is_matched_row]] = np.flatnonzero(is_matched_row)
+    is_matched_col = col_to_row >= 0
+
+    ## Find the under-determined part
+    # These are columns and rows reachable by alternating paths from unmatched
+    # columns (column to row through Jacobian entries and row to column
+    # through the matching)
+    matching = sparse.csr_array(
+        (
+            np.ones(np.sum(is_matched_row)),
+            (np.flatnonzero(is_matched_row), row_to_col[is_matched_row])
+        ),
+        shape=(num_row, num_col)
+    )
+    # Nodes are columns, then rows, then a source node linked to unmatched
+    # columns
+    num_node = num_col + num_row
+    graph = sparse.block_array([
+        [None, jac_nonzero.T, sparse.csr_array((num_col, 1))],
+        [matching, None, sparse.csr_array((num_row, 1))],
+        [
+            sparse.csr_array(~is_matched_col[None, :], dtype=float),
+            sparse.csr_array((1, num_row)),
+            None
+        ]
+    ], format='csr')
+    nodes = csgraph.breadth_first_order(graph, num_node, return_predecessors=False)
+    is_under = np.zeros(num_node+1, dtype=bool)
+    is_under[nodes] = True
+    is_under_col, is_under_row = is_under[:num_col], is_under[num_col:-1]
+
+    ## Split matched rows into strongly connected components
+    # Each matched row depends on the rows matched to its columns
+    dep_rows = np.flatnonzero(is_matched_row & ~is_under_row)
+    row_to_dep_idx = np.full(num_row, -1)
+    row_to_dep_idx[dep_rows] = np.arange(dep_rows.size)
+    rows, cols = jac_nonzero[dep_rows].nonzero()
+    dep_idxs = row_to_dep_idx[col_to_row[cols]]
+    is_dep = is_matched_col[cols] & ~is_under_col[cols]
+    rows, dep_idxs = rows[is_dep], dep_idxs[is_dep]
+    dep_graph = sparse.csr_array(
+        (np.ones(rows.size), (rows, dep_idxs)),
+        shape=(dep_rows.size, dep_rows.size)
+    )
+    num_comp, comp_labels = csgraph.connected_components(
+        dep_graph, directed=True, connection='strong'
+    )
+
+    # Order components so that dependencies are solved first (Kahn's
+    # algorithm on the graph of components)
+    comp_edges = {
+        (comp_a, comp_b)
+        for comp_a, comp_b in zip(comp_labels[rows], comp_labels[dep_idxs])
+        if comp_a != comp_b
+    }
+    comp_deps = [set() for _ in range(num_comp)]
+    comp_dependents = [[] for _ in range(num_comp)]
+    for comp_a, comp_b in comp_edges:
+        comp_deps[comp_a].add(comp_b)
+        comp_dependents[comp_b].append(comp_a)
+    comp_order = [comp for comp in range(num_comp) if len(comp_deps[comp]) == 0]
+    for comp in comp_order:
+        for dependent in comp_dependents[comp]:
+            comp_deps[dependent].discard(comp)
+            if len(comp_deps[dependent]) == 0:
+                comp_order.append(dependent)
+    comp_positions = np.empty(num_comp, dtype=int)
+    comp_positions[comp_order] = np.arange(num_comp)
+
+    ## Add unmatched rows to the last component they depend on
+    # Unmatched rows only depend on matched columns (otherwise the matching
+    # could be augmented) and never on under-determined columns
+    extra_rows, cols = jac_nonzero[~is_matched_row].nonzero()
+    extra_rows = np.flatnonzero(~is_matched_row)[extra_rows]
+    col_positions = comp_positions[comp_labels[row_to_dep_idx[col_to_row[cols]]]]
+    extra_row_positions = np.full(num_row, -1)
+    np.maximum.at(extra_row_positions, extra_rows, col_positions)
+
+    ## Collect rows and columns of each block
+    row_positions = np.full(num_row, -1)
+    row_positions[dep_rows] = comp_positions[comp_labels]
+    row_positions[~is_matched_row] = extra_row_positions[~is_matched_row]
+    row_order = np.argsort(row_positions, kind='stable')
+    row_bounds = np.searchsorted(row_positions[row_order], np.arange(num_comp+1))
+
+    blocks = []
+    for row_start, row_stop in zip(row_bounds[:-1], row_bounds[1:]):
+        block_rows = row_order[row_start:row_stop]
+        block_cols = row_to_col[block_rows]
+        blocks.append((block_rows, np.sort(block_cols[block_cols >= 0])))
+
+    under_rows, under_cols = np.flatnonzero(is_under_row), np.flatnonzero(is_under_col)
+    if under_rows.size > 0 or under_cols.size > 0:
+        blocks.append((under_rows, under_cols))
+    return blocks
+
+def solve_block_triangular(
+    jac: "NDArray | sparse.sparray", res: NDArray
+) -> tuple[NDArray, list[int]]:
+    """
+    Return a least squares solution of `jac @ x = res` by block substitution
+
+    Blocks from `find_block_triangular_order` are solved in order with
+    solutions of earlier blocks substituted into later blocks.
+    Each block is solved with `np.linalg.lstsq` so blocks with redundant rows
+    have least squares solutions and the under-determined block has a minimum
+    norm solution.
+    Blocks can be numerically rank deficient even if they're structurally
+    square (for example, a box with coincident corners).
+    These blocks are merged with the next block that depends on them until
+    the merged block has full column rank.
+
+    For square, non-singular Jacobians (and consistent over-determined
+    Jacobians) this gives the same solution as a solve of the whole system.
+
+    Parameters
+    ----------
+    jac: NDArray | sparse.sparray
+        The (dense or sparse) Jacobian with shape `(m, n)`
+    res: NDArray
+        The right hand side with shape `(m,)`
+
+    Returns
+    -------
+    x: NDArray
+        The solution with shape `(n,)`
+    block_sizes: list[int]
+        The number of columns in each solved (merged) block
+    """
+    x = np.zeros(jac.shape[1], dtype=np.result_type(jac.dtype, res))
+    block_sizes = []
+    # Rows and columns of rank deficient blocks and a label for each column
+    deferred_blocks: dict[int, tuple[NDArray, NDArray]] = {}
+    col_to_deferred = np.full(jac.shape[1], -1)
+    jac_nonzero = sparse.csr_array((jac != 0).astype(float))
+    for n, (rows, cols) in enumerate(find_block_triangular_order(jac)):
+        # Merge deferred blocks with columns that this block depends on
+        dep_cols = np.unique(jac_nonzero[rows].nonzero()[1])
+        dep_labels = np.unique(col_to_deferred[dep_cols])
+        for label in dep_labels[dep_labels >= 0]:
+            deferred_rows, deferred_cols = deferred_blocks.pop(label)
+            rows = np.concatenate([deferred_rows, rows])
+            cols = np.concatenate([deferred_cols, cols])
+            x[deferred_cols] = 0
+            col_to_deferred[deferred_cols] = -1
+        if rows.size == 0 or cols.size == 0:
+            continue
+
+        # `x` is zero for columns of merged and later blocks
+        block_res = res[rows] - jac[rows] @ x
+        x[cols], _, rank, _ = np.linalg.lstsq(
+            dense_jacobian_block(jac, rows, cols), block_res, rcond=None
+        )
+        block_sizes.append(cols.size)
+        if rank < cols.size:
+            deferred_blocks[n] = (rows, cols)
+            col_to_deferred[cols] = n
+    return x, block_sizes
+
+
+def partition_jacobian(
+    jac: "NDArray | sparse.sparray", max_interface_fraction: float = 0.1
+) -> tuple[list[tuple[NDArray, NDArray]], tuple[NDArray, NDArray]]:
+    """
+    Return subdomains and an interface that split a Jacobian
+
+    Columns (parameters) are linked if a residual row depends on both.
+    The most linked columns are moved to the interface until the remaining
+    columns split into subdomains (connected components) where the largest
+    subdomain has at most half the remaining columns.
+    For example, in a large layout coupled through figure dimensions and shared
+    margins, the interface contains the figure and margin parameters.
+
+    Parameters
+    ----------
+    jac: NDArray | sparse.sparray
+        The (dense or sparse) Jacobian with shape `(m, n)`
+    max_interface_fraction: float
+        The largest fraction of columns in the interface
+
+        If the columns can't be split with a small enough interface, the
+        interface is empty and there's one subdomain.
+
+    Returns
+    -------
+    subdomains: list[tuple[NDArray, NDArray]]
+        Row and column indices for each subdomain
+
+        Subdomain rows only depend on subdomain and interface columns.
+    interface: tuple[NDArray, NDArray]
+        Row and column indices of the interface
+
+        Interface rows only depend on interface columns.
+    """
+    num_row, num_col = jac.shape
+    jac_nonzero = sparse.csr_array((jac != 0).astype(float))
+    col_graph = sparse.csr_array(jac_nonzero.T @ jac_nonzero)
+    degrees = np.diff(col_graph.indptr)
+    col_order = np.argsort(-degrees, kind='stable')
+
+    def split(interface_size: int) -> tuple[NDArray, int, NDArray]:
+        is_interface = np.zeros(num_col, dtype=bool)
+        is_interface[col_order[:interface_size]] = True
+        is_inner = ~is_interface
+        _, labels = csgraph.connected_components(
+            col_graph[is_inner][:, is_inner], directed=False
+        )
+        col_labels = np.full(num_col, -1)
+        col_labels[is_inner] = labels
+        max_size = np.max(np.bincount(labels), initial=0)
+        return col_labels, max_size, is_interface
+
+    # Try interface sizes 0, 1, 2, 4, ...
+    max_interface_size = int(max_interface_fraction * num_col)
+    interface_sizes = [0] + [
+        2**n for n in range(int(np.log2(max(max_interface_size, 1))) + 1)
+    ]
+    for interface_size in interface_sizes:
+        col_labels, max_size, is_interface = split(interface_size)
+        if 2*max_size <= num_col - interface_size:
+            break
+    else:
+        col_labels, _, is_interface = split(0)
+        col_labels[:] = 0
+
+    # Rows belong to the subdomain of their non-interface columns
+    rows, cols = jac_nonzero.nonzero()
+    row_labels = np.full(num_row, -1)
+    np.maximum.at(row_labels, rows, col_labels[cols])
+
+    num_subdomain = np.max(col_labels, initial=-1) + 1
+    row_order = np.argsort(row_labels, kind='stable')
+    col_order = np.argsort(col_labels, kind='stable')
+    row_bounds = np.searchsorted(row_labels[row_order], np.arange(-1, num_subdomain+1))
+    col_bounds = np.searchsorted(col_labels[col_order], np.arange(-1, num_subdomain+1))
+    subdomains = [
+        (row_order[row_start:row_stop], col_order[col_start:col_stop])
+        for row_start, row_stop, col_start, col_stop
+        in zip(row_bounds[1:-1], row_bounds[2:], col_bounds[1:-1], col_bounds[2:])
+    ]
+    interface = (row_order[:row_bounds[1]], np.flatnonzero(is_interface))
+    return subdomains, interface
+
+def solve_schur(
+    jac: "NDArray | sparse.sparray",
+    res: NDArray,
+    executor: Optional[concurrent.futures.Executor] = None,
+    max_interface_fraction: float = 0.1
+) -> tuple[NDArray, int, int]:
+    """
+    Return a least squares solution of `jac @ x = res` with a Schur complement
+
+    The Jacobian is split into subdomains and an interface (see
+    `partition_jacobian`).
+    Subdomain parameters are eliminated independently (in parallel if an
+    executor is given) which leaves a least squares problem for the interface parameters (the
+    Schur complement).
+    Subdomain parameters are then found from the interface parameters.
+
+    If every subdomain block has full column rank, this gives the same
+    solution as a least squares solve of the whole system.
+
+    Parameters
+    ----------
+    jac: NDArray | sparse.sparray
+        The (dense or sparse) Jacobian with shape `(m, n)`
+    res: NDArray
+        The right hand side with shape `(m,)`
+    executor: Optional[concurrent.futures.Executor]
+        An executor used to solve subdomains
+
+        If `None`, subdomains are solved serially in the current thread.
+        Pass the same executor for repeated solves (for example, each newton
+        iteration) so worker threads aren't recreated.
+    max_interface_fraction: float
+        The largest fraction of columns in the interface (see
+        `partition_jacobian`)
+
+    Returns
+    -------
+    x: NDArray
+        The solution with shape `(n,)`
+    num_subdomains: int
+        The number of subdomains
+    interface_size: int
+        The number of interface parameters
+    """
+    subdomains, (interface_rows, interface_cols) = partition_jacobian(
+        jac, max_interface_fraction
+    )
+    # Projections lose precision in single precision (the `jax` default) so
+    # use at least double precision
+    dtype = np.result_type(jac.dtype, res)
+    jac = jac.astype(np.promote_types(dtype, np.float64))
+    res = res.astype(np.promote_types(dtype, np.float64))
+
+    def eliminate(subdomain: tuple[NDArray, NDArray]):
+        # Project the subdomain rows onto the orthogonal complement of the
+        # subdomain block's range
+        rows, cols = subdomain
+        u, s, vh = np.linalg.svd(
+            dense_jacobian_block(jac, rows, cols), full_matrices=False
+        )
+        # This matches the default `rcond` of `np.linalg.lstsq`
+        tol = np.max(s, initial=0) * np.finfo(s.dtype).eps * max(rows.size, cols.size)
+        rank = np.sum(s > tol)
+        u, s, vh = u[:, :rank], s[:rank], vh[:rank]
+        jac_interface = dense_jacobian_block(jac, rows, interface_cols)
+        proj_jac = jac_interface - u @ (u.T @ jac_interface)
+        proj_res = res[rows] - u @ (u.T @ res[rows])
+        return (u, s, vh), proj_jac, proj_res
+
+    def back_substitute(subdomain, factor, x_interface: NDArray) -> NDArray:
+        rows, cols = subdomain
+        u, s, vh = factor
+        sub_res = res[rows] - dense_jacobian_block(jac, rows, interface_cols) @ x_interface
+        return vh.T @ ((u.T @ sub_res) / s)
+
+    def solve_subdomains(map_subdomains: Callable) -> NDArray:
+        eliminated = list(map_subdomains(eliminate, subdomains))
+        factors = [factor for factor, _, _ in eliminated]
+
+        schur_jac = np.concatenate(
+            [dense_jacobian_block(jac, interface_rows, interface_cols)]
+            + [proj_jac for _, proj_jac, _ in eliminated]
+        )
+        schur_res = np.concatenate(
+            [res[interface_rows]] + [proj_res for _, _, proj_res in eliminated]
+        )
+        x_interface, *_ = np.linalg.lstsq(schur_jac, schur_res, rcond=None)
+
+        x = np.zeros(jac.shape[1], dtype=dtype)
+        x[interface_cols] = x_interface
+        sub_xs = map_subdomains(
+            back_substitute, subdomains, factors, len(subdomains)*[x_interface]
+        )
+        for (_, cols), sub_x in zip(subdomains, sub_xs):
+            x[cols] = sub_x
+        return x
+
+    x = solve_subdomains(map if executor is None else executor.map)
+    return x, len(subdomains), interface_cols.size
+
+
+def make_block_jacobi(
+    jtj: Callable[[NDArray], NDArray],
+    block_sizes: list[int],
+    block_colors: NDArray,
+    rcond: float = 1e-6
+) -> Callable[[NDArray], NDArray]:
+    """
+    Return a block-Jacobi preconditioner for a Jacobian given its normal product
+
+    The diagonal blocks of the normal matrix `J^T J` are probed with
+    structured tangents. For each color (see `color_free_blocks`), tangent `k`
+    sets the `k`-th entry of every block with that color. Blocks with the
+    same color don't share residuals, so their Jacobian columns are
+    orthogonal and each block's rows of `J^T J` times the tangent give the
+    block's `k`-th diagonal column exactly. This needs one normal product per
+    color and block entry rather than one per parameter. The preconditioner
+    applies the inverse square root of each block so it can be used as a
+    symmetric right preconditioner (`J M y = b` with `x = M y`).
+
+    Parameters
+    ----------
+    jtj: Callable[[NDArray], NDArray]
+        A function returning `J^T J x` for a parameter-sized vector `x`
+    block_sizes: list[int]
+        The sizes of consecutive parameter blocks
+    block_colors: NDArray
+        The color of each block
+    rcond: float
+        Block eigenvalues below `rcond` times the block's largest eigenvalue
+        are treated as null
+
+    Returns
+    -------
+    Callable[[NDArray], NDArray]
+        A function applying the preconditioner to a parameter-sized vector
+    """
+    block_sizes = np.array(block_sizes, dtype=int)
+    block_colors = np.asarray(block_colors)
+    num_param = block_sizes.sum()
+    idx_bounds = np.cumsum(np.concatenate([[0], block_sizes]))
+
+    blocks = [np.zeros((size, size)) for size in block_sizes]
+    for color in np.unique(block_colors[block_sizes > 0]):
+        color_blocks = np.flatnonzero((block_colors == color) & (block_sizes > 0))
+        for k in range(block_sizes[color_blocks].max()):
+            probed_blocks = color_blocks[block_sizes[color_blocks] > k]
+            tangent = np.zeros(num_param)
+            tangent[idx_bounds[probed_blocks] + k] = 1
+            normal_col = jtj(tangent)
+            for block in probed_blocks:
+                blocks[block][:, k] = normal_col[idx_bounds[block]:idx_bounds[block+1]]
+
+    # Group blocks by size so each group is applied as one stacked array
+    size_to_idxs = {}
+    size_to_inv_sqrt = {}
+    for idx_start, idx_end, block in zip(idx_bounds[:-1], idx_bounds[1:], blocks):
+        idxs = np.arange(idx_start, idx_end)
+        if idxs.size == 0:
+            continue
+        eigvals, eigvecs = np.linalg.eigh(0.5*(block + block.T))
+        # Replace (near) null eigenvalues by the largest eigenvalue so
+        # unconstrained directions aren't amplified; all-zero blocks are left
+        # unscaled
+        max_eigval = eigvals.max() if eigvals.max() > 0 else 1.0
+        eigvals = np.where(eigvals > rcond*max_eigval, eigvals, max_eigval)
+
+        size_to_idxs.setdefault(idxs.size, []).append(idxs)
+        size_to_inv_sqrt.setdefault(idxs.size, []).append(
+            (eigvecs / np.sqrt(eigvals)) @ eigvecs.T
+        )
+
+    size_to_idxs = {size: np.array(idxs) for size, idxs in size_to_idxs.items()}
+    size_to_inv_sqrt = {
+        size: np.array(inv_sqrts) for size, inv_sqrts in size_to_inv_sqrt.items()
+    }
+
+    def precondition(x: NDArray) -> NDArray:
+        y = np.zeros_like(x)
+        for size, idxs in size_to_idxs.items():
+            y[idxs] = np.einsum('bij,bj->bi', size_to_inv_sqrt[size], x[idxs])
+        return y
+
+    return precondition
+
+
+def forcing_term(
+    abs_err: float,
+    abs_err_prev: Optional[float],
+    eta_prev: Optional[float],
+    abs_tol: float,
+    eta_max: float = 0.9,
+    gamma: float = 0.9,
+    alpha: float = 2.0
+) -> float:
+    """
+    Return the relative tolerance of an inexact newton step
+
+    This is the second Eisenstat-Walker choice, `gamma (|r_k|/|r_k-1|)^alpha`,
+    with their safeguard against decreasing the tolerance too quickly. The
+    tolerance also isn't reduced further than needed to reach `abs_tol`.
+
+    Parameters
+    ----------
+    abs_err, abs_err_prev: float, Optional[float]
+        The residual norm at the current and previous iterations
+
+        The previous norm is `None` at the first iteration.
+    eta_prev: Optional[float]
+        The previous forcing term (`None` at the first iteration)
+    abs_tol: float
+        The absolute tolerance of the nonlinear solve
+    eta_max, gamma, alpha: float
+        Eisenstat-Walker constants
+
+    Returns
+    -------
+    float
+        The forcing term
+    """
+    if abs_err_prev is None or eta_prev is None or abs_err_prev == 0:
+        return 0.5
+
+    eta = gamma*(abs_err/abs_err_prev)**alpha
+    safeguard = gamma*eta_prev**alpha
+    if safeguard > 0.1:
+        eta = max(eta, safeguard)
+    if abs_err > 0:
+        eta = max(eta, 0.5*abs_tol/abs_err)
+    return float(min(eta, eta_max))
+
+
+## Residual assembly
+
 def assem_constraint_residual(
     root_prim: pr.Primitive,
     constraints: list[cr.Constraint],
@@ -2,24 +2,31 @@
 Utilities for visualizing primitives and constraints
 """
 
-from typing import Callable, Optional
-from matplotlib.figure import Figure
-from matplotlib.axes import Axes
-
-import matplotlib as mpl
-from matplotlib.patches import Polygon
-from matplotlib import pyplot as plt
-from matplotlib.colors import Colormap
+from typing import Callable, Optional, TYPE_CHECKING
+from numpy.typing import NDArray
+
 import numpy as np
 
+from . import lazy
 from . import primitives as pr
 from . import constraints as cr
 from . import constructions as cn
 
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure
+    from matplotlib.axes import Axes
+    from matplotlib.colors import Colormap
+
+mpl = lazy.LazyModule("matplotlib")
+patches = lazy.LazyModule("matplotlib.patches")
+collections = lazy.LazyModule("matplotlib.collections")
+ticker = lazy.LazyModule("matplotlib.ticker")
+plt = lazy.LazyModule("matplotlib.pyplot")
+
 ## Functions for plotting geometric primitives
 
 
-def plot_point(ax: Axes, point: pr.Point, label: Optional[str]=None, **kwargs):
+def plot_point(ax: "Axes", point: pr.Point, label: Optional[str]=None, **kwargs):
     """
     Plot a point
 
@@ -42,17 +49,10 @@ def rotation_from_line(line: pr.Line) -> float:
     """
     Return the rotation of a line vector
     """
-    line_vec = cn.LineVector.assem((line,))
-    unit_vec = line_vec / np.linalg.norm(line_vec)
-
-    # Since `unit_vec` has unit length, the x-component is the cosine
-    theta = 180/np.pi * np.arccos(unit_vec[0])
-    if unit_vec[1] < 0:
-        theta = theta + 180
-
-    return theta
+    coords = np.array([point.value for point in line.values()])
+    return rotation_from_line_coords(coords)
 
-def plot_line(ax: Axes, line: pr.Line, label: Optional[str]=None, **kwargs):
+def plot_line(ax: "Axes", line: pr.Line, label: Optional[str]=None, **kwargs):
     """
     Plot a line
 
@@ -78,7 +78,7 @@ def plot_line(ax: Axes, line: pr.Line, label: Optional[str]=None, **kwargs):
         theta = rotation_from_line(line)
         ax.annotate(label, (xmid, ymid), ha='center', va='baseline', rotation=theta, **kwargs)
 
-def plot_polygon(ax: Axes, polygon: pr.Polygon, label: Optional[str]=None, **kwargs):
+def plot_polygon(ax: "Axes", polygon: pr.Polygon, label: Optional[str]=None, **kwargs):
     """
     Plot a `Polygon`
 
@@ -100,7 +100,7 @@ def plot_polygon(ax: Axes, polygon: pr.Polygon, label: Optional[str]=None, **kwa
     verts = np.array([point.value for point in points])
     patch_kwargs = kwargs.copy()
     patch_kwargs['alpha'] = 0.1*kwargs['alpha']
-    poly_patch = Polygon(verts, closed=True, **patch_kwargs)
+    poly_patch = patches.Polygon(verts, closed=True, **patch_kwargs)
     ax.add_patch(poly_patch)
 
     # (line,) = ax.plot(xs, ys, **kwargs)
@@ -117,11 +117,11 @@ def plot_polygon(ax: Axes, polygon: pr.Polygon, label: Optional[str]=None, **kwa
             **kwargs
         )
 
-def plot_generic_prim(ax: Axes, prim: pr.Primitive, label: Optional[str]=None, **kwargs):
+def plot_generic_prim(ax: "Axes", prim: pr.Primitive, label: Optional[str]=None, **kwargs):
     pass
 
 def plot_prim(
-    ax: Axes,
+    ax: "Axes",
     prim: pr.Primitive,
     prim_key: str='',
     max_label_depth: int = 99,
@@ -189,7 +189,7 @@ def plot_prim(
 ## Functions for plotting arbitrary geometric primitives
 def make_plot(
     prim: pr.Primitive,
-) -> Callable[[Axes, tuple[pr.Primitive, ...]], None]:
+) -> Callable[["Axes", tuple[pr.Primitive, ...]], None]:
     """
     Return a function that can plot a `pr.Primitive` object
 
@@ -200,7 +200,7 @@ def make_plot(
 
     Returns
     -------
-    Callable[[Axes, tuple[pr.Primitive, ...]], None]
+    Callable[["Axes", tuple[pr.Primitive, ...]], None]
         A function that can plot the primitive
 
         This function is one of the above `plot_...` function
@@ -216,21 +216,249 @@ def make_plot(
         return plot_generic_prim
 
 
-def plot_prims(ax: Axes, root_prim: pr.Primitive, cmap: Colormap=mpl.colormaps['viridis']):
+def plot_prims(
+    ax: "Axes",
+    root_prim: pr.Primitive,
+    cmap: Optional["Colormap"]=None,
+    max_label_depth: int = 99,
+    label_spacing: Optional[float] = None
+):
     """
     Plot all child primitives in a root primitive
 
+    Primitives are drawn in batches (see `collect_prims`): all points in one
+    scatter plot, all lines in one `LineCollection` and all polygons in one
+    `PolyCollection`.
+    This is much faster than `plot_prim` for large layouts.
+
     Parameters
     ----------
     ax: Axes
         The axes to plot in
     root_prim: pr.Primitive
         The primitive to plot
+    cmap: Optional[Colormap]
+        The colormap used to colour each child primitive
+
+        This is 'viridis' by default.
+    max_label_depth: int
+        The maximum depth of labelled primitives
+    label_spacing: Optional[float]
+        The minimum distance between labels (in points)
+
+        Labels closer than this to an existing label are not drawn.
+        Labels for shallower primitives are drawn first.
+        If `None` (the default), all labels are drawn.
     """
+    if cmap is None:
+        cmap = mpl.colormaps['viridis']
     num_prims = len(root_prim)
+
+    batches = {"point": [], "line": [], "polygon": []}
     for ii, (key, prim) in enumerate(root_prim.items()):
         color = cmap(ii / num_prims)
-        plot_prim(ax, prim, prim_key=key, color=color)
+        for item in collect_prims(prim, key, max_label_depth):
+            kind, coords, label, depth, alpha = item
+            batches[kind].append((coords, label, depth, (*color[:3], alpha)))
+
+    # Plot primitives in batches
+    if len(batches["polygon"]) > 0:
+        verts, _, _, colors = zip(*batches["polygon"])
+        facecolors = [(*color[:3], 0.1*color[3]) for color in colors]
+        polygons = collections.PolyCollection(
+            verts, facecolors=facecolors, edgecolors=facecolors
+        )
+        ax.add_collection(polygons)
+
+    if len(batches["line"]) > 0:
+        segments, _, _, colors = zip(*batches["line"])
+        ax.add_collection(collections.LineCollection(segments, colors=colors))
+
+    if len(batches["point"]) > 0:
+        coords, _, _, colors = zip(*batches["point"])
+        coords = np.array(coords)
+        ax.scatter(coords[:, 0], coords[:, 1], c=np.array(colors), marker=".")
+
+    ax.autoscale_view()
+
+    # Add labels (shallowest first) that don't overlap existing labels
+    labels = [
+        (kind, coords, label, depth, color)
+        for kind, batch in batches.items()
+        for coords, label, depth, color in batch
+        if label is not None
+    ]
+    labels = sorted(labels, key=lambda label: label[3])
+    if label_spacing is None:
+        is_visible = np.ones(len(labels), dtype=bool)
+    else:
+        ax.apply_aspect()
+        anchors = np.array([label_anchor(kind, coords) for kind, coords, *_ in labels])
+        anchors = ax.transData.transform(anchors.reshape(-1, 2))
+        spacing = label_spacing * ax.figure.dpi / 72
+        is_visible = cull_overlapping_points(anchors, spacing)
+
+    for (kind, coords, label, _, color), visible in zip(labels, is_visible):
+        if visible:
+            annotate_prim(ax, kind, coords, label, color=color)
+
+def collect_prims(
+    prim: pr.Primitive,
+    prim_key: str='',
+    max_label_depth: int = 99
+) -> list[tuple[str, NDArray, Optional[str], int, float]]:
+    """
+    Return plotting data for a primitive and its children
+
+    This recurses through child primitives in the same way as `plot_prim`.
+
+    Parameters
+    ----------
+    prim: pr.Primitive
+        The primitive
+    prim_key: str
+        The primitive key
+    max_label_depth: int
+        The maximum depth of labelled primitives
+
+    Returns
+    -------
+    list[tuple[str, NDArray, Optional[str], int, float]]
+        A list of `(kind, coords, label, depth, alpha)` for each primitive
+
+        `kind` is one of ('point', 'line', 'polygon') and `coords` are
+        the point, line end point or polygon vertex coordinates.
+    """
+    split_key = prim_key.split("/")
+    prim_height = prim.node_height() + len(split_key) - 1
+    depth = len(split_key) - 1
+
+    if depth > max_label_depth or prim_key == '':
+        label = None
+    else:
+        parent_key = depth*"."
+        label = f"{parent_key}/{split_key[-1]}"
+
+    if prim_height == 0:
+        s = 1
+    else:
+        s = (prim_height - depth)/prim_height
+    alpha = 1*s + 0.2*(1-s)
+
+    items = []
+    if isinstance(prim, pr.Point):
+        items.append(("point", prim.value, label, depth, alpha))
+    elif isinstance(prim, pr.Line):
+        coords = np.array([point.value for point in prim.values()])
+        # Don't plot zero length lines
+        if np.any(coords[0] != coords[1]):
+            items.append(("line", coords, label, depth, alpha))
+    elif isinstance(prim, pr.Polygon):
+        coords = np.array(
+            [prim[f"Line{ii}"]["Point0"].value for ii in range(len(prim))]
+        )
+        items.append(("polygon", coords, label, depth, alpha))
+
+    # Line end points aren't plotted (see `plot_prim`)
+    if not isinstance(prim, pr.Line):
+        for child_key, child_prim in prim.items():
+            items += collect_prims(
+                child_prim, f'{prim_key}/{child_key}', max_label_depth
+            )
+    return items
+
+def label_anchor(kind: str, coords: NDArray) -> NDArray:
+    """
+    Return the label position for batched primitive data
+
+    See `collect_prims` for `kind` and `coords`.
+    """
+    if kind == "line":
+        return 1/2*coords.sum(axis=0)
+    elif kind == "polygon":
+        return coords[0]
+    else:
+        return coords
+
+def annotate_prim(
+    ax: "Axes", kind: str, coords: NDArray, label: str, **kwargs
+):
+    """
+    Label batched primitive data like `plot_point`, `plot_line`, etc.
+
+    See `collect_prims` for `kind` and `coords`.
+    """
+    anchor = label_anchor(kind, coords)
+    if kind == "line":
+        theta = rotation_from_line_coords(coords)
+        ax.annotate(
+            label, anchor, ha='center', va='baseline', rotation=theta, **kwargs
+        )
+    elif kind == "polygon":
+        ax.annotate(
+            label,
+            anchor,
+            xycoords="data",
+            xytext=(2.0, 2.0),
+            textcoords="offset points",
+            ha="left",
+            va="bottom",
+            **kwargs
+        )
+    else:
+        ax.annotate(label, anchor, ha='center', **kwargs)
+
+def rotation_from_line_coords(coords: NDArray) -> float:
+    """
+    Return the rotation of a line vector from line end point coordinates
+
+    See `rotation_from_line`.
+    """
+    line_vec = coords[1] - coords[0]
+    unit_vec = line_vec / np.linalg.norm(line_vec)
+
+    # Since `unit_vec` has unit length, the x-component is the cosine
+    theta = 180/np.pi * np.arccos(unit_vec[0])
+    if unit_vec[1] < 0:
+        theta = theta + 180
+
+    return theta
+
+def cull_overlapping_points(points: NDArray, spacing: float) -> NDArray:
+    """
+    Return a mask of points that are at least `spacing` from earlier points
+
+    Points are checked in order and a point is kept only if it's further than
+    `spacing` from all previously kept points.
+    Kept points are binned in a grid with cell size `spacing` so only
+    neighbouring cells are checked.
+
+    Parameters
+    ----------
+    points: NDArray
+        Point coordinates with shape `(n, 2)`
+    spacing: float
+        The minimum spacing
+
+    Returns
+    -------
+    NDArray
+        A boolean mask of kept points
+    """
+    is_kept = np.zeros(len(points), dtype=bool)
+    cell_to_points: dict[tuple[int, int], list[NDArray]] = {}
+    cells = np.floor(points / spacing).astype(int)
+    offsets = [(i, j) for i in (-1, 0, 1) for j in (-1, 0, 1)]
+    for n, (point, (ci, cj)) in enumerate(zip(points, cells)):
+        neighbours = (
+            neighbour
+            for di, dj in offsets
+            for neighbour in cell_to_points.get((ci+di, cj+dj), [])
+        )
+        if all(np.linalg.norm(point-neighbour) >= spacing for neighbour in neighbours):
+            is_kept[n] = True
+            cell_to_points.setdefault((ci, cj), []).append(point)
+    return is_kept
 
 
 def figure_prims(
@@ -238,7 +466,7 @@ def figure_prims(
     fig_size: tuple[float, float] = (8, 8),
     major_tick_interval: float = 1.0,
     minor_tick_interval: float = 1/8
-) -> tuple[Figure, Axes]:
+) -> tuple["Figure", "Axes"]:
     """
     Return a figure of a primitive
 
@@ -264,8 +492,8 @@ def figure_prims(
     fig, ax = plt.subplots(1, 1, figsize=fig_size)
 
     for axis in (ax.xaxis, ax.yaxis):
-        axis.set_minor_locator(mpl.ticker.MultipleLocator(minor_tick_interval))
-        axis.set_major_locator(mpl.ticker.MultipleLocator(major_tick_interval))
+        axis.set_minor_locator(ticker.MultipleLocator(minor_tick_interval))
+        axis.set_major_locator(ticker.MultipleLocator(major_tick_interval))
 
     ax.set_aspect(1)
     ax.grid()
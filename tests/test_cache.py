@@ -0,0 +1,96 @@
+"""
+Test `cache`
+"""
+
+import pytest
+
+import time
+
+import numpy as np
+
+from mpllayout import primitives as pr
+from mpllayout import constraints as co
+from mpllayout import containers as cn
+from mpllayout import layout as lay
+from mpllayout import cache
+
+
+class TestSolutionCache:
+
+    def make_layout(self, width: float = 5.0):
+        layout = lay.Layout()
+        layout.add_prim(pr.Quadrilateral(), "Figure")
+        layout.add_constraint(co.Box(), ("Figure",), ())
+        layout.add_constraint(co.Fix(), ("Figure/Line0/Point0",), (np.array([0, 0]),))
+        layout.add_constraint(co.Width(), ("Figure",), (width,))
+        layout.add_constraint(co.Height(), ("Figure",), (2.0,))
+        return layout
+
+    def test_fingerprint(self):
+        key_a = cache.fingerprint(self.make_layout(5.0))
+        key_b = cache.fingerprint(self.make_layout(5.0))
+        key_c = cache.fingerprint(self.make_layout(6.0))
+        assert key_a == key_b
+        assert key_a != key_c
+
+    def test_fingerprint_construction(self):
+        # These layouts only differ by the constraint function
+        def make_layout(constraint):
+            layout = lay.Layout()
+            layout.add_prim(pr.Point(), "PointA")
+            layout.add_prim(pr.Point(), "PointB")
+            layout.add_constraint(constraint, ("PointA", "PointB"), (1.0,), key="Distance")
+            return layout
+
+        key_x = cache.fingerprint(make_layout(co.XDistance()))
+        key_y = cache.fingerprint(make_layout(co.YDistance()))
+        assert key_x != key_y
+
+    def test_solve(self):
+        solution_cache = cache.SolutionCache()
+
+        t0 = time.time()
+        prim_a, info_a = solution_cache.solve(self.make_layout())
+        t1 = time.time()
+        prim_b, info_b = solution_cache.solve(self.make_layout())
+        t2 = time.time()
+        print(f"Miss took {t1-t0:.2e} s, hit took {t2-t1:.2e} s")
+
+        assert solution_cache.stats == {"hits": 1, "disk_hits": 0, "misses": 1, "size": 1}
+        assert prim_a is prim_b
+
+    def test_lru(self):
+        solution_cache = cache.SolutionCache(max_size=1)
+        solution_cache.solve(self.make_layout(5.0))
+        solution_cache.solve(self.make_layout(6.0))
+        solution_cache.solve(self.make_layout(5.0))
+        assert solution_cache.misses == 3
+        assert len(solution_cache) == 1
+
+    def test_disk(self, tmp_path):
+        solution_cache = cache.SolutionCache(cache_dir=tmp_path)
+        prim_a, info_a = solution_cache.solve(self.make_layout(), presolve=True)
+
+        # A new cache should load the solution from disk
+        solution_cache = cache.SolutionCache(cache_dir=tmp_path)
+        prim_b, info_b = solution_cache.solve(self.make_layout(), presolve=True)
+        assert solution_cache.disk_hits == 1
+
+        values_a = [prim.value for _, prim in cn.iter_flat("", prim_a)]
+        values_b = [prim.value for _, prim in cn.iter_flat("", prim_b)]
+        assert all(np.all(a == b) for a, b in zip(values_a, values_b))
+        assert np.all(np.isclose(info_a["abs_errs"], info_b["abs_errs"]))
+        assert info_b["presolve"]["num_merged_values"] == info_a["presolve"]["num_merged_values"]
+
+    def test_solve_kwargs(self):
+        solution_cache = cache.SolutionCache()
+        solution_cache.solve(self.make_layout(), linear_solver='block_triangular')
+        solution_cache.solve(self.make_layout(), linear_solver='lstsq')
+        assert solution_cache.misses == 2
+
+        # Profiling options don't change the solution
+        _, info = solution_cache.solve(
+            self.make_layout(), linear_solver='lstsq', profile=True, jac_chunk_size=2
+        )
+        assert solution_cache.hits == 1
+        assert "phase_times" not in info
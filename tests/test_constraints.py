@@ -770,3 +770,8 @@ class TestAxesConstraints(GeometryFixtures):
         res = co.YAxisThickness()((axes['YAxis'],), axes_mpl.yaxis)
         assert np.all(np.isclose(res, 0))
 
+    def test_AxisThickness_thickness(self, axes_mpl, xaxis_height):
+        assert co.XAxisThickness.thickness(axes_mpl.xaxis) == xaxis_height
+        assert co.XAxisThickness.thickness(0.25) == 0.25
+        assert co.XAxisThickness.thickness(None) == 0
+
@@ -96,11 +96,16 @@ class TestNode(NodeFixtures):
 
     def test_flatten_unflatten_python(self, node: cn.Node):
         fnode_structs = cn.flatten("root", node)
-        reconstructed_node, _ = cn.unflatten(fnode_structs)
+        reconstructed_node, leftover_structs = cn.unflatten(fnode_structs)
 
         print(fnode_structs)
 
         assert str(node) == str(reconstructed_node)
+        assert leftover_structs == []
+
+        # Nodes past the root node should be returned as leftovers
+        _, leftover_structs = cn.unflatten(fnode_structs + fnode_structs[:1])
+        assert leftover_structs == fnode_structs[:1]
         print(node)
         print(reconstructed_node)
 
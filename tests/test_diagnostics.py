@@ -0,0 +1,119 @@
+"""
+Test `diagnostics`
+"""
+
+import pytest
+
+import json
+
+import numpy as np
+
+from mpllayout import primitives as pr
+from mpllayout import constraints as co
+from mpllayout import layout as lay
+from mpllayout import diagnostics as dg
+
+
+class TestAttributeConstraints:
+
+    @pytest.fixture()
+    def layout(self):
+        layout = lay.Layout()
+        layout.add_prim(pr.Quadrilateral(), "Figure")
+        layout.add_prim(pr.Point([0.5, 0.5]), "Point")
+
+        layout.add_constraint(co.Box(), ("Figure",), ())
+        layout.add_constraint(co.Fix(), ("Figure/Line0/Point0",), (np.array([0, 0]),))
+        layout.add_constraint(co.Width(), ("Figure",), (4.0,))
+        layout.add_constraint(co.Height(), ("Figure",), (3.0,))
+        layout.add_constraint(co.Fix(), ("Point",), (np.array([2, 1]),))
+        return layout
+
+    def test_constraint_columns(self, layout: lay.Layout):
+        keys = dg.constraint_keys(layout)
+        columns = dict(zip(keys, dg.constraint_columns(layout)))
+
+        # The figure has 4 unique points (8 parameters) and comes first
+        # `Fix` constraints are keyed by their class name (`SumConstruction`)
+        assert list(columns["Box0"]) == list(range(8))
+        assert list(columns["SumConstruction0"]) == [0, 1]
+        assert list(columns["SumConstruction3"]) == [8, 9]
+
+    def test_attribute_constraints(self, layout: lay.Layout):
+        attributions, _, info = dg.attribute_constraints(layout, num_repeats=2)
+        print(dg.format_table(attributions))
+
+        assert [attr["key"] for attr in attributions] == dg.constraint_keys(layout)
+        num_iter = len(info["abs_errs"])
+        for attr in attributions:
+            assert len(attr["norms"]) == num_iter + 1
+        assert np.isclose(sum(attr["time_share"] for attr in attributions), 1)
+
+        # Block norms should add up to the global residual norm
+        init_norm = np.sqrt(sum(attr["norms"][0]**2 for attr in attributions))
+        assert np.isclose(init_norm, info["abs_errs"][0], rtol=1e-5)
+
+        # The point fix constraint has an initial residual of norm |(1.5, 0.5)|
+        (point_fix,) = [attr for attr in attributions if attr["key"] == "SumConstruction3"]
+        assert np.isclose(point_fix["norms"][0], np.linalg.norm([1.5, 0.5]))
+
+        assert json.loads(dg.to_json(attributions)) == attributions
+
+    def test_attribute_constraints_hooks(self, layout: lay.Layout):
+        events = []
+        def hook(event, data):
+            events.append(event)
+
+        # `hooks=None` is the default for `solve`
+        attributions, _, _ = dg.attribute_constraints(layout, hooks=None)
+        assert len(attributions) == len(dg.constraint_keys(layout))
+
+        dg.attribute_constraints(layout, hooks=(hook,))
+        assert "residual" in events
+
+    def test_attribute_duplicate_constraints(self, layout: lay.Layout):
+        # Duplicates are kept so residual blocks match constraints
+        layout.add_constraint(co.Width(), ("Figure",), (4.0,))
+        attributions, _, info = dg.attribute_constraints(layout, num_repeats=1)
+        assert [attr["key"] for attr in attributions] == dg.constraint_keys(layout)
+        init_norm = np.sqrt(sum(attr["norms"][0]**2 for attr in attributions))
+        assert np.isclose(init_norm, info["abs_errs"][0], rtol=1e-5)
+
+        with pytest.raises(ValueError):
+            dg.attribute_constraints(layout, drop_duplicates=True)
+
+
+class TestAnalyzeDOFs:
+
+    @pytest.fixture()
+    def layout(self):
+        layout = lay.Layout()
+        layout.add_prim(pr.Quadrilateral(), "Figure")
+        layout.add_prim(pr.Point([0.5, 0.5]), "Point")
+
+        layout.add_constraint(co.Box(), ("Figure",), ())
+        layout.add_constraint(co.Fix(), ("Figure/Line0/Point0",), (np.array([0, 0]),))
+        layout.add_constraint(co.Width(), ("Figure",), (4.0,))
+        return layout
+
+    def test_analyze_dofs(self, layout: lay.Layout):
+        # The figure height and the point are free
+        analysis = dg.analyze_dofs(layout)
+        print(analysis)
+        assert analysis["num_params"] == 10
+        assert analysis["rank"] == 7
+        assert analysis["num_free_dofs"] == 3
+        assert analysis["free_dofs"]["Figure"] == 1
+        assert analysis["free_dofs"]["Point"] == 2
+        assert analysis["redundant_constraints"] == {}
+
+        # Adding a height constraint removes the free figure height
+        layout.add_constraint(co.Height(), ("Figure",), (3.0,))
+        analysis = dg.analyze_dofs(layout)
+        assert "Figure" not in analysis["free_dofs"]
+
+        # A duplicate width constraint is redundant
+        layout.add_constraint(co.Width(), ("Figure",), (4.0,))
+        analysis = dg.analyze_dofs(layout)
+        print(analysis)
+        assert sum(analysis["redundant_constraints"].values()) == 1
@@ -88,3 +88,19 @@ class TestLayout:
         print("Constraints parameter vector:")
         pprint(constraints_param)
 
+
+    def test_memory_info(self):
+        layout = lat.Layout()
+
+        layout.add_prim(pr.Quadrilateral(), "MyBox")
+        layout.add_constraint(co.Box(), ("MyBox",), ())
+
+        memory_info = layout.memory_info()
+        pprint(memory_info)
+
+        # A quadrilateral has 4 lines that share 4 points
+        assert memory_info["prim_counts"]["Quadrilateral"] == 1
+        assert memory_info["prim_counts"]["Line"] == 4
+        assert memory_info["prim_counts"]["Point"] == 4
+        assert memory_info["num_unique_prims"] == 1 + 1 + 4 + 4
+        assert memory_info["constraint_counts"]["Box"] == 1
@@ -0,0 +1,114 @@
+"""
+Test deferred imports of heavy dependencies
+"""
+
+import pytest
+
+import sys
+import subprocess
+
+import numpy as np
+
+from mpllayout import lazy
+from mpllayout import primitives as pr
+from mpllayout import containers as cn
+
+
+HEAVY_MODULES = ("jax", "scipy", "matplotlib", "matplotlib.pyplot")
+
+def run_python(code: str) -> str:
+    """
+    Return the stdout of a fresh python interpreter running `code`
+    """
+    proc = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    return proc.stdout
+
+
+class TestImportTime:
+
+    @pytest.fixture(
+        params=[
+            "mpllayout",
+            "mpllayout.layout",
+            "mpllayout.constraints",
+            "mpllayout.solver",
+            "mpllayout.matplotlibutils",
+            "mpllayout.ui",
+        ]
+    )
+    def module_name(self, request):
+        return request.param
+
+    def test_import_is_lazy(self, module_name: str):
+        code = (
+            "import sys\n"
+            f"import {module_name}\n"
+            f"print(*[m for m in {HEAVY_MODULES} if m in sys.modules])\n"
+        )
+        loaded_modules = run_python(code).strip()
+        assert loaded_modules == ""
+
+    def test_user_import_registers_pytrees(self):
+        # Importing `jax` after this package should register pytree nodes
+        # without any solve or explicit hook call
+        code = (
+            "from mpllayout import primitives as pr\n"
+            "import jax\n"
+            "print(len(jax.tree_util.tree_leaves(pr.Quadrilateral())))\n"
+        )
+        assert int(run_python(code)) > 1
+
+    def test_finder_is_removed(self):
+        # The import hook should only be installed while hooks are waiting
+        code = (
+            "import sys\n"
+            "from mpllayout import lazy\n"
+            "from mpllayout import primitives as pr\n"
+            "def is_installed():\n"
+            "    return any(\n"
+            "        isinstance(finder, lazy._PostImportFinder)\n"
+            "        for finder in sys.meta_path\n"
+            "    )\n"
+            "before = is_installed()\n"
+            "import jax\n"
+            "print(before, is_installed())\n"
+        )
+        assert run_python(code).split() == ["True", "False"]
+
+    def test_build_layout_is_lazy(self):
+        code = (
+            "import sys\n"
+            "from mpllayout import layout as lay\n"
+            "from mpllayout import primitives as pr\n"
+            "from mpllayout import constraints as co\n"
+            "layout = lay.Layout()\n"
+            "layout.add_prim(pr.Quadrilateral(), 'Figure')\n"
+            "layout.add_constraint(co.Box(), ('Figure',), ())\n"
+            "layout.add_constraint(co.Width(), ('Figure',), (5.0,))\n"
+            f"print(*[m for m in {HEAVY_MODULES} if m in sys.modules])\n"
+        )
+        assert run_python(code).strip() == ""
+
+
+class TestLazyModule:
+
+    def test_load(self):
+        module = lazy.LazyModule("json")
+        assert module.dumps([1]) == "[1]"
+        assert module.is_loaded
+
+    def test_on_load(self):
+        loaded = []
+        lazy.on_load("json", loaded.append)
+        assert len(loaded) == 1
+
+    def test_pytree_registration(self):
+        import jax
+
+        # If primitives are registered, every primitive value should be a leaf
+        prim = pr.Quadrilateral()
+        leaves = jax.tree_util.tree_leaves(prim)
+        assert all(isinstance(leaf, np.ndarray) for leaf in leaves)
+        assert len(leaves) == len(cn.flatten("", prim))
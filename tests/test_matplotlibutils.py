@@ -0,0 +1,303 @@
+"""
+Test `matplotlibutils`
+"""
+
+import pytest
+
+import numpy as np
+from matplotlib import pyplot as plt
+
+from mpllayout import primitives as pr
+from mpllayout import constraints as co
+from mpllayout import layout as lay
+from mpllayout import matplotlibutils as mputils
+from mpllayout import solver
+
+
+def plot_line(fig, axs, slope):
+    # Module level plotting function for batch rendering (see `TestRender`)
+    axs["Axes"].plot([0, 1], [0, slope])
+
+def make_axes_layout():
+    # A single axes with x/y axis thickness constraints in a figure
+    layout = lay.Layout()
+    layout.add_prim(pr.Quadrilateral(), "Figure")
+    layout.add_prim(pr.Axes(xaxis=True, yaxis=True), "Axes")
+
+    layout.add_constraint(co.Box(), ("Figure",), ())
+    layout.add_constraint(co.Fix(), ("Figure/Line0/Point0",), (np.array([0, 0]),))
+    layout.add_constraint(co.Width(), ("Figure",), (4.0,))
+    layout.add_constraint(co.Height(), ("Figure",), (3.0,))
+
+    for key in ("Frame", "XAxis", "YAxis"):
+        layout.add_constraint(co.Box(), (f"Axes/{key}",), ())
+    layout.add_constraint(co.PositionXAxis(side="bottom"), ("Axes",), ())
+    layout.add_constraint(co.PositionYAxis(side="left"), ("Axes",), ())
+    layout.add_constraint(co.XAxisThickness(), ("Axes/XAxis",), (None,))
+    layout.add_constraint(co.YAxisThickness(), ("Axes/YAxis",), (None,))
+
+    # Set margins around the axis bounding boxes
+    layout.add_constraint(co.InnerMargin(side="bottom"), ("Axes/XAxis", "Figure"), (0.1,))
+    layout.add_constraint(co.InnerMargin(side="left"), ("Axes/YAxis", "Figure"), (0.1,))
+    layout.add_constraint(co.InnerMargin(side="top"), ("Axes/Frame", "Figure"), (0.1,))
+    layout.add_constraint(co.InnerMargin(side="right"), ("Axes/Frame", "Figure"), (0.1,))
+    return layout
+
+class TestAxisThickness:
+
+    @pytest.fixture()
+    def layout(self):
+        return make_axes_layout()
+
+    def test_solve_axis_thickness(self, layout: lay.Layout):
+        root_prim, _ = solver.solve(layout)
+        fig, axs = mputils.subplots(root_prim)
+        axs["Axes"].plot(np.linspace(0, 1000, 10), np.linspace(0, 1e5, 10))
+
+        layout, root_prim, info = mputils.solve_axis_thickness(layout, fig, axs)
+        print(info["thickness_errs"])
+        assert info["thickness_errs"][-1] < 1e-3
+
+        # The axis primitive thickness should match the `matplotlib` axis
+        xaxis_height = mputils.width_and_height_from_quad(root_prim["Axes/XAxis"])[1]
+        yaxis_width = mputils.width_and_height_from_quad(root_prim["Axes/YAxis"])[0]
+        renderer = fig.canvas.get_renderer()
+        xaxis = axs["Axes"].xaxis
+        yaxis = axs["Axes"].yaxis
+        assert np.isclose(
+            xaxis_height, co.get_axis_thickness(xaxis, "bottom", renderer), atol=1e-3
+        )
+        assert np.isclose(
+            yaxis_width, co.get_axis_thickness(yaxis, "left", renderer), atol=1e-3
+        )
+
+        with pytest.raises(ValueError):
+            mputils.solve_axis_thickness(layout, fig, axs, max_thickness_iter=0)
+        plt.close(fig)
+
+    def test_axis_thickness_measurer(self, layout: lay.Layout):
+        root_prim, _ = solver.solve(layout)
+        fig, axs = mputils.subplots(root_prim)
+        axs["Axes"].plot(np.linspace(0, 1000, 10), np.linspace(0, 1e5, 10))
+
+        measurer = mputils.AxisThicknessMeasurer.from_layout(layout, fig, axs)
+        thicknesses = measurer.measure()
+
+        # Measurements should match the figure canvas renderer
+        renderer = fig.canvas.get_renderer()
+        ax = axs["Axes"]
+        ref_thicknesses = {
+            "XAxisThickness0": co.get_axis_thickness(ax.xaxis, "bottom", renderer),
+            "YAxisThickness0": co.get_axis_thickness(ax.yaxis, "left", renderer),
+        }
+        assert thicknesses.keys() == ref_thicknesses.keys()
+        for key, thickness in thicknesses.items():
+            assert np.isclose(thickness, ref_thicknesses[key])
+
+        # A new measurer sharing the text cache (with a new renderer) shouldn't
+        # measure any new text
+        text_cache = measurer.text_cache
+        num_misses = text_cache.misses
+        measurer = mputils.AxisThicknessMeasurer.from_layout(
+            layout, fig, axs, text_cache
+        )
+        assert measurer.measure() == thicknesses
+        print(text_cache.hits, text_cache.misses)
+        assert text_cache.misses == num_misses
+        assert text_cache.hits > 0
+        plt.close(fig)
+
+class TestUpdateSubplots:
+
+    @pytest.fixture(params=[(1, 1), (4, 5)])
+    def axes_shape(self, request):
+        return request.param
+
+    @pytest.fixture()
+    def root_prim(self, axes_shape: tuple[int, int]):
+        layout = lay.Layout()
+        layout.add_prim(pr.Quadrilateral(), "Figure")
+        self.set_quad(layout.root_prim["Figure"], self.box_coords(0, 0, 10, 8))
+
+        # Add randomly placed axes with x/y axes on random sides
+        rng = np.random.default_rng(0)
+        num_axes = int(np.prod(axes_shape))
+        for n in range(num_axes):
+            layout.add_prim(pr.Axes(xaxis=True, yaxis=True), f"Axes{n}")
+            axes = layout.root_prim[f"Axes{n}"]
+
+            x0, y0 = rng.uniform(1, 7, size=2)
+            x1, y1 = (x0, y0) + rng.uniform(0.5, 2, size=2)
+            self.set_quad(axes["Frame"], self.box_coords(x0, y0, x1, y1))
+
+            t = 0.3
+            xaxis_boxes = {
+                "bottom": (x0, y0-t, x1, y0), "top": (x0, y1, x1, y1+t)
+            }
+            yaxis_boxes = {
+                "left": (x0-t, y0, x0, y1), "right": (x1, y0, x1+t, y1)
+            }
+            for key, boxes in (("XAxis", xaxis_boxes), ("YAxis", yaxis_boxes)):
+                side = list(boxes.keys())[rng.integers(2)]
+                self.set_quad(axes[key], self.box_coords(*boxes[side]))
+                axes[f"{key}Label"].value[:] = rng.uniform(0, 8, size=2)
+        return layout.root_prim
+
+    @staticmethod
+    def box_coords(x0, y0, x1, y1):
+        return np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1]])
+
+    @staticmethod
+    def set_quad(quad: pr.Quadrilateral, coords):
+        for n, coord in enumerate(coords):
+            quad[f"Line{n}/Point0"].value[:] = coord
+
+    def test_subplots_without_axis_prims(self):
+        layout = lay.Layout()
+        layout.add_prim(pr.Quadrilateral(), "Figure")
+        layout.add_prim(pr.Axes(), "Axes")
+        fig, axs = mputils.subplots(layout.root_prim)
+        assert np.allclose(axs["Axes"].get_position().bounds, (0, 0, 1, 1))
+        plt.close(fig)
+
+    def test_subplots_rectangles(self):
+        layout = lay.Layout()
+        layout.add_prim(pr.Rectangle([0, 0, 10, 8]), "Figure")
+        layout.add_prim(pr.Axes(prims=(pr.Rectangle([1, 2, 4, 2]),)), "Axes")
+
+        frame = layout.root_prim["Axes/Frame"]
+        fig_size = np.array((10, 8))
+        rect = mputils.rect_from_box(frame, np.zeros(2), fig_size)
+        assert np.allclose(rect, (0.1, 0.25, 0.4, 0.25))
+
+        fig, axs = mputils.subplots(layout.root_prim)
+        assert np.allclose(fig.get_size_inches(), fig_size)
+        assert np.allclose(axs["Axes"].get_position().bounds, rect)
+        plt.close(fig)
+
+    def test_update_subplots(self, root_prim: pr.PrimitiveNode):
+        fig, axs = mputils.subplots(root_prim)
+
+        fig_quad = root_prim["Figure"]
+        fig_origin = fig_quad["Line0/Point0"].value
+        fig_size = np.array(mputils.width_and_height_from_quad(fig_quad))
+        assert np.allclose(fig.get_size_inches(), fig_size)
+
+        for key, ax in axs.items():
+            frame = root_prim[f"{key}/Frame"]
+            assert np.allclose(
+                ax.get_position().bounds,
+                mputils.rect_from_box(frame, fig_origin, fig_size)
+            )
+            for axis, prefix in zip((ax.xaxis, ax.yaxis), ("X", "Y")):
+                position = mputils.find_axis_position(
+                    frame, root_prim[f"{key}/{prefix}Axis"]
+                )
+                assert axis.get_ticks_position() == position
+                assert np.allclose(
+                    axis.label.get_position(),
+                    root_prim[f"{key}/{prefix}AxisLabel"].value / fig_size
+                )
+        plt.close(fig)
+
+class TestRender:
+
+    @pytest.fixture()
+    def root_prim(self):
+        root_prim, _ = solver.solve(make_axes_layout())
+        return root_prim
+
+    @pytest.mark.parametrize("num_workers", [0, 2])
+    def test_render_figures(self, root_prim, num_workers, tmp_path):
+        slopes = np.linspace(1, 2, 4)
+        paths = [tmp_path / f"fig{n}.png" for n in range(len(slopes))]
+        infos = mputils.render_figures(
+            root_prim, plot_line, slopes, paths, num_workers=num_workers
+        )
+
+        assert [info["index"] for info in infos] == list(range(len(slopes)))
+        for info, path in zip(infos, paths):
+            assert path.is_file()
+            assert info["path"] == str(path)
+            assert info["total_time"] >= info["plot_time"]
+
+    def test_iter_render_figures_bounded(self, root_prim, tmp_path):
+        num_items = 6
+        consumed = []
+        def iter_items():
+            for n in range(num_items):
+                consumed.append(n)
+                yield 1 + n/num_items
+
+        paths = [tmp_path / f"fig{n}.png" for n in range(num_items)]
+        infos = mputils.iter_render_figures(
+            root_prim, plot_line, iter_items(), paths, num_workers=1,
+            max_pending=2
+        )
+
+        # Items should only be submitted as results are consumed
+        assert next(infos)["index"] == 0
+        assert len(consumed) <= 2
+        assert [info["index"] for info in infos] == list(range(1, num_items))
+
+
+class TestFigurePool:
+
+    @pytest.fixture()
+    def root_prim(self):
+        root_prim, _ = solver.solve(make_axes_layout())
+        return root_prim
+
+    def test_subplots(self, root_prim):
+        pool = mputils.FigurePool()
+
+        ref_fig, ref_axs = mputils.subplots(root_prim)
+        fig, axs = mputils.subplots(root_prim, pool=pool)
+        axs["Axes"].plot([0, 1], [0, 1])
+        fig.suptitle("Title")
+        pool.release(fig)
+        assert len(pool) == 1
+
+        # Reused figures should be cleared and positioned like new figures
+        reused_fig, reused_axs = mputils.subplots(root_prim, pool=pool)
+        assert reused_fig is fig
+        assert pool.num_created == 1 and pool.num_reused == 1
+        assert len(reused_axs["Axes"].lines) == 0
+        assert len(reused_fig.texts) == 0
+        assert np.allclose(reused_fig.get_size_inches(), ref_fig.get_size_inches())
+        assert np.allclose(
+            reused_axs["Axes"].get_position().bounds,
+            ref_axs["Axes"].get_position().bounds
+        )
+
+        # Pool figures shouldn't be registered with `pyplot`
+        assert all(plt.figure(num) is not fig for num in plt.get_fignums())
+        pool.release(reused_fig)
+        plt.close(ref_fig)
+
+    def test_subplots_extra_axes(self, root_prim):
+        pool = mputils.FigurePool()
+
+        # Axes added by plot functions shouldn't accumulate between renders
+        ref_bounds = None
+        for n in range(2):
+            with pool.figure(root_prim) as (fig, axs):
+                ax = axs["Axes"]
+                if ref_bounds is None:
+                    ref_bounds = ax.get_position().bounds
+                assert np.allclose(ax.get_position().bounds, ref_bounds)
+                assert fig.axes == list(axs.values())
+                assert len(ax.child_axes) == 0
+
+                image = ax.imshow(np.eye(2))
+                fig.colorbar(image, ax=ax)
+                ax.twinx()
+                ax.inset_axes([0.5, 0.5, 0.2, 0.2])
+        assert pool.num_reused == 1
+
+    def test_figure_context(self, root_prim):
+        pool = mputils.FigurePool(max_size=1)
+        with pool.figure(root_prim) as (fig_a, _):
+            with pool.figure(root_prim) as (fig_b, _):
+                assert fig_a is not fig_b
+        assert len(pool) == 1
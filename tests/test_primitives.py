@@ -12,6 +12,7 @@ from pprint import pprint
 import numpy as np
 
 from mpllayout import primitives as pr
+from mpllayout import containers as cn
 
 
 class TestPrimitives:
@@ -28,6 +29,99 @@ class TestPrimitives:
     def test_Polygon(self):
         poly = pr.Polygon()
 
+    def test_Rectangle(self):
+        rect = pr.Rectangle([1.0, 2.0, 3.0, 4.0])
+
+        verts = [rect[f"Line{n}/Point0"].value for n in range(4)]
+        assert np.all(np.array(verts) == [[1, 2], [4, 2], [4, 6], [1, 6]])
+        for n in range(4):
+            assert np.all(
+                rect[f"Line{n}/Point1"].value
+                == rect[f"Line{(n+1) % 4}/Point0"].value
+            )
+
+        # Rebuilt rectangles should derive children from the new value
+        root_prim = pr.PrimitiveNode(np.array(()), {})
+        root_prim.add_child("Rect", rect)
+        prim_to_idx, values = pr.filter_unique_values_from_prim(root_prim)
+        values[prim_to_idx["/Rect"]] = np.array([0.0, 0.0, 2.0, 1.0])
+        new_root_prim = pr.build_prim_from_unique_values(
+            cn.flatten("", root_prim), prim_to_idx, values
+        )
+        assert np.all(new_root_prim["Rect/Line1/Point1"].value == [2, 1])
+        children = pr.Rectangle.derive_children(np.array([0.0, 0.0, 2.0, 1.0]))
+        assert np.all(children["Line2"]["Point0"].value == [2, 1])
+
+    def test_RigidBlock(self):
+        template = pr.PrimitiveNode(np.array(()), {})
+        template.add_child("Quad", pr.Quadrilateral())
+        template.add_child("Rect", pr.Rectangle([1.0, 1.0, 2.0, 1.0]))
+        BlockType = pr.make_rigid_block_type(template, origin=[1.0, 0.0], scalable=True)
+
+        # The default block has the same geometry as the template
+        block = BlockType()
+        assert np.all(block.value == [1, 0, 1])
+        for key, prim in cn.iter_flat("", template):
+            if key != "":
+                assert np.all(block[key[1:]].value == prim.value)
+
+        # Child coordinates are scaled about the origin and translated
+        block = BlockType([2.0, 3.0, 2.0])
+        assert np.all(block["Quad/Line1/Point1"].value == [2, 5])
+        assert np.all(block["Rect"].value == [2, 5, 4, 2])
+        assert np.all(block["Rect/Line1/Point1"].value == [6, 7])
+
+        children = BlockType.derive_children(np.array([1.0, 0.0, 1.0]))
+        assert np.all(children["Rect"]["Line0/Point0"].value == [1, 1])
+
+    def test_filter_unique_values_Rectangle(self):
+        root_prim = pr.PrimitiveNode(np.array(()), {})
+        root_prim.add_child("Rect", pr.Rectangle())
+        root_prim.add_child("Quad", pr.Quadrilateral())
+
+        prim_to_idx, values = pr.filter_unique_values_from_prim(root_prim)
+        pprint(prim_to_idx)
+
+        # The rectangle children are derived so only the rectangle value is
+        # unique
+        rect_idx = prim_to_idx["/Rect"]
+        assert all(
+            idx == rect_idx
+            for key, idx in prim_to_idx.items() if key.startswith("/Rect/")
+        )
+        assert len(values) == 1 + 1 + (1 + 4 + 4)
+        assert sum(value.size for value in values) == 4 + 8
+
+    def test_filter_unique_values_merge(self):
+        root_prim = pr.PrimitiveNode(np.array(()), {})
+        root_prim.add_child("Rect", pr.Rectangle())
+        root_prim.add_child("QuadA", pr.Quadrilateral())
+        root_prim.add_child("QuadB", pr.Quadrilateral())
+        root_prim.add_child("Point", pr.Point([4.0, 2.0]))
+
+        _, values = pr.filter_unique_values_from_prim(root_prim)
+        merge_keys = [
+            # Points in a chain should merge into one value
+            ("/QuadA/Line1/Point0", "/QuadB/Line0/Point0"),
+            ("/QuadB/Line0/Point0", "/Point"),
+            # Derived points and primitives with different shapes aren't merged
+            ("/Rect/Line0/Point0", "/QuadA/Line0/Point0"),
+            ("/QuadA/Line0", "/QuadB/Line0/Point1"),
+        ]
+        prim_to_idx, merged_values = pr.filter_unique_values_from_prim(
+            root_prim, merge_keys
+        )
+        assert len(merged_values) == len(values) - 2
+
+        idx = prim_to_idx["/Point"]
+        assert prim_to_idx["/QuadA/Line1/Point0"] == idx
+        assert prim_to_idx["/QuadA/Line0/Point1"] == idx
+        assert prim_to_idx["/QuadB/Line0/Point0"] == idx
+        assert np.allclose(merged_values[idx], np.mean([[1, 0], [0, 0], [4, 2]], axis=0))
+
+        assert prim_to_idx["/Rect/Line0/Point0"] == prim_to_idx["/Rect"]
+        assert prim_to_idx["/QuadA/Line0"] != prim_to_idx["/QuadB/Line0/Point1"]
+
     def test_Primitive_jax_pytree(self):
         # breakpoint()
         from jax import tree_util
@@ -35,8 +129,10 @@ class TestPrimitives:
         point = pr.Point()
         line = pr.Line()
         quad = pr.Quadrilateral()
+        rect = pr.Rectangle()
+        block = pr.make_rigid_block_type(quad)()
 
-        for prim in (point, line, quad):
+        for prim in (point, line, quad, rect, block):
             print(f"\nTesting primitive type {type(prim).__name__}")
             leaves = tree_util.tree_leaves(prim)
             print("Leaves:", leaves)
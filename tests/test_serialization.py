@@ -0,0 +1,184 @@
+"""
+Test `serialization`
+"""
+
+import pytest
+
+import io
+import sys
+import subprocess
+from timeit import timeit
+
+import numpy as np
+
+from mpllayout import primitives as pr
+from mpllayout import constraints as co
+from mpllayout import containers as cn
+from mpllayout import layout as lay
+from mpllayout import serialization as se
+from mpllayout import solver
+from mpllayout import cache
+
+
+class TestSerialization:
+
+    @pytest.fixture()
+    def layout(self):
+        layout = lay.Layout()
+        layout.add_prim(pr.Quadrilateral(), "Figure")
+        layout.add_prim(pr.Axes(xaxis=True, yaxis=True), "Axes")
+        layout.add_constraint(co.Box(), ("Figure",), ())
+        layout.add_constraint(co.Fix(), ("Figure/Line0/Point0",), (np.array([0, 0]),))
+        layout.add_constraint(co.Width(), ("Figure",), (6.0,))
+        layout.add_constraint(co.Height(), ("Figure",), (4,))
+        layout.add_constraint(co.Box(), ("Axes/Frame",), ())
+        for side in ("bottom", "top", "left", "right"):
+            layout.add_constraint(
+                co.InnerMargin(side=side), ("Axes/Frame", "Figure"), (0.5,)
+            )
+        layout.add_constraint(co.PositionXAxis(side="bottom"), ("Axes",), ())
+        layout.add_constraint(co.XAxisThickness(), ("Axes/XAxis",), (None,))
+        return layout
+
+    def assert_prims_equal(self, prim_a: pr.PrimitiveNode, prim_b: pr.PrimitiveNode):
+        flat_a = cn.flatten("", prim_a)
+        flat_b = cn.flatten("", prim_b)
+        assert len(flat_a) == len(flat_b)
+        for (key_a, type_a, value_a, ckeys_a), (key_b, type_b, value_b, ckeys_b) in zip(flat_a, flat_b):
+            assert key_a == key_b
+            assert type_a == type_b
+            assert np.all(value_a == value_b)
+            assert ckeys_a == ckeys_b
+
+    def test_prim_roundtrip(self, layout: lay.Layout):
+        root_prim = layout.root_prim
+
+        file = io.BytesIO()
+        se.save_prim(file, root_prim)
+        file.seek(0)
+        root_prim_load = se.load_prim(file)
+
+        self.assert_prims_equal(root_prim, root_prim_load)
+
+        # Check that shared primitive values are still shared
+        _, values = pr.filter_unique_values_from_prim(root_prim)
+        _, values_load = pr.filter_unique_values_from_prim(root_prim_load)
+        assert len(values) == len(values_load)
+
+        N = 100
+        arrays = se.encode_prim(root_prim)
+        duration = timeit(lambda: se.decode_prim(arrays), number=N)
+        print(f"Decoding duration: {duration/N: .2e} s")
+
+    def test_layout_roundtrip(self, layout: lay.Layout):
+        file = io.BytesIO()
+        se.save_layout(file, layout)
+        file.seek(0)
+        layout_load = se.load_layout(file, layout.root_constraint)
+
+        self.assert_prims_equal(layout.root_prim, layout_load.root_prim)
+        assert layout.root_constraint.keys() == layout_load.root_constraint.keys()
+
+        # Check the stored layout has the same residual
+        res = np.concatenate(
+            solver.assem_constraint_residual(layout.root_prim, *layout.flat_constraints())
+        )
+        res_load = np.concatenate(
+            solver.assem_constraint_residual(layout_load.root_prim, *layout_load.flat_constraints())
+        )
+        assert np.all(np.isclose(res, res_load))
+
+    def assert_params_equal(self, param_a, param_b):
+        assert type(param_a) is type(param_b)
+        if isinstance(param_a, (list, tuple)):
+            assert len(param_a) == len(param_b)
+            for item_a, item_b in zip(param_a, param_b):
+                self.assert_params_equal(item_a, item_b)
+        elif isinstance(param_a, (np.ndarray, np.generic)):
+            assert param_a.dtype == param_b.dtype
+            assert np.all(param_a == param_b)
+        else:
+            assert param_a == param_b
+
+    def test_layout_params_roundtrip(self, layout: lay.Layout):
+        for n in range(4):
+            layout.add_prim(pr.Quadrilateral(), f"Quad{n}")
+        layout.add_constraint(
+            co.Grid((2, 2)), tuple(f"Quad{n}" for n in range(4)),
+            ((1,), [2], [np.float64(0.25)], (0.5,))
+        )
+        layout.add_constraint(co.Width(), ("Quad0",), (2,))
+
+        file = io.BytesIO()
+        se.save_layout(file, layout)
+        file.seek(0)
+        layout_load = se.load_layout(file, layout.root_constraint)
+
+        # Parameter types (not just values) should be restored
+        *_, params = layout.flat_constraints()
+        *_, params_load = layout_load.flat_constraints()
+        assert len(params) == len(params_load)
+        for param, param_load in zip(params, params_load):
+            self.assert_params_equal(param, param_load)
+
+        assert cache.fingerprint(layout) == cache.fingerprint(layout_load)
+
+    def test_format_version(self, layout: lay.Layout):
+        file = io.BytesIO()
+        np.savez(file, format_version=se.FORMAT_VERSION+1, **se.encode_prim(layout.root_prim))
+        file.seek(0)
+        with pytest.raises(ValueError):
+            se.load_prim(file)
+
+    def test_unknown_prim_type(self, layout: lay.Layout):
+        arrays = se.encode_prim(layout.root_prim)
+        arrays["prim_types"] = np.array(["os:system"] + list(arrays["prim_types"][1:]))
+        with pytest.raises(ValueError):
+            se.decode_prim(arrays)
+
+        with pytest.raises(TypeError):
+            se.register_prim_type(dict)
+
+    def test_non_numeric_param(self, layout: lay.Layout):
+        layout.add_constraint(co.Width(), ("Axes/Frame",), ("wide",))
+        with pytest.raises(TypeError):
+            se.save_layout(io.BytesIO(), layout)
+
+    def test_rigid_block_roundtrip(self, tmp_path):
+        template = pr.PrimitiveNode(np.array(()), {})
+        template.add_child("Quad", pr.Quadrilateral())
+        template.add_child("Rect", pr.Rectangle([1.0, 1.0, 2.0, 1.0]))
+        BlockType = pr.make_rigid_block_type(template, origin=[1.0, 0.0], scalable=True)
+
+        OtherType = pr.make_rigid_block_type(template)
+
+        root_prim = pr.PrimitiveNode(np.array(()), {})
+        root_prim.add_child("Block", BlockType([2.0, 3.0, 2.0]))
+        root_prim.add_child("Group", pr.PrimitiveNode(np.array(()), {}))
+        root_prim.add_child("Group/Inner", BlockType([0.5, 0.5, 2.0]))
+        root_prim.add_child("Group/Other", OtherType([1.0, 1.0]))
+
+        path = tmp_path / "blocks.npz"
+        se.save_prim(path, root_prim)
+        root_prim_load = se.load_prim(path)
+        self.assert_prims_equal(root_prim, root_prim_load)
+        assert type(root_prim_load["Block"]) is BlockType
+        assert type(root_prim_load["Group/Inner"]) is BlockType
+        assert type(root_prim_load["Group/Other"]) is OtherType
+
+        # Block types should be rebuilt in a process that never created them
+        code = (
+            "from mpllayout import serialization as se\n"
+            f"root_prim = se.load_prim({str(path)!r})\n"
+            "print(type(root_prim['Group/Inner']).__name__)\n"
+            "print(*root_prim['Group/Inner/Rect'].value)\n"
+        )
+        proc = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        )
+        type_name, rect_value = proc.stdout.strip().split("\n")
+        assert type_name == BlockType.__name__
+        assert np.allclose(
+            [float(x) for x in rect_value.split()],
+            root_prim["Group/Inner/Rect"].value
+        )
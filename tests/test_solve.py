@@ -5,9 +5,12 @@ Test `solver`
 import pytest
 
 import time
+import contextlib
+import concurrent.futures
 from pprint import pprint
 
 import numpy as np
+from scipy import sparse
 
 from mpllayout import primitives as pr
 from mpllayout import constraints as co
@@ -117,6 +120,73 @@ class TestPrimitiveTree:
         )
         return layout
 
+    @pytest.fixture()
+    def layout_rectangles(self, axes_shape):
+        layout = lay.Layout()
+
+        ## Create the figure rectangle
+        layout.add_prim(pr.Rectangle(), "Figure")
+        layout.add_constraint(
+            co.Fix(), ("Figure/Line0/Point0",), (np.array([0, 0]),)
+        )
+        layout.add_constraint(co.Width(), ("Figure",), (6,))
+        layout.add_constraint(co.Height(), ("Figure",), (3,))
+
+        ## Create the axes rectangles in a grid
+        num_row, num_col = axes_shape
+        num_axes = int(np.prod(axes_shape))
+        for n in range(num_axes):
+            layout.add_prim(pr.Axes(prims=(pr.Rectangle(),)), f"Axes{n}")
+
+        grid_param = (
+            (num_col - 1) * [1],
+            (num_row - 1) * [1],
+            (num_col - 1) * [1 / 16],
+            (num_row - 1) * [1 / 16],
+        )
+        layout.add_constraint(
+            co.Grid(axes_shape),
+            tuple(f"Axes{n}/Frame" for n in range(num_axes)),
+            grid_param
+        )
+
+        ## Constrain the grid margins
+        for side, axes_key in (
+            ("left", "Axes0"), ("top", "Axes0"),
+            ("right", f"Axes{num_axes-1}"), ("bottom", f"Axes{num_axes-1}")
+        ):
+            layout.add_constraint(
+                co.InnerMargin(side=side), (f"{axes_key}/Frame", "Figure"), (0.25,)
+            )
+        return layout
+
+    def test_solve_rectangles(self, layout_rectangles: lay.Layout, axes_shape):
+        layout = layout_rectangles
+        _, prim_values = pr.filter_unique_values_from_prim(layout.root_prim)
+        num_axes = int(np.prod(axes_shape))
+        assert sum(value.size for value in prim_values) == 4*(num_axes + 1)
+
+        prim_tree_n, solve_info = solver.solve(layout, profile=True)
+        pprint(solve_info["abs_errs"])
+        assert solve_info["abs_errs"][-1] < 1e-5
+
+        # The x and y coordinates of rectilinear layouts are independent
+        assert all(num_blocks >= 2 for num_blocks in solve_info["jac_num_blocks"])
+
+        # Margins between columns (relative to the last column) are 1/16 so
+        # the two right-most columns are 1/16 apart
+        num_row, num_col = axes_shape
+        x0_last = prim_tree_n[f"Axes{num_col-1}/Frame"].value[0]
+        x0, _, width, _ = prim_tree_n[f"Axes{num_col-2}/Frame"].value
+        assert np.isclose(x0_last - (x0 + width), 1/16, atol=1e-5)
+
+        # Child points are derived from the solved rectangle parameters
+        x0, y0, width, height = prim_tree_n["Figure"].value
+        assert np.allclose(
+            prim_tree_n["Figure/Line1/Point1"].value, (x0 + width, y0 + height)
+        )
+        assert np.allclose((width, height), (6, 3), atol=1e-5)
+
     def test_assem_constraint_residual(self, layout_grid: lay.Layout):
         layout = layout_grid
 
@@ -166,7 +236,7 @@ class TestPrimitiveTree:
         print(f"Duration {t1-t0:.2e} s")
 
     @pytest.fixture(
-        params=('newton', 'minimize')
+        params=('newton', 'newton-krylov', 'minimize')
     )
     def method(self, request):
         return request.param
@@ -184,3 +254,524 @@ class TestPrimitiveTree:
         }
         pprint(prim_keys_to_value)
         pprint(solve_info)
+
+    def test_solve_profile(self, layout: lay.Layout, method: str):
+        events = []
+        def hook(event, data):
+            events.append((event, data))
+
+        prim_tree_n, solve_info = solver.solve(
+            layout, method=method, max_iter=100, profile=True, hooks=[hook]
+        )
+        pprint(solve_info["phase_times"])
+
+        phase_times = solve_info["phase_times"]
+        for phase in ("flatten", "filter_unique_values", "trace", "compile", "write_back"):
+            assert len(phase_times[phase]) == 1
+        if method == 'newton':
+            num_iter = len(solve_info["abs_errs"])
+            for phase in ("residual", "jacobian", "lstsq"):
+                assert len(phase_times[phase]) == num_iter
+
+            num_param = len(np.concatenate(pr.filter_unique_values_from_prim(layout.root_prim)[1]))
+            assert all(shape[1] == num_param for shape in solve_info["jac_shape"])
+            assert len(solve_info["jac_rank"]) == num_iter
+            assert len(solve_info["jac_singular_values"]) == num_iter
+        elif method == 'newton-krylov':
+            num_iter = len(solve_info["abs_errs"])
+            for phase in ("residual", "krylov"):
+                assert len(phase_times[phase]) == num_iter
+            assert len(solve_info["krylov_iters"]) == num_iter
+
+            # The preconditioner is built on the first iteration then reused
+            rebuilds = solve_info["preconditioner_rebuilds"]
+            assert len(rebuilds) == num_iter and rebuilds[0]
+            assert len(phase_times["preconditioner"]) == sum(rebuilds)
+            assert len(solve_info["forcing_terms"]) == num_iter
+        else:
+            assert len(phase_times["objective"]) > 0
+
+        num_phase_events = sum(len(times) for times in phase_times.values())
+        assert len([event for event, _ in events if event == "phase"]) == num_phase_events
+
+    def test_solve_profile_memory(self, layout: lay.Layout, method: str):
+        events = []
+        def hook(event, data):
+            events.append((event, data))
+
+        _, solve_info = solver.solve(
+            layout, method=method, max_iter=100, profile_memory=True, hooks=[hook]
+        )
+        pprint(solve_info["phase_peak_bytes"])
+        pprint(solve_info["phase_live_buffer_bytes"])
+        pprint(solve_info["layout_memory"])
+
+        phase_times = solve_info["phase_times"]
+        for key in ("phase_peak_bytes", "phase_live_buffer_bytes"):
+            assert solve_info[key].keys() == phase_times.keys()
+            for phase, values in solve_info[key].items():
+                assert len(values) == len(phase_times[phase])
+                assert all(value >= 0 for value in values)
+
+        layout_memory = solve_info["layout_memory"]
+        assert layout_memory == layout.memory_info()
+        assert "live_node_counts" not in solve_info
+
+        phase_events = [data for event, data in events if event == "phase"]
+        assert all("peak_bytes" in data for data in phase_events)
+
+    def test_solve_count_live_nodes(self, layout: lay.Layout):
+        _, solve_info = solver.solve(layout, max_iter=100, count_live_nodes=True)
+        live_node_counts = solve_info["live_node_counts"]
+        for class_name, count in layout.memory_info()["prim_counts"].items():
+            assert live_node_counts[class_name] >= count
+
+    def test_solve_presolve(self, layout_grid: lay.Layout):
+        layout = layout_grid
+        layout.add_prim(pr.Point([1.0, 1.0]), "Corner")
+        layout.add_constraint(
+            co.Coincident(), ("Corner", "Axes0/Line3/Point0"), ()
+        )
+        layout.add_constraint(
+            co.CoincidentLines(), ("Axes1/Line3", "Axes1/Line3"), (False,)
+        )
+        prim_tree_n, solve_info = solver.solve(
+            layout, max_iter=100, profile=True, presolve=True
+        )
+        pprint(solve_info["presolve"])
+
+        # The 'Origin' and 'Corner' points are merged and the
+        # `CoincidentLines` constraint is always satisfied
+        assert solve_info["presolve"] == {
+            "num_merged_values": 2,
+            "num_dropped_constraints": 3,
+            "num_dropped_rows": 8,
+            "num_duplicate_constraints": 0,
+            "near_duplicate_constraints": [],
+            "num_pruned_values": 1,
+            "num_pruned_params": 0
+        }
+        assert np.all(prim_tree_n["Origin"].value == prim_tree_n["Figure/Line0/Point0"].value)
+        assert np.all(prim_tree_n["Corner"].value == prim_tree_n["Axes0/Line3/Point0"].value)
+
+        # Merging points is opt-in
+        _, solve_info = solver.solve(layout, max_iter=100)
+        assert solve_info["presolve"]["num_merged_values"] == 0
+        assert solve_info["presolve"]["num_dropped_constraints"] == 0
+
+    def test_solve_prune(self, layout: lay.Layout, method: str):
+        unused_quad = pr.Quadrilateral()
+        layout.add_prim(unused_quad, "Unused")
+        layout.add_prim(pr.Point([1.0, 2.0]), "Label")
+        layout.add_prim(pr.Point([3.0, 4.0]), "Anchor")
+        layout.add_constraint(co.Coincident(), ("Label", "Anchor"), ())
+
+        prim_tree_n, solve_info = solver.solve(
+            layout, method=method, max_iter=100, presolve=True
+        )
+        pprint(solve_info["presolve"])
+
+        # The root, 'Unused' quadrilateral values and merged 'Label' point
+        # aren't solved for
+        assert solve_info["presolve"]["num_pruned_values"] == 1 + 9 + 1
+        assert solve_info["presolve"]["num_pruned_params"] == 8 + 2
+        for key, prim in cn.iter_flat("Unused", unused_quad):
+            assert np.all(prim_tree_n[key].value == prim.value)
+        assert np.all(prim_tree_n["Label"].value == [2.0, 3.0])
+        assert np.all(prim_tree_n["Anchor"].value == [2.0, 3.0])
+
+    def test_solve_prune_default(self, layout: lay.Layout, method: str):
+        unused_quad = pr.Quadrilateral()
+        layout.add_prim(unused_quad, "Unused")
+
+        prim_tree_n, solve_info = solver.solve(layout, method=method, max_iter=100)
+        pprint(solve_info["presolve"])
+
+        # Unconstrained values are pruned without presolving
+        assert solve_info["presolve"]["num_merged_values"] == 0
+        assert solve_info["presolve"]["num_pruned_values"] == 1 + 9
+        assert solve_info["presolve"]["num_pruned_params"] == 8
+        for key, prim in cn.iter_flat("Unused", unused_quad):
+            assert np.all(prim_tree_n[key].value == prim.value)
+
+    def test_solve_duplicates(self, layout: lay.Layout, method: str):
+        layout.add_constraint(co.Box(), ("MyFavouriteBox",), ())
+        layout.add_constraint(co.Length(), ("MyFavouriteBox/Line0",), (5.0,))
+        layout.add_constraint(co.Length(), ("MyFavouriteBox/Line2",), (5.0,))
+        # Duplicates are dropped by default
+        prim_tree_n, solve_info = solver.solve(layout, method=method, max_iter=100)
+        pprint(solve_info["presolve"])
+
+        # The `Box` children and first `Length` are exact duplicates
+        assert solve_info["presolve"]["num_duplicate_constraints"] == 4 + 1
+        assert solve_info["presolve"]["num_dropped_rows"] == 4 + 1
+        assert solve_info["presolve"]["near_duplicate_constraints"] == []
+
+        layout.add_constraint(co.Length(), ("MyFavouriteBox/Line1",), (5.2,))
+        _, solve_info = solver.solve(layout, method=method, max_iter=1)
+        near_duplicates = solve_info["presolve"]["near_duplicate_constraints"]
+        assert len(near_duplicates) == 1
+
+        _, solve_info = solver.solve(
+            layout, method=method, max_iter=1, drop_duplicates=False
+        )
+        assert solve_info["presolve"]["num_duplicate_constraints"] == 0
+        assert solve_info["presolve"]["num_dropped_rows"] == 0
+
+    def test_solve_rectangles_block_triangular(self, layout_rectangles: lay.Layout):
+        layout = layout_rectangles
+        prim_tree_n, solve_info = solver.solve(
+            layout, profile=True, linear_solver='block_triangular'
+        )
+        pprint(solve_info["jac_max_block_size"])
+        assert solve_info["abs_errs"][-1] < 1e-5
+
+        # Rectangles are positioned constructively so they're solved in small
+        # blocks
+        assert max(solve_info["jac_max_block_size"]) <= 8
+
+        prim_tree_ref, _ = solver.solve(layout)
+        assert np.allclose(
+            prim_tree_n["Figure"].value, prim_tree_ref["Figure"].value, atol=1e-5
+        )
+
+    def test_solve_rectangles_newton_krylov(self, layout_rectangles: lay.Layout):
+        layout = layout_rectangles
+        prim_tree_n, solve_info = solver.solve(
+            layout, method='newton-krylov', max_iter=100, profile=True
+        )
+        pprint(solve_info["krylov_iters"])
+        pprint(solve_info["forcing_terms"])
+        assert solve_info["abs_errs"][-1] < 1e-5
+
+        # Inner solves are inexact, with at most the default `eta_max`
+        assert all(eta <= 0.9 for eta in solve_info["forcing_terms"])
+
+        prim_tree_ref, _ = solver.solve(layout)
+        assert np.allclose(
+            prim_tree_n["Figure"].value, prim_tree_ref["Figure"].value, atol=1e-5
+        )
+
+    def test_solve_krylov_options(self, layout: lay.Layout):
+        _, solve_info = solver.solve(
+            layout, method='newton-krylov', max_iter=3, profile=True,
+            krylov_options={"max_krylov_iter": 2, "rebuild_factor": 0.0}
+        )
+        assert all(num_iter <= 2 for num_iter in solve_info["krylov_iters"])
+        # Any LSMR iterations trigger a rebuild with a zero factor
+        assert all(solve_info["preconditioner_rebuilds"])
+
+        with pytest.raises(TypeError):
+            solver.solve(
+                layout, method='newton-krylov', krylov_options={"tol": 1e-3}
+            )
+
+    def test_solve_rigid_block(self):
+        sub_layout = lay.Layout()
+        sub_layout.add_prim(pr.Quadrilateral(), "Frame")
+        sub_layout.add_constraint(co.Box(), ("Frame",), ())
+        sub_layout.add_constraint(
+            co.Fix(), ("Frame/Line0/Point0",), (np.array([0, 0]),)
+        )
+        sub_layout.add_constraint(co.Width(), ("Frame",), (2.0,))
+        sub_layout.add_constraint(co.Height(), ("Frame",), (1.0,))
+        sub_layout.add_prim(pr.Rectangle(), "Inner")
+        for side in ("bottom", "top", "left", "right"):
+            sub_layout.add_constraint(
+                co.InnerMargin(side=side), ("Inner", "Frame"), (0.25,)
+            )
+        BlockType = solver.solve_rigid_block(
+            sub_layout, origin="Frame/Line0/Point0", scalable=True
+        )
+
+        layout = lay.Layout()
+        layout.add_prim(BlockType(), "BlockA")
+        layout.add_prim(BlockType(), "BlockB")
+        layout.add_constraint(
+            co.Fix(), ("BlockA/Frame/Line0/Point0",), (np.array([1, 2]),)
+        )
+        layout.add_constraint(co.Length(), ("BlockA/Frame/Line0",), (4.0,))
+        layout.add_constraint(
+            co.Fix(), ("BlockB/Inner/Line0/Point0",), (np.array([5, 5]),)
+        )
+        layout.add_constraint(co.Length(), ("BlockB/Frame/Line0",), (2.0,))
+
+        prim_tree_n, solve_info = solver.solve(layout, profile=True)
+        assert solve_info["abs_errs"][-1] < 1e-5
+
+        # Only block placements are solved for
+        assert solve_info["jac_shape"][-1] == (6, 6)
+        assert np.allclose(prim_tree_n["BlockA"].value, [1, 2, 2])
+        assert np.allclose(prim_tree_n["BlockA/Inner"].value, [1.5, 2.5, 3, 1])
+        assert np.allclose(prim_tree_n["BlockB"].value, [4.75, 4.75, 1])
+
+    @pytest.mark.parametrize("num_workers", [None, 2])
+    def test_solve_grid_schur(
+        self, layout_grid: lay.Layout, num_workers, monkeypatch
+    ):
+        # Worker threads should only be created once per solve
+        executors = []
+        class ThreadPoolExecutor(concurrent.futures.ThreadPoolExecutor):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                executors.append(self)
+        monkeypatch.setattr(
+            concurrent.futures, "ThreadPoolExecutor", ThreadPoolExecutor
+        )
+
+        prim_tree_n, solve_info = solver.solve(
+            layout_grid, max_iter=100, profile=True, linear_solver='schur',
+            num_workers=num_workers
+        )
+        pprint(solve_info["jac_interface_size"])
+        assert solve_info["abs_errs"][-1] < 1e-5
+        assert len(executors) == (0 if num_workers is None else 1)
+
+        # The axes are coupled through a few figure and margin parameters
+        assert max(solve_info["jac_num_blocks"]) > 1
+
+        prim_tree_ref, _ = solver.solve(layout_grid, max_iter=100)
+        for key in ("Axes0/Line0/Point0", "Axes0/Line1/Point1"):
+            assert np.allclose(
+                prim_tree_n[key].value, prim_tree_ref[key].value, atol=1e-5
+            )
+
+    @pytest.mark.parametrize(
+        "jac_chunk_size, jac_memory_budget", [(3, None), (None, 1), (None, 2**30)]
+    )
+    def test_solve_chunked_jacobian(
+        self, layout: lay.Layout, jac_chunk_size, jac_memory_budget
+    ):
+        prim_tree_n, solve_info = solver.solve(
+            layout, max_iter=100, profile=True,
+            jac_chunk_size=jac_chunk_size, jac_memory_budget=jac_memory_budget
+        )
+        num_param = solve_info["jac_shape"][0][1]
+        chunk_size, = solve_info["jac_chunk_size"]
+        # Picking the chunk size isn't part of the compile time
+        assert len(solve_info["phase_times"]["compile"]) == 1
+        assert (
+            "jac_chunk_size" in solve_info["phase_times"]
+        ) == (jac_memory_budget is not None)
+        if jac_chunk_size is not None:
+            assert chunk_size == jac_chunk_size
+        elif jac_memory_budget == 1:
+            assert chunk_size == 1
+        else:
+            assert chunk_size == num_param
+
+        prim_tree_ref, solve_info_ref = solver.solve(layout, max_iter=100)
+        assert len(solve_info["abs_errs"]) == len(solve_info_ref["abs_errs"])
+        for (_, prim), (_, prim_ref) in zip(
+            cn.iter_flat("", prim_tree_n), cn.iter_flat("", prim_tree_ref)
+        ):
+            assert np.allclose(prim.value, prim_ref.value)
+
+    @pytest.mark.parametrize("linear_solver", ['lstsq', 'block_triangular', 'schur'])
+    def test_solve_sparse_jacobian(self, layout: lay.Layout, linear_solver):
+        prim_tree_n, solve_info = solver.solve(
+            layout, max_iter=100, linear_solver=linear_solver,
+            jac_chunk_size=4, jac_sparse=True
+        )
+        prim_tree_ref, _ = solver.solve(
+            layout, max_iter=100, linear_solver=linear_solver
+        )
+        for (_, prim), (_, prim_ref) in zip(
+            cn.iter_flat("", prim_tree_n), cn.iter_flat("", prim_tree_ref)
+        ):
+            assert np.allclose(prim.value, prim_ref.value, atol=1e-5)
+
+        # Sparse storage needs chunked assembly
+        with pytest.raises(ValueError):
+            solver.solve(layout, jac_sparse=True)
+
+    def test_solve_no_profile(self, layout: lay.Layout, method: str):
+        _, solve_info = solver.solve(layout, method=method, max_iter=100)
+        assert "phase_times" not in solve_info
+
+
+class TestLinearSolve:
+
+    @pytest.fixture(params=[(0, True), (1, False), (2, True)])
+    def block_system(self, request):
+        seed, rank_deficient = request.param
+        rng = np.random.default_rng(seed)
+
+        # Assemble a block diagonal system with shuffled rows and columns
+        block_shapes = [(5, 4), (3, 2), (2, 3)]
+        num_row, num_col = np.sum(block_shapes, axis=0)
+        jac = np.zeros((num_row + 1, num_col + 1))
+        row, col = 0, 0
+        for m, n in block_shapes:
+            block = rng.normal(size=(m, n))
+            if rank_deficient:
+                block[:, -1] = block[:, 0]
+            jac[row:row+m, col:col+n] = block
+            row, col = row + m, col + n
+
+        jac = jac[rng.permutation(jac.shape[0])][:, rng.permutation(jac.shape[1])]
+        res = rng.normal(size=jac.shape[0])
+        return jac, res, len(block_shapes)
+
+    def test_solve_block_lstsq(self, block_system):
+        jac, res, num_blocks = block_system
+
+        x_ref, _, rank_ref, s_ref = np.linalg.lstsq(jac, res, rcond=None)
+        x, rank, s, _num_blocks = solver.solve_block_lstsq(jac, res)
+
+        assert _num_blocks == num_blocks
+        assert rank == rank_ref
+        assert np.allclose(x, x_ref)
+        assert np.allclose(s, s_ref)
+
+        # Sparse Jacobians give the same solution
+        x_sparse, rank_sparse, s_sparse, _ = solver.solve_block_lstsq(
+            sparse.csr_array(jac), res
+        )
+        assert rank_sparse == rank_ref
+        assert np.allclose(x_sparse, x_ref)
+        assert np.allclose(s_sparse, s_ref)
+
+    @pytest.fixture(params=[0, 1])
+    def block_triangular_system(self, request):
+        seed = request.param
+        rng = np.random.default_rng(seed)
+
+        # Build a block lower triangular system then permute rows/columns
+        block_sizes = (2, 3, 1, 2)
+        size = sum(block_sizes)
+        jac = np.zeros((size, size))
+        start = 0
+        for block_size in block_sizes:
+            stop = start + block_size
+            jac[start:stop, start:stop] = rng.normal(size=(block_size, block_size))
+            # Couple each block to the previous block
+            jac[start:stop, max(start-1, 0)] += rng.normal(size=block_size)
+            start = stop
+
+        jac = jac[rng.permutation(size)][:, rng.permutation(size)]
+        res = rng.normal(size=size)
+        return jac, res, block_sizes
+
+    def test_solve_block_triangular(self, block_triangular_system):
+        jac, res, block_sizes = block_triangular_system
+
+        blocks = solver.find_block_triangular_order(jac)
+        assert sorted(cols.size for _, cols in blocks) == sorted(block_sizes)
+
+        # Each block only depends on columns of itself and earlier blocks
+        solved_cols = np.zeros(jac.shape[1], dtype=bool)
+        for rows, cols in blocks:
+            solved_cols[cols] = True
+            assert np.all(jac[np.ix_(rows, np.flatnonzero(~solved_cols))] == 0)
+
+        x, _block_sizes = solver.solve_block_triangular(jac, res)
+        assert np.allclose(x, np.linalg.solve(jac, res))
+
+        x_sparse, _ = solver.solve_block_triangular(sparse.csr_array(jac), res)
+        assert np.allclose(x_sparse, x)
+
+
+    @pytest.fixture(params=[0, 1])
+    def bordered_system(self, request):
+        seed = request.param
+        rng = np.random.default_rng(seed)
+
+        # Build a bordered block diagonal system (subdomains coupled through a
+        # few interface columns) then permute rows/columns
+        num_sub, sub_shape, num_interface = 5, (6, 4), 2
+        num_row = num_sub*sub_shape[0] + num_interface
+        num_col = num_sub*sub_shape[1] + num_interface
+        jac = np.zeros((num_row, num_col))
+        for n in range(num_sub):
+            rows = slice(n*sub_shape[0], (n+1)*sub_shape[0])
+            cols = slice(n*sub_shape[1], (n+1)*sub_shape[1])
+            jac[rows, cols] = rng.normal(size=sub_shape)
+            jac[rows, -num_interface:] = rng.normal(size=(sub_shape[0], num_interface))
+        jac[-num_interface:, -num_interface:] = rng.normal(
+            size=(num_interface, num_interface)
+        )
+
+        jac = jac[rng.permutation(num_row)][:, rng.permutation(num_col)]
+        res = rng.normal(size=num_row)
+        return jac, res, num_sub, num_interface
+
+    @pytest.mark.parametrize("num_workers", [0, 2])
+    def test_solve_schur(self, bordered_system, num_workers):
+        if num_workers == 0:
+            executor_context = contextlib.nullcontext()
+        else:
+            executor_context = concurrent.futures.ThreadPoolExecutor(num_workers)
+
+        jac, res, num_sub, num_interface = bordered_system
+
+        subdomains, (interface_rows, interface_cols) = solver.partition_jacobian(jac)
+        assert len(subdomains) == num_sub
+        assert interface_cols.size == num_interface
+        for rows, cols in subdomains:
+            other_cols = np.setdiff1d(np.arange(jac.shape[1]), np.union1d(cols, interface_cols))
+            assert np.all(jac[np.ix_(rows, other_cols)] == 0)
+
+        with executor_context as executor:
+            x, _num_sub, _num_interface = solver.solve_schur(jac, res, executor)
+            x_sparse, *_ = solver.solve_schur(sparse.csr_array(jac), res, executor)
+        x_ref, *_ = np.linalg.lstsq(jac, res, rcond=None)
+        assert (_num_sub, _num_interface) == (num_sub, num_interface)
+        assert np.allclose(x, x_ref)
+        assert np.allclose(x_sparse, x_ref)
+
+    @pytest.mark.parametrize("chunk_size", [1, 3, 8])
+    @pytest.mark.parametrize("sparse_storage", [False, True])
+    def test_assem_chunked_jacobian(self, chunk_size, sparse_storage):
+        rng = np.random.default_rng(0)
+        mat = rng.normal(size=(6, 7))
+        mat[:, 2] = 0
+
+        def assem_jac_chunk(x, tangents):
+            # The residual `mat @ x**2` has the Jacobian `mat * 2*x`
+            return (mat * 2*x) @ tangents.T
+
+        x = rng.normal(size=7)
+        jac = solver.assem_chunked_jacobian(assem_jac_chunk, x, chunk_size, sparse_storage)
+        if sparse_storage:
+            assert jac.nnz == 6*6
+            jac = jac.toarray()
+        assert np.allclose(jac, mat * 2*x)
+
+    def test_make_block_jacobi(self):
+        rng = np.random.default_rng(0)
+
+        # Constraints couple neighbouring blocks in a chain so two colors
+        # separate the blocks
+        prim_graph = {f"/P{idx}": idx for idx in range(5)}
+        constraint_graph = [(f"P{idx}", f"P{idx+1}") for idx in range(4)]
+        is_free = np.ones(5, dtype=bool)
+        block_colors = solver.color_free_blocks(prim_graph, constraint_graph, is_free)
+        assert list(block_colors) == [0, 1, 0, 1, 0]
+
+        block_sizes = [2, 3, 1, 2, 2]
+        idx_bounds = np.cumsum([0] + block_sizes)
+        jac = np.zeros((3*len(constraint_graph), sum(block_sizes)))
+        for constraint_idx in range(len(constraint_graph)):
+            rows = slice(3*constraint_idx, 3*constraint_idx + 3)
+            cols = slice(idx_bounds[constraint_idx], idx_bounds[constraint_idx+2])
+            jac[rows, cols] = rng.normal(size=(3, cols.stop - cols.start))
+
+        num_products = 0
+        def jtj(x):
+            nonlocal num_products
+            num_products += 1
+            return jac.T @ (jac @ x)
+
+        precondition = solver.make_block_jacobi(jtj, block_sizes, block_colors)
+        # One normal product per color and block entry
+        assert num_products == 2 + 3
+
+        # Applying the preconditioner twice inverts each diagonal block
+        x = rng.normal(size=sum(block_sizes))
+        y = precondition(precondition(x))
+        for idx_start, idx_end in zip(idx_bounds[:-1], idx_bounds[1:]):
+            jac_block = jac[:, idx_start:idx_end]
+            assert np.allclose(
+                jac_block.T @ jac_block @ y[idx_start:idx_end], x[idx_start:idx_end]
+            )
@@ -0,0 +1,87 @@
+"""
+Test `ui`
+"""
+
+import pytest
+
+import time
+
+import numpy as np
+from matplotlib import pyplot as plt
+
+from mpllayout import primitives as pr
+from mpllayout import layout as lay
+from mpllayout import containers as cn
+from mpllayout import ui
+
+
+class TestPlotPrims:
+
+    @pytest.fixture(params=[(2, 2), (20, 20)])
+    def root_prim(self, request):
+        layout = lay.Layout()
+        num_row, num_col = request.param
+        for ii in range(num_row):
+            for jj in range(num_col):
+                layout.add_prim(pr.Axes(xaxis=True, yaxis=True), f"Axes{ii}_{jj}")
+
+        # Move axes to a grid (shared point values are only moved once)
+        moved_values = set()
+        for key, prim in cn.iter_flat("", layout.root_prim):
+            if isinstance(prim, pr.Point) and id(prim.value) not in moved_values:
+                ii, jj = (int(n) for n in key.strip("/").split("/")[0][4:].split("_"))
+                prim.value[:] = prim.value + 1.5*np.array([jj, ii])
+                moved_values.add(id(prim.value))
+        layout.add_prim(pr.Point([0, 0]), "Origin")
+        return layout.root_prim
+
+    def test_collect_prims(self):
+        quad = pr.Quadrilateral()
+        items = ui.collect_prims(quad, "Quad")
+        kinds = [item[0] for item in items]
+        assert kinds == ["polygon"] + 4*["line"]
+
+        _, coords, label, depth, _ = items[0]
+        assert coords.shape == (4, 2)
+        assert label == "/Quad"
+        assert depth == 0
+
+        # Labels past the maximum depth should be removed
+        items = ui.collect_prims(quad, "Quad", max_label_depth=0)
+        assert all(item[2] is None for item in items[1:])
+
+    def test_cull_overlapping_points(self):
+        points = np.array([[0, 0], [0.5, 0], [2, 0], [2, 0.9], [2, 1.5]])
+        is_kept = ui.cull_overlapping_points(points, 1.0)
+        assert list(is_kept) == [True, False, True, False, True]
+
+    def test_plot_prims(self, root_prim: pr.PrimitiveNode):
+        fig, ax = plt.subplots(1, 1, figsize=(8, 8))
+
+        time_start = time.perf_counter()
+        ui.plot_prims(ax, root_prim)
+        fig.canvas.draw()
+        duration = time.perf_counter() - time_start
+        print(f"Plotting took {duration:.2e} s with {len(ax.texts)} labels")
+
+        assert len(ax.collections) == 3
+
+        # All labels are drawn by default
+        num_labels = sum(
+            item[2] is not None
+            for key, prim in root_prim.items()
+            for item in ui.collect_prims(prim, key)
+        )
+        assert len(ax.texts) == num_labels
+        plt.close(fig)
+
+    def test_plot_prims_label_spacing(self, root_prim: pr.PrimitiveNode):
+        fig, ax = plt.subplots(1, 1, figsize=(8, 8))
+        ui.plot_prims(ax, root_prim)
+        num_labels = len(ax.texts)
+        ax.clear()
+
+        # Overlapping labels are culled if a spacing is given
+        ui.plot_prims(ax, root_prim, label_spacing=12.0)
+        assert 0 < len(ax.texts) < num_labels
+        plt.close(fig)